@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+'''Size and time of compact MathML against the normal output.
+
+For each ``spacing`` and ``mathml_encoding``, the sample corpus is
+converted with ``compact`` off and on, and the total UTF-8 bytes of the
+MathML and the time of ``convert_many()`` are printed.
+
+Usage: python benchmarks/bench_compact.py [-n COUNT] [-r REPEAT]
+'''
+import argparse
+import itertools
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from blahtex import Blahtex, BlahtexException
+import formulas
+
+
+def _accepted(items):
+    bt = Blahtex()
+    result = []
+    for latex, display_math in items:
+        try:
+            bt.convert(latex, display_math)
+        except BlahtexException:
+            continue
+        result.append((latex, display_math))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = _accepted(formulas.load_corpus())
+    items = [corpus[i % len(corpus)] for i in range(args.count)]
+    print('{:9s} {:8s} {:>12s} {:>12s} {:>7s} {:>10s} {:>10s}'.format(
+        'spacing', 'encoding', 'bytes', 'compact', 'ratio',
+        'us/item', 'compact'))
+    for spacing, encoding in itertools.product(Blahtex.SPACING,
+                                               Blahtex.ENCODING):
+        sizes, times = [], []
+        for compact in (False, True):
+            bt = Blahtex(spacing=spacing, mathml_encoding=encoding,
+                         compact=compact)
+            sizes.append(sum(len(m.encode('utf-8'))
+                             for m in bt.convert_many(items)))
+            best = min(timeit.repeat(lambda: bt.convert_many(items),
+                                     number=1, repeat=args.repeat))
+            times.append(best / args.count * 1e6)
+        print('{:9s} {:8s} {:12d} {:12d} {:7.3f} {:10.2f} {:10.2f}'.format(
+            spacing.name, encoding.name, sizes[0], sizes[1],
+            sizes[1] / sizes[0], times[0], times[1]))
+
+
+if __name__ == '__main__':
+    main()
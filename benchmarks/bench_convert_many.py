@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+'''Per-item overhead of Blahtex.convert_many() against a Python loop.
+
+Usage: python benchmarks/bench_convert_many.py [-n COUNT] [-r REPEAT]
+'''
+import argparse
+import timeit
+
+from blahtex import Blahtex
+
+FORMULAS = [
+    (r'\alpha', False),
+    (r'x^2 + y^2 = z^2', False),
+    (r'\frac{1}{2}', True),
+    (r'\sqrt{3} \pi', False),
+    (r'\sum_{k=1}^{n} k = \frac{n(n+1)}{2}', True),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    items = [FORMULAS[i % len(FORMULAS)] for i in range(args.count)]
+    bt = Blahtex()
+
+    def loop():
+        return [bt.convert(s, d) for s, d in items]
+
+    def batch():
+        return bt.convert_many(items)
+
+    assert loop() == batch()
+    for name, func in (('convert loop', loop), ('convert_many', batch)):
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('{:14s} {:10.0f} items/s {:8.2f} us/item'.format(
+            name, args.count / best, best / args.count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+'''Cold-start conversion time with and without a warmed SQLiteCache.
+
+Usage: python benchmarks/bench_disk_cache.py [-n COUNT]
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from blahtex import Blahtex
+from blahtex.cache import SQLiteCache
+
+
+def corpus(count):
+    for i in range(count):
+        yield r'\frac{x^{%d} + \alpha_{%d}}{\sqrt{y + %d}}' % (i, i % 7, i)
+
+
+def run(count, cache_path):
+    # A fresh converter (and cache connection) as a restarted process has.
+    start = time.perf_counter()
+    bt = Blahtex()
+    if cache_path is not None:
+        bt.set_cache(SQLiteCache(cache_path))
+    for latex in corpus(count):
+        bt.convert(latex)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'cache.db')
+        start = time.perf_counter()
+        SQLiteCache(path).warm(Blahtex(), corpus(args.count))
+        warm = time.perf_counter() - start
+        print('warm-up          {:8.3f} s'.format(warm))
+        for name, cache_path in (('cold, no cache', None),
+                                 ('cold, warm store', path)):
+            print('{:16s} {:8.3f} s'.format(name, run(args.count, cache_path)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+'''Conversion with a 50-macro preamble: prepended text against MacroSet.
+
+Usage: python benchmarks/bench_macros.py [-n COUNT] [-m MACROS]
+'''
+import argparse
+import random
+import time
+
+from blahtex import Blahtex
+
+
+def make_preamble(count):
+    return ''.join(r'\newcommand{\m%s}[1]{\frac{#1}{x_{%d}} + \sqrt{#1}}'
+                   % (chr(ord('a') + i // 26) + chr(ord('a') + i % 26), i)
+                   for i in range(count))
+
+
+def make_formulas(count, macros, seed=0):
+    rand = random.Random(seed)
+    names = [r'\m' + chr(ord('a') + i // 26) + chr(ord('a') + i % 26)
+             for i in range(macros)]
+    return [r'%s{y} + %s{z^{%d}}' % (rand.choice(names), rand.choice(names), i)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=10000)
+    parser.add_argument('-m', '--macros', type=int, default=50)
+    args = parser.parse_args()
+
+    preamble = make_preamble(args.macros)
+    formulas = make_formulas(args.count, args.macros)
+    bt = Blahtex()
+
+    start = time.perf_counter()
+    prepended = bt.convert_many([preamble + f for f in formulas])
+    elapsed_prepended = time.perf_counter() - start
+
+    start = time.perf_counter()
+    macros = bt.compile_macros(preamble)
+    compiled = bt.convert_many(formulas, macros=macros)
+    elapsed_compiled = time.perf_counter() - start
+
+    assert prepended == compiled
+    for name, elapsed in (('prepended', elapsed_prepended),
+                          ('MacroSet', elapsed_compiled)):
+        print('{:10s} {:8.3f} s {:8.2f} us/formula'.format(
+            name, elapsed, elapsed / args.count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
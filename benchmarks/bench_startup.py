@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+'''Start-up cost of blahtex in a fresh interpreter.
+
+Each run starts a new Python process and measures the time of
+``import blahtex``, of the first ``Blahtex()``, of the first conversion
+and of the whole process.  The minimum and the median of the runs are
+printed, with the modules loaded by ``import blahtex``.
+
+Usage: python benchmarks/bench_startup.py [-r RUNS] [-v]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# json is imported after the measures, as it loads modules blahtex may need.
+_SCRIPT = r'''
+import sys, time
+before = set(sys.modules)
+t0 = time.perf_counter()
+import blahtex
+t1 = time.perf_counter()
+bt = blahtex.Blahtex()
+t2 = time.perf_counter()
+bt.convert(r'\frac{1}{2}')
+t3 = time.perf_counter()
+modules = sorted(set(sys.modules) - before)
+import json
+print(json.dumps({
+    'import': t1 - t0, 'construct': t2 - t1, 'first_convert': t3 - t2,
+    'modules': modules}))
+'''
+
+_PHASES = ('import', 'construct', 'first_convert', 'process')
+
+
+def _run():
+    start = time.perf_counter()
+    out = subprocess.check_output([sys.executable, '-c', _SCRIPT])
+    result = json.loads(out.decode('utf-8'))
+    result['process'] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--runs', type=int, default=20)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list the modules loaded by import blahtex')
+    args = parser.parse_args()
+
+    if os.environ.get('PYTHONDONTWRITEBYTECODE'):
+        print('warning: PYTHONDONTWRITEBYTECODE is set; '
+              'import times include compiling', file=sys.stderr)
+    _run() # write .pyc files and warm the file cache
+    results = [_run() for _ in range(args.runs)]
+    for phase in _PHASES:
+        times = [r[phase] for r in results]
+        print('{:14s} min {:8.2f} ms  median {:8.2f} ms'.format(
+            phase, min(times) * 1e3, statistics.median(times) * 1e3))
+    modules = results[0]['modules']
+    print('{:14s} {}'.format('modules', len(modules)))
+    if args.verbose:
+        for name in modules:
+            print('  ' + name)
+
+
+if __name__ == '__main__':
+    main()
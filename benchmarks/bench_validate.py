@@ -0,0 +1,49 @@
+#! /usr/bin/env python3
+'''Blahtex.validate() against convert() on the sample corpus.
+
+Usage: python benchmarks/bench_validate.py [-n COUNT] [-r REPEAT]
+'''
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from blahtex import Blahtex, BlahtexException
+import formulas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = formulas.load_corpus()
+    items = [corpus[i % len(corpus)] for i in range(args.count)]
+    bt = Blahtex()
+
+    def convert():
+        for latex, display_math in items:
+            try:
+                bt.convert(latex, display_math)
+            except BlahtexException:
+                pass
+
+    def validate():
+        for latex, display_math in items:
+            bt.validate(latex, display_math)
+
+    def validate_many():
+        bt.validate_many(items)
+
+    for name, func in (('convert', convert), ('validate', validate),
+                       ('validate_many', validate_many)):
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print('{:14s} {:10.0f} items/s {:8.2f} us/item'.format(
+            name, args.count / best, best / args.count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
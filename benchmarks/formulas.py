@@ -0,0 +1,147 @@
+'''Seeded generator of synthetic formulas, by formula class.
+
+The same seed always gives the same formulas, so timings of different
+runs (and different builds) are measured on the same input.
+
+>> from formulas import generate
+>> generate('fractions', 100, seed=1)
+'''
+import os
+import random
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'corpus', 'sample.tex')
+
+_SYMBOLS = [r'\alpha', r'\beta', r'\gamma', r'\delta', r'\epsilon',
+            r'\theta', r'\lambda', r'\mu', r'\pi', r'\sigma', r'\omega',
+            r'\Gamma', r'\Delta', r'\Omega', r'\infty', r'\partial',
+            r'\nabla', 'x', 'y', 'z', 'a', 'b', 'n', '1', '2', '3']
+_RELATIONS = ['=', '<', '>', r'\le', r'\ge', r'\ne', r'\approx', r'\sim']
+_OPERATORS = ['+', '-', r'\cdot', r'\times', r'\pm']
+
+
+def _term(rand):
+    symbol = rand.choice(_SYMBOLS)
+    r = rand.random()
+    if r < 0.3:
+        return '%s^{%s}' % (symbol, rand.choice(_SYMBOLS))
+    if r < 0.5:
+        return '%s_{%s}' % (symbol, rand.choice(_SYMBOLS))
+    return symbol
+
+
+def _expression(rand, terms):
+    parts = [_term(rand)]
+    for _ in range(terms - 1):
+        parts.append(rand.choice(_OPERATORS))
+        parts.append(_term(rand))
+    return ' '.join(parts)
+
+
+def symbols(rand):
+    '''Flat sequence of symbols, operators and relations.'''
+    return '%s %s %s' % (_expression(rand, rand.randint(3, 8)),
+                         rand.choice(_RELATIONS),
+                         _expression(rand, rand.randint(1, 4)))
+
+
+def fractions(rand):
+    '''Sums of fractions, some of them nested.'''
+    parts = []
+    for _ in range(rand.randint(2, 5)):
+        num = _expression(rand, rand.randint(1, 3))
+        den = _expression(rand, rand.randint(1, 3))
+        if rand.random() < 0.3:
+            den = r'1 + \frac{%s}{%s}' % (den, _term(rand))
+        parts.append(r'\frac{%s}{%s}' % (num, den))
+    return ' + '.join(parts)
+
+
+def array(rand):
+    '''Large matrices written with the array environment.'''
+    rows, cols = rand.randint(8, 16), rand.randint(4, 8)
+    body = r' \\ '.join(' & '.join(_term(rand) for _ in range(cols))
+                        for _ in range(rows))
+    return r'\left(\begin{array}{%s}%s\end{array}\right)' % ('c' * cols, body)
+
+
+def align(rand):
+    '''Multi-line derivations written with the aligned environment.'''
+    rows = [r'%s &%s %s' % (_expression(rand, 2), rand.choice(_RELATIONS),
+                            _expression(rand, rand.randint(3, 6)))
+            for _ in range(rand.randint(6, 12))]
+    return r'\begin{aligned}%s\end{aligned}' % r' \\ '.join(rows)
+
+
+def nesting(rand):
+    '''Deeply nested roots, fractions, scripts and delimiters.'''
+    formula = _term(rand)
+    for _ in range(rand.randint(12, 24)):
+        r = rand.random()
+        if r < 0.25:
+            formula = r'\sqrt{%s}' % formula
+        elif r < 0.5:
+            formula = r'\frac{%s}{%s}' % (formula, _term(rand))
+        elif r < 0.75:
+            formula = r'\left(%s\right)^{%s}' % (formula, _term(rand))
+        else:
+            formula = '{%s}_{%s}' % (formula, _term(rand))
+    return formula
+
+
+def macros(rand):
+    '''Formulas using a chain of \\newcommand definitions.'''
+    count = rand.randint(4, 8)
+    defs = [r'\newcommand{\ma}[1]{\left\| #1 \right\|}']
+    names = [r'\ma']
+    for i in range(1, count):
+        name = r'\m' + chr(ord('a') + i)
+        defs.append(r'\newcommand{%s}[1]{{%s{#1}_{%s} + %s}}' % (
+            name, rand.choice(names), _term(rand), _term(rand)))
+        names.append(name)
+    body = ' + '.join('%s{%s}' % (rand.choice(names), _term(rand))
+                      for _ in range(rand.randint(3, 6)))
+    return ''.join(defs) + body
+
+
+def plane1(rand):
+    '''Letters output as plane-1 characters (\\mathfrak, \\mathbb).'''
+    letters = [chr(c) for c in range(ord('A'), ord('Z') + 1)]
+    parts = []
+    for _ in range(rand.randint(3, 8)):
+        word = ''.join(rand.choice(letters) for _ in range(rand.randint(1, 4)))
+        parts.append(r'\%s{%s}' % (rand.choice(('mathfrak', 'mathbb')), word))
+    return ' + '.join(parts)
+
+
+CLASSES = {f.__name__: f for f in
+           (symbols, fractions, array, align, nesting, macros, plane1)}
+
+
+def generate(kind: str, count: int, seed: int=0) -> list:
+    '''Generate ``count`` formulas of the class ``kind``.'''
+    rand = random.Random('%s:%d' % (kind, seed))
+    return [CLASSES[kind](rand) for _ in range(count)]
+
+
+def load_corpus(path: str=CORPUS) -> list:
+    '''Read a corpus file: one formula per line, ``%`` starts a comment.
+
+    A line starting with ``D `` is a formula in display style.
+
+    Returns
+    -------
+    list
+      ``(TeX-string, display_math)`` pairs.
+    '''
+    items = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('%'):
+                continue
+            if line.startswith('D '):
+                items.append((line[2:].strip(), True))
+            else:
+                items.append((line, False))
+    return items
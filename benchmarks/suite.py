@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+'''Benchmark suite: latency by formula class, throughput, construction, memory.
+
+Usage: python benchmarks/suite.py [-n COUNT] [-r REPEAT] [-s SEED]
+                                  [-o RESULTS.json] [-c BASELINE.json]
+
+Formulas are made by the seeded generator of formulas.py, plus the sample
+corpus in corpus/sample.tex. The results are written as JSON (schema
+below) and, with --compare, printed against the results of an earlier
+run. Times are in microseconds unless stated otherwise.
+
+    {"schema": 1, "meta": {...},
+     "construction": {"us": ...},
+     "latency": {CLASS: {"count", "errors", "mean", "median", "p90",
+                         "max"}, ...},
+     "throughput": {API: {"items_per_s", "us_per_item"}, ...},
+     "memory": {"traced_peak_bytes", "max_rss_bytes"}}
+'''
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import blahtex
+from blahtex import Blahtex, BlahtexException
+import formulas
+
+SCHEMA = 1
+
+
+def _quantile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(q * len(sorted_values)))]
+
+
+def measure_construction(repeat):
+    number = 1000
+    best = min(timeit.repeat(Blahtex, number=number, repeat=repeat))
+    return {'us': best / number * 1e6}
+
+
+def measure_latency(bt, items, repeat):
+    '''Best time of ``repeat`` conversions of each input.'''
+    times = []
+    errors = 0
+    for latex, display_math in items:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                bt.convert(latex, display_math)
+            except BlahtexException:
+                pass
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        try:
+            bt.convert(latex, display_math)
+        except BlahtexException:
+            errors += 1
+        times.append(best * 1e6)
+    times.sort()
+    return {'count': len(times), 'errors': errors,
+            'mean': statistics.mean(times),
+            'median': statistics.median(times),
+            'p90': _quantile(times, 0.9), 'max': times[-1]}
+
+
+def _convert_loop(bt, items):
+    results = []
+    for latex, display_math in items:
+        try:
+            results.append(bt.convert(latex, display_math))
+        except BlahtexException as e:
+            results.append(e)
+    return results
+
+
+def measure_throughput(bt, items, repeat, processes):
+    apis = [('convert', lambda: _convert_loop(bt, items)),
+            ('convert_many', lambda: bt.convert_many(items))]
+    pool = None
+    if processes:
+        from blahtex.parallel import ConverterPool
+        pool = ConverterPool(processes, blahtex=bt)
+        pool.map(items[:processes]) # start the workers
+        apis.append(('ConverterPool(%d)' % processes,
+                     lambda: pool.map(items)))
+    results = {}
+    try:
+        for name, func in apis:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            results[name] = {'items_per_s': len(items) / best,
+                             'us_per_item': best / len(items) * 1e6}
+    finally:
+        if pool is not None:
+            pool.close()
+    return results
+
+
+def measure_memory(items):
+    '''Peak memory of converting all inputs with a new Blahtex object.
+
+    ``traced_peak_bytes`` is the peak of Python allocations (the results)
+    seen by tracemalloc; ``max_rss_bytes`` is the peak resident size of
+    the process, which includes allocations of the native library.
+    '''
+    tracemalloc.start()
+    try:
+        Blahtex().convert_many(items)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    try:
+        import resource
+    except ImportError: # not on Windows
+        max_rss = None
+    else:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            max_rss *= 1024
+    return {'traced_peak_bytes': peak, 'max_rss_bytes': max_rss}
+
+
+def run(count, repeat, seed, classes, corpus, processes):
+    sets = [(kind, [(f, False) for f in formulas.generate(kind, count, seed)])
+            for kind in classes]
+    if corpus:
+        sets.append(('corpus', formulas.load_corpus(corpus)))
+    mixed = [item for _, items in sets for item in items]
+
+    bt = Blahtex()
+    bt.convert(r'\frac{1}{2}') # warm up
+    results = {
+        'schema': SCHEMA,
+        'meta': {
+            'blahtex': blahtex.__version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'count': count, 'repeat': repeat, 'seed': seed,
+            'corpus': os.path.basename(corpus) if corpus else None,
+        },
+        'construction': measure_construction(repeat),
+        'latency': {kind: measure_latency(bt, items, repeat)
+                    for kind, items in sets},
+        'throughput': measure_throughput(bt, mixed, repeat, processes),
+    }
+    # last, as the peak RSS never goes down
+    results['memory'] = measure_memory(mixed)
+    return results
+
+
+def _ratio(new, old):
+    return '{:7.2f}x'.format(new / old) if old else '      -'
+
+
+def report(results, baseline=None):
+    def base(*keys):
+        value = baseline
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    print('blahtex {blahtex}, Python {python} ({implementation}), '
+          '{platform}'.format(**results['meta']))
+    us = results['construction']['us']
+    old = base('construction', 'us')
+    print('{:24s} {:10.2f} us {}'.format(
+        'Blahtex()', us, _ratio(us, old) if old else ''))
+    print('latency (us)             {:>10s} {:>10s} {:>10s} {:>6s}'.format(
+        'median', 'p90', 'max', 'errors'))
+    for kind, r in results['latency'].items():
+        old = base('latency', kind, 'median')
+        print('  {:22s} {:10.2f} {:10.2f} {:10.2f} {:6d} {}'.format(
+            kind, r['median'], r['p90'], r['max'], r['errors'],
+            _ratio(r['median'], old) if old else ''))
+    print('throughput')
+    for api, r in results['throughput'].items():
+        old = base('throughput', api, 'items_per_s')
+        print('  {:22s} {:10.0f} items/s {:8.2f} us/item {}'.format(
+            api, r['items_per_s'], r['us_per_item'],
+            _ratio(r['items_per_s'], old) if old else ''))
+    memory = results['memory']
+    print('memory: traced peak {} bytes, max RSS {} bytes'.format(
+        memory['traced_peak_bytes'], memory['max_rss_bytes']))
+    if baseline is not None:
+        print('(ratios are against the baseline; above 1.00x is slower for '
+              'times and faster for throughput)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='formulas generated per class')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-k', '--classes', default=','.join(formulas.CLASSES),
+                        help='comma separated formula classes')
+    parser.add_argument('--corpus', default=formulas.CORPUS,
+                        help='corpus file, or empty for none')
+    parser.add_argument('-p', '--processes', type=int, default=0,
+                        help='also measure ConverterPool with this many '
+                             'processes')
+    parser.add_argument('-o', '--output', help='write results to this file')
+    parser.add_argument('-c', '--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    classes = [c for c in args.classes.split(',') if c]
+    for c in classes:
+        if c not in formulas.CLASSES:
+            parser.error('unknown formula class: ' + c)
+    results = run(args.count, args.repeat, args.seed, classes, args.corpus,
+                  args.processes)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -29,10 +29,107 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from . import _blahtex # type: ignore
-import enum
-import textwrap
+import collections
+
+# threading.local and threading.Lock are the ones of _thread; taking them
+# from _thread saves importing threading and functools with blahtex.
+try:
+    from _thread import _local as _thread_local, allocate_lock as _Lock
+except ImportError:
+    from threading import local as _thread_local, Lock as _Lock
 
 BlahtexException = _blahtex.BlahtexException
+LimitExceeded = _blahtex.LimitExceeded
+InputTooLong = _blahtex.InputTooLong
+TooManyTokens = _blahtex.TooManyTokens
+TooManyMacroExpansions = _blahtex.TooManyMacroExpansions
+NestingTooDeep = _blahtex.NestingTooDeep
+TooManyNodes = _blahtex.TooManyNodes
+DeadlineExceeded = _blahtex.DeadlineExceeded
+__version__ = _blahtex.__version__
+
+def _fingerprint(options: dict) -> str:
+    # Stable string identifying options, used as a part of cache keys.
+    import enum
+    items = []
+    for key in sorted(options):
+        value = options[key]
+        if isinstance(value, enum.Enum):
+            value = value.name
+        items.append('{}={!r}'.format(key, value))
+    return ';'.join(items)
+
+_STRING_TYPES = (str, bytes, bytearray, memoryview)
+
+# True for type checkers only, without importing typing. They see the
+# enums of Blahtex as declared classes, made by _LazyEnum at run time.
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    import enum
+
+class _LazyEnum(object):
+    # Class attribute turned into an enum.Enum on first access, so that
+    # importing blahtex and creating Blahtex objects do not import enum,
+    # which takes about as long as the rest of the import.
+    _lock = _Lock()
+
+    def __init__(self, name: str, members):
+        self._name = name
+        self._members = members
+        self._enum = None
+
+    def __get__(self, obj, cls):
+        if self._enum is None:
+            import enum
+            with _LazyEnum._lock:
+                if self._enum is None:
+                    self._enum = enum.Enum(
+                        self._name, self._members, module=__name__,
+                        qualname='Blahtex.' + self._name)
+        return self._enum
+
+ValidationResult = collections.namedtuple(
+    'ValidationResult', ['valid', 'code', 'arguments', 'position'])
+ValidationResult.__doc__ = '''Result of ``Blahtex.validate()``.
+
+valid
+    True if blahtex accepts the TeX-string.
+code, arguments
+    Error code and its arguments, as ``BlahtexException``; None and an
+    empty tuple if valid.
+position
+    Offset in the TeX-string of the token where the error is, or None if
+    it is not known.
+'''
+
+_VALID = ValidationResult(True, None, (), None)
+
+DedupInfo = collections.namedtuple(
+    'DedupInfo', ['items', 'conversions', 'ratio'])
+
+def canonical_key(latex) -> str:
+    '''Key of a TeX-string for finding duplicates.
+
+    TeX-strings with the same key give the same output. The key ignores
+    whitespace in math mode (not in ``\\text`` etc.) and braces around a
+    superscript or subscript of one letter or digit, so ``x ^ {2}`` and
+    ``x^2`` have the same key. It is itself a TeX-string equivalent to
+    latex. latex can also be given as bytes of UTF-8.
+    '''
+    return _blahtex.Blahtex.canonical_key(latex)
+
+def _to_str(latex) -> str:
+    # Input given as a buffer of UTF-8 is decoded for cache keys etc.
+    if isinstance(latex, str):
+        return latex
+    return bytes(latex).decode('utf-8')
+
+def _copy_exception(e: BlahtexException) -> BlahtexException:
+    # Cached exceptions are copied before raised, so that tracebacks are
+    # not accumulated on the cached instance.
+    copy = type(e)(*e.args)
+    copy.__dict__.update(e.__dict__)
+    return copy
 
 class Blahtex(object):
     '''
@@ -55,6 +152,15 @@ class Blahtex(object):
 
         Default is False.
 
+    compact: bool
+        Output of the smallest MathML rendered the same: no whitespace
+        between tags, no ``<mrow>`` around a single element or filling an
+        inferred ``<mrow>`` (of ``<math>``, ``<msqrt>``, ``<mtd>``, ...),
+        no ``mathvariant``/``fontstyle`` of the default value, and empty
+        elements closed by ``/>``. ``indented`` is ignored.
+
+        Default is False.
+
     texvc_compatibility: bool
         Enables use of commands thar are specific to texvc, but that are not
         standard TeX/LaTeX/AMS-LaTeX commands
@@ -128,144 +234,214 @@ class Blahtex(object):
         which are all deprecated in MathML 2.0.
 
         Default is False.
+
+    Threads
+    -------
+
+    A Blahtex object can be shared between threads. Every thread gets its
+    own native blahtex core, created on first use and configured from the
+    options of the object, and conversions run without holding the GIL,
+    so threads convert in parallel. The state set by ``process_input()``
+    is also per thread. Options should not be changed while other threads
+    are converting with the same object.
     '''
 
-    class ENCODING(enum.Enum):
-        RAW = 0
-        NUMERIC = 1
-        SHORT = 2
-        LONG = 3
+    if TYPE_CHECKING:
+        class ENCODING(enum.Enum):
+            RAW = 0
+            NUMERIC = 1
+            SHORT = 2
+            LONG = 3
+
+        class SPACING(enum.Enum):
+            STRICT = 0
+            MODERATE = 1
+            RELAXED = 2
+    else:
+        ENCODING = _LazyEnum('ENCODING', [
+            ('RAW', 0), ('NUMERIC', 1), ('SHORT', 2), ('LONG', 3)])
 
-    class SPACING(enum.Enum):
-        STRICT = 0
-        MODERATE = 1
-        RELAXED = 2
+        SPACING = _LazyEnum('SPACING', [
+            ('STRICT', 0), ('MODERATE', 1), ('RELAXED', 2)])
+
+    _OPTION_NAMES = (
+        "indented", "compact", "texvc_compatibility", "spacing",
+        "disallow_plane_1", "mathml_encoding", "other_encoding",
+        "mathml_version1_fonts",
+        "use_ucs_package", "use_cjk_package", "use_preview_package",
+        "japanese_font", "latex_preamble", "latex_before_math")
+
+    # Native core holding the default options, copied into new objects.
+    _defaults = None
+
+    @staticmethod
+    def _default_core():
+        core = Blahtex._defaults
+        if core is None:
+            # Same as disallow_plane_1=False, spacing=SPACING.RELAXED,
+            # mathml_encoding=ENCODING.RAW and other_encoding=ENCODING.RAW,
+            # set natively so that no enum is needed.
+            core = _blahtex.Blahtex()
+            core.mathml_options.allow_plane1 = True
+            core.encoding_options.allow_plane1 = True
+            core.mathml_options.spacing_control = \
+                _blahtex.MathmlOptions.SpacingControl.RELAXED
+            core.encoding_options.mathml_encoding = \
+                _blahtex.EncodingOptions.MathmlEncoding.RAW
+            core.encoding_options.other_encoding_raw = True
+            Blahtex._defaults = core
+        return core
 
     def __init__(self, **opts):
         '''Constructor.
 
         You can set options by keyword arguments.
         '''
-        super().__setattr__('_core', _blahtex.Blahtex())
-        super().__setattr__('_inputted', False)
-        o = {
-            "disallow_plane_1": False,
-            "spacing": self.SPACING.RELAXED,
-            "mathml_encoding": self.ENCODING.RAW,
-            "other_encoding": self.ENCODING.RAW,
-        }
-        o.update(opts)
-        self.set_options(o)
+        core = _blahtex.Blahtex()
+        core.copy_options(self._default_core())
+        super().__setattr__('_core', core)
+        super().__setattr__('_local', _thread_local())
+        super().__setattr__('_options_version', 0)
+        super().__setattr__('_fingerprint', (-1, None))
+        super().__setattr__('_cache', None)
+        super().__setattr__('_stats', None)
+        super().__setattr__('_stats_callback', None)
+        super().__setattr__('_limits', None)
+        super().__setattr__('_release_trees', False)
+        super().__setattr__('_dedup', None)
+        if opts:
+            self.set_options(opts)
+
+    def __reduce__(self):
+        # Only the options are pickled; the native cores are rebuilt.
+        return (self.__class__, (), self.get_options())
+
+    def __setstate__(self, state):
+        self.set_options(state)
 
     def __setattr__(self, key, value):
+        self._set_option(self._core, key, value)
+        super().__setattr__('_options_version', self._options_version + 1)
+
+    def __getattr__(self, key):
+        return self._get_option(self._core, key)
+
+    @staticmethod
+    def _set_option(core, key, value):
+        # core is a native Blahtex or Options object.
         if key == "indented":
-            self._core.indented = value
+            core.indented = value
+        elif key == "compact":
+            core.compact = value
         elif key == "texvc_compatibility":
-            self._core.texvc_compatibility = value
+            core.texvc_compatibility = value
         elif key == "spacing":
-            if value == self.SPACING.STRICT:
+            if value == Blahtex.SPACING.STRICT:
                 v = _blahtex.MathmlOptions.SpacingControl.STRICT
-            elif value == self.SPACING.MODERATE:
+            elif value == Blahtex.SPACING.MODERATE:
                 v = _blahtex.MathmlOptions.SpacingControl.MODERATE
-            elif value == self.SPACING.RELAXED:
+            elif value == Blahtex.SPACING.RELAXED:
                 v = _blahtex.MathmlOptions.SpacingControl.RELAXED
             else:
                 raise ValueError(
                     "spacing must be one of "
                     "Blahtex.SPACING.{STRICT,MODERATE,RELAXED}")
-            self._core.mathml_options.spacing_control = v
+            core.mathml_options.spacing_control = v
         elif key == "disallow_plane_1":
-            self._core.mathml_options.allow_plane1 = not value
-            self._core.encoding_options.allow_plane1 = not value
+            core.mathml_options.allow_plane1 = not value
+            core.encoding_options.allow_plane1 = not value
         elif key == "mathml_encoding":
-            if value == self.ENCODING.RAW:
+            if value == Blahtex.ENCODING.RAW:
                 v = _blahtex.EncodingOptions.MathmlEncoding.RAW
-            elif value == self.ENCODING.NUMERIC:
+            elif value == Blahtex.ENCODING.NUMERIC:
                 v = _blahtex.EncodingOptions.MathmlEncoding.NUMERIC
-            elif value == self.ENCODING.LONG:
+            elif value == Blahtex.ENCODING.LONG:
                 v = _blahtex.EncodingOptions.MathmlEncoding.LONG
-            elif value == self.ENCODING.SHORT:
+            elif value == Blahtex.ENCODING.SHORT:
                 v = _blahtex.EncodingOptions.MathmlEncoding.SHORT
             else:
                 raise ValueError(
                     "mathml_encoding must be one of "
                     "Blahtex.ENCODING.{RAW,NUMERIC,LONG,SHORT}")
-            self._core.encoding_options.mathml_encoding = v
+            core.encoding_options.mathml_encoding = v
         elif key == "other_encoding":
-            if value == self.ENCODING.RAW:
+            if value == Blahtex.ENCODING.RAW:
                 v = True
-            elif value == self.ENCODING.NUMERIC:
+            elif value == Blahtex.ENCODING.NUMERIC:
                 v = False
             else:
                 raise ValueError(
                     "other_encoding must be one of "
                     "Blahtex.ENCODING.{RAW,NUMERIC}")
-            self._core.encoding_options.other_encoding_raw = v
+            core.encoding_options.other_encoding_raw = v
         elif key == "mathml_version1_fonts":
-            self._core.mathml_options.use_version1_font_attributes = value
+            core.mathml_options.use_version1_font_attributes = value
         elif key == "use_ucs_package":
-            self._core.purified_tex_options.allow_ucs = value
+            core.purified_tex_options.allow_ucs = value
         elif key == "use_cjk_package":
-            self._core.purified_tex_options.allow_cjk = value
+            core.purified_tex_options.allow_cjk = value
         elif key == "use_preview_package":
-            self._core.purified_tex_options.allow_preview = value
+            core.purified_tex_options.allow_preview = value
         elif key == "japanese_font":
-            self._core.purified_tex_options.japanese_font = value
+            core.purified_tex_options.japanese_font = value
         elif key == "latex_preamble":
-            self._core.purified_tex_options.latex_preamble = value
+            core.purified_tex_options.latex_preamble = value
         elif key == "latex_before_math":
-            self._core.purified_tex_options.latex_before_math = value
+            core.purified_tex_options.latex_before_math = value
         else:
             raise ValueError("Unknown attribute '{}'".format(key))
-        
-    def __getattr__(self, key):
+
+    @staticmethod
+    def _get_option(core, key):
         if key == "indented":
-            return self._core.indented
+            return core.indented
+        elif key == "compact":
+            return core.compact
         elif key == "texvc_compatibility":
-            return self._core.texvc_compatibility
+            return core.texvc_compatibility
         elif key == "spacing":
-            v = self._core.mathml_options.spacing_control
+            v = core.mathml_options.spacing_control
             if v == _blahtex.MathmlOptions.SpacingControl.STRICT:
-                return self.SPACING.STRICT
+                return Blahtex.SPACING.STRICT
             elif v == _blahtex.MathmlOptions.SpacingControl.MODERATE:
-                return self.SPACING.MODERATE
+                return Blahtex.SPACING.MODERATE
             elif v == _blahtex.MathmlOptions.SpacingControl.RELAXED:
-                return self.SPACING.RELAXED
+                return Blahtex.SPACING.RELAXED
             else:
                 raise Exception()
         elif key == "disallow_plane_1":
-            return not self._core.mathml_options.allow_plane1
+            return not core.mathml_options.allow_plane1
         elif key == "mathml_encoding":
-            v = self._core.encoding_options.mathml_encoding
+            v = core.encoding_options.mathml_encoding
             if v == _blahtex.EncodingOptions.MathmlEncoding.RAW:
-                return self.ENCODING.RAW
+                return Blahtex.ENCODING.RAW
             elif v == _blahtex.EncodingOptions.MathmlEncoding.NUMERIC:
-                return self.ENCODING.NUMERIC
+                return Blahtex.ENCODING.NUMERIC
             elif v == _blahtex.EncodingOptions.MathmlEncoding.LONG:
-                return self.ENCODING.LONG
+                return Blahtex.ENCODING.LONG
             elif v == _blahtex.EncodingOptions.MathmlEncoding.SHORT:
-                return self.ENCODING.SHORT
+                return Blahtex.ENCODING.SHORT
             else:
                 raise Exception()
         elif key == "other_encoding":
-            if self._core.encoding_options.other_encoding_raw:
-                return self.ENCODING.RAW
+            if core.encoding_options.other_encoding_raw:
+                return Blahtex.ENCODING.RAW
             else:
-                return self.ENCODING.NUMERIC
+                return Blahtex.ENCODING.NUMERIC
         elif key == "mathml_version1_fonts":
-            return self._core.mathml_options.use_version1_font_attributes
+            return core.mathml_options.use_version1_font_attributes
         elif key == "use_ucs_package":
-            return self._core.purified_tex_options.allow_ucs
+            return core.purified_tex_options.allow_ucs
         elif key == "use_cjk_package":
-            return self._core.purified_tex_options.allow_cjk
+            return core.purified_tex_options.allow_cjk
         elif key == "use_preview_package":
-            return self._core.purified_tex_options.allow_preview
+            return core.purified_tex_options.allow_preview
         elif key == "japanese_font":
-            return self._core.purified_tex_options.japanese_font
+            return core.purified_tex_options.japanese_font
         elif key == "latex_preamble":
-            return self._core.purified_tex_options.latex_preamble
+            return core.purified_tex_options.latex_preamble
         elif key == "latex_before_math":
-            return self._core.purified_tex_options.latex_before_math
+            return core.purified_tex_options.latex_before_math
 
     def set_options(self, *args, **kargs) -> None:
         '''Set options of blahtex.
@@ -275,12 +451,18 @@ class Blahtex(object):
         or by dictionay like as
         >> opts = { 'spacing': bl.SPACING.STRICT }
         >> bl.set_options(opts)  
+        or by BlahtexOptions, which sets all of the options at once.
 
         List of options is shown at docstring of this class.
         '''
         
         if len(args):
-            if len(args) == 1 and isinstance(args[0], dict):
+            if len(args) == 1 and isinstance(args[0], BlahtexOptions):
+                self._core.copy_options(args[0]._native)
+                super().__setattr__('_options_version',
+                                    self._options_version + 1)
+                return
+            elif len(args) == 1 and isinstance(args[0], dict):
                 opts = args[0]
             else:
                 raise ValueError('Argument must be a dictionay '
@@ -301,14 +483,319 @@ class Blahtex(object):
           Options
         '''
         result = {}
-        for key in ("indented",  "texvc_compatibility", "spacing",
-                    "disallow_plane_1", "mathml_encoding", "other_encoding",
-                    "mathml_version1_fonts",
-                    "use_ucs_package", "use_cjk_package", "use_preview_package",
-                    "japanese_font", "latex_preamble", "latex_before_math"):
+        for key in self._OPTION_NAMES:
             result[key] = getattr(self, key)
         return result
 
+    def get_profile(self) -> 'BlahtexOptions':
+        '''Get all options of blahtex as an immutable BlahtexOptions.'''
+        return BlahtexOptions(**self.get_options())
+
+    def _options_fingerprint(self) -> str:
+        version, fingerprint = self._fingerprint
+        if version != self._options_version:
+            version = self._options_version
+            fingerprint = _fingerprint(self.get_options())
+            super().__setattr__('_fingerprint', (version, fingerprint))
+        return fingerprint
+
+    def set_cache(self, cache) -> None:
+        '''Set a cache of conversion results.
+
+        ``convert()`` and ``convert_many()`` look up the cache before
+        converting. Results are keyed by the TeX-string, display_math and
+        all of the options, so changing an option never returns results
+        converted with the old options. Failed conversions are cached too.
+        When a result is taken from the cache, the state for
+        ``get_mathml()`` or ``get_purified_tex()`` is not updated.
+
+        >> from blahtex.cache import LRUCache
+        >> bl.set_cache(LRUCache(maxsize=4096))
+
+        Paramters
+        ---------
+        cache : blahtex.cache.LRUCache
+          Cache object, or None to disable caching.
+        '''
+        super().__setattr__('_cache', cache)
+
+    def cache_info(self):
+        '''Get statistics of the cache, or None if no cache is set.
+
+        Returns
+        -------
+        blahtex.cache.CacheInfo
+          Hits, misses, evictions and the size of the cache.
+        '''
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def _cache_keys(self, pairs, fingerprint) -> list:
+        # Keys of the cache for (TeX-string, display_math) pairs, made from
+        # the canonical keys when dedup is set, as convert() makes them.
+        if self._dedup is None:
+            texts = [_to_str(latex) for latex, _ in pairs]
+        else:
+            texts = _blahtex.Blahtex.canonical_keys(
+                [latex for latex, _ in pairs])
+        return [(text, bool(display_math), fingerprint)
+                for text, (_, display_math) in zip(texts, pairs)]
+
+    def set_dedup(self, enabled: bool=True) -> None:
+        '''Convert TeX-strings which have the same canonical key once.
+
+        When this is set, ``convert_many()`` converts each distinct
+        ``canonical_key()`` (with display_math) once in a batch, and
+        gives the result to all items having it, and the cache of
+        ``set_cache()`` is keyed by the canonical keys instead of the
+        TeX-strings. Counts are reset by every call.
+
+        Paramters
+        ---------
+        enabled : bool=True
+          False converts each item as it is, as the default.
+        '''
+        dedup = [_Lock(), 0, 0] if enabled else None
+        super().__setattr__('_dedup', dedup)
+
+    def dedup_info(self):
+        '''Get counts of the deduplication, or None if it is not set.
+
+        Returns
+        -------
+        DedupInfo
+          ``items`` converted by ``convert_many()``, ``conversions``
+          actually done for them, and ``ratio``, items per conversion.
+          Items taken from the cache of ``set_cache()`` are not counted
+          in either, so ``ratio`` is the saving of the deduplication
+          alone, on top of the cache.
+        '''
+        dedup = self._dedup
+        if dedup is None:
+            return None
+        with dedup[0]:
+            items, conversions = dedup[1], dedup[2]
+        return DedupInfo(items, conversions,
+                         items / conversions if conversions else 1.0)
+
+    def enable_stats(self, callback=None):
+        '''Record stats of each conversion by ``convert()`` and
+        ``convert_many()``.
+
+        Conversions measure the time of each stage and count tokens,
+        macro expansions and MathML nodes. When stats are disabled (the
+        default), none of this is done. Results taken from a cache are
+        not recorded.
+
+        Paramters
+        ---------
+        callback : callable=None
+          Called with ``blahtex.stats.ConversionStats`` of each
+          conversion, for example to forward them to a metrics system.
+          It is called on the thread which converted.
+
+        Returns
+        -------
+        blahtex.stats.PipelineStats
+          Totals of the stats, also returned by ``get_stats()``.
+        '''
+        from .stats import PipelineStats
+        if self._stats is None:
+            super().__setattr__('_stats', PipelineStats())
+        super().__setattr__('_stats_callback', callback)
+        return self._stats
+
+    def disable_stats(self) -> None:
+        '''Stop recording stats of conversions.'''
+        super().__setattr__('_stats', None)
+        super().__setattr__('_stats_callback', None)
+
+    def get_stats(self):
+        '''Get the totals of stats, or None if stats are disabled.
+
+        Returns
+        -------
+        blahtex.stats.PipelineStats
+          Totals of the stats of conversions.
+        '''
+        return self._stats
+
+    def _record_stats(self, stats, callback):
+        from .stats import ConversionStats
+        stats = ConversionStats._make(stats)
+        self._stats.record(stats)
+        if callback is not None:
+            callback(stats)
+
+    def _convert(self, core, latex, display_math, native):
+        # Conversion by the native core, recording stats if enabled.
+        if self._stats is None:
+            try:
+                return core.convert(latex, display_math, native, self._limits)
+            finally:
+                self._release(core)
+        try:
+            result, stats = core.convert_stats(latex, display_math, native,
+                                               self._limits)
+        finally:
+            self._release(core)
+        self._record_stats(stats, self._stats_callback)
+        if isinstance(result, BlahtexException):
+            raise result
+        return result
+
+    def _convert_many(self, core, items, native):
+        if self._stats is None:
+            try:
+                return core.convert_many(items, native, self._limits)
+            finally:
+                self._release(core)
+        callback = self._stats_callback
+        results = []
+        try:
+            converted = core.convert_many_stats(items, native, self._limits)
+        finally:
+            self._release(core)
+        for result, stats in converted:
+            self._record_stats(stats, callback)
+            results.append(result)
+        return results
+
+    _LIMIT_NAMES = ('max_input_length', 'max_tokens', 'max_macro_expansions',
+                    'max_depth', 'max_nodes', 'deadline')
+
+    def set_limits(self, max_input_length: int=None, max_tokens: int=None,
+                   max_macro_expansions: int=None, max_depth: int=None,
+                   max_nodes: int=None, deadline: float=None) -> None:
+        '''Set resource limits of each conversion.
+
+        A conversion over a limit raises a subclass of ``LimitExceeded``,
+        itself a subclass of ``BlahtexException``; ``convert_many()``
+        places it in the list as other errors. The counts of the input
+        are checked before parsing, so pathological input is rejected
+        before blahtex spends time on it. The deadline is checked between
+        parsing, building the MathML and making the ``<math>`` element.
+        Results taken from a cache are not checked, and errors of limits
+        are not cached. None (the default) means no limit.
+
+        >> bl.set_limits(max_input_length=4096, max_depth=64, deadline=0.05)
+
+        Paramters
+        ---------
+        max_input_length : int=None
+          Characters of the TeX-string (``InputTooLong``).
+        max_tokens : int=None
+          Tokens of the TeX-string (``TooManyTokens``).
+        max_macro_expansions : int=None
+          Expansions of ``\\newcommand`` macros, including nested ones
+          (``TooManyMacroExpansions``).
+        max_depth : int=None
+          Nesting of groups, environments and ``\\left``/``\\right``
+          (``NestingTooDeep``).
+        max_nodes : int=None
+          Elements of the MathML (``TooManyNodes``).
+        deadline : float=None
+          Seconds from the start of a conversion (``DeadlineExceeded``).
+        '''
+        values = (max_input_length, max_tokens, max_macro_expansions,
+                  max_depth, max_nodes, deadline)
+        if all(v is None for v in values):
+            super().__setattr__('_limits', None)
+            return
+        limits = _blahtex.Limits()
+        for name, value in zip(self._LIMIT_NAMES, values):
+            if value is None:
+                continue
+            if value <= 0:
+                raise ValueError('{} must be positive'.format(name))
+            setattr(limits, name, value)
+        super().__setattr__('_limits', limits)
+
+    def get_limits(self) -> dict:
+        '''Get the resource limits set by ``set_limits()``.
+
+        Returns
+        -------
+        dict
+          Limits by the names of arguments of ``set_limits()``. No limit
+          is None.
+        '''
+        limits = self._limits
+        result = {}
+        for name in self._LIMIT_NAMES:
+            value = getattr(limits, name) if limits is not None else 0
+            result[name] = value or None
+        return result
+
+    def set_release_trees(self, release: bool=True) -> None:
+        '''Free the trees of each conversion as soon as it is done.
+
+        blahtex keeps the parse tree, the layout tree and the MathML tree
+        of the last input until the next one, which holds large matrices
+        in memory while a converter is idle. When this is set, the trees
+        are freed in bulk at the end of every conversion and validation,
+        and ``get_mathml()`` etc. can be used only after
+        ``process_input()``.
+
+        Paramters
+        ---------
+        release : bool=True
+          False keeps the trees of the last input, as the default.
+        '''
+        super().__setattr__('_release_trees', bool(release))
+
+    def reset(self) -> None:
+        '''Free the trees kept for the last input of the calling thread.
+
+        The options, limits, cache and stats are kept. ``get_mathml()``
+        etc. raise ValueError until a new TeX-string is processed.
+        '''
+        core = getattr(self._local, 'core', None)
+        if core is not None:
+            core.release()
+            self._local.inputted = False
+
+    def memory_usage(self) -> dict:
+        '''Get the memory used by the process and the calling thread.
+
+        Returns
+        -------
+        dict
+          ``resident`` and ``peak_resident`` are the resident set size of
+          the process and its peak in bytes, or None if it is not known on
+          the platform. ``retained`` is True if the calling thread keeps
+          the trees of an input.
+        '''
+        resident, peak = _blahtex.resident_memory()
+        core = getattr(self._local, 'core', None)
+        return {'resident': resident, 'peak_resident': peak,
+                'retained': core is not None and core.has_input}
+
+    def _release(self, core):
+        # Frees the trees of the last input after a conversion, if
+        # set_release_trees() is set.
+        if self._release_trees:
+            core.release()
+            self._local.inputted = False
+
+    def _thread_core(self):
+        '''Get the native core of the calling thread.
+
+        The core is created on first use, and its options are copied from
+        ``_core`` whenever they have been changed since the last call.
+        '''
+        local = self._local
+        core = getattr(local, 'core', None)
+        if core is None:
+            core = local.core = _blahtex.Blahtex()
+            local.version = -1
+            local.inputted = False
+        if local.version != self._options_version:
+            core.copy_options(self._core)
+            local.version = self._options_version
+        return core
+
     def process_input(self, s: str, display_math: bool=False) -> None:
         '''Set input TeX-string to blahtex.
 
@@ -316,7 +803,8 @@ class Blahtex(object):
         ---------
         s : str
           TeX/LaTeX/AMS-LaTeX string. Supported commands are listed on
-          a document of blahtex-0.9.
+          a document of blahtex-0.9. It can also be given as bytes or
+          memoryview of UTF-8.
         display_math: bool=Flase
           Input string are assumed at display-math environment. When this
           argmuent is False (default), TeX-stirng is assumed at inline-math.
@@ -326,9 +814,10 @@ class Blahtex(object):
         BlahtexException
           If s is not recognized by blahtex.
         '''
-        super().__setattr__('_inputted', True)
-        self._core.purified_tex_options.display_math = display_math
-        self._core.process_input(s, display_math)
+        core = self._thread_core()
+        self._local.inputted = True
+        core.purified_tex_options.display_math = display_math
+        core.process_input(s, display_math)
     
     def get_mathml(self) -> str:
         '''Get MathML string converted by blahtex.
@@ -343,40 +832,215 @@ class Blahtex(object):
         ValueError
           If no TeX-string is inputted by ``process_input()``.
         '''
-        if not self._inputted:
+        core = self._thread_core()
+        if not self._local.inputted:
             raise ValueError("no TeX-string is processed")
-        if self._core.purified_tex_options.display_math:
+        if core.purified_tex_options.display_math:
             display = "block"
         else:
             display = "inline"
         head = ('<math xmlns="http://www.w3.org/1998/Math/MathML" ' +
                 'display="{}">'.format(display))
-        body = self._core.get_mathml()
+        body = core.get_mathml()
+        if core.compact:
+            return head + _blahtex.Blahtex.compact_mathml(body) + "</math>"
         if self.indented:
+            import textwrap
             return head + "\n" + textwrap.indent(body, "  ") + "</math>\n"
         return head + body + "</math>"
 
+    def parse(self, latex, display_math: bool=False,
+              macros=None) -> 'ParsedFormula':
+        '''Parse TeX-string once, to render it many times.
+
+        Paramters
+        ---------
+        latex : str
+          Same as ``convert()``.
+        display_math: bool=False
+          Same as ``convert()``.
+        macros: blahtex.macros.MacroSet=None
+          Same as ``convert()``.
+
+        Returns
+        -------
+        ParsedFormula
+          Handle rendering MathML or purified TeX of the formula with the
+          options of this object at parsing, or with any BlahtexOptions.
+
+        Raises
+        ------
+        BlahtexException
+          If latex is not recognized by blahtex.
+        '''
+        if macros is not None:
+            latex = macros.apply(_to_str(latex))
+        return ParsedFormula(self._thread_core().parse(latex, display_math,
+                                                       self._limits))
+
+    def compile_macros(self, tex: str):
+        r'''Compile a preamble of macro definitions once.
+
+        >> macros = bl.compile_macros(r'\newcommand{\R}{\mathbb{R}}')
+        >> bl.convert(r'x \in \R', macros=macros)
+
+        Paramters
+        ---------
+        tex : str
+          ``\newcommand`` definitions, separated by spaces or comments.
+
+        Returns
+        -------
+        blahtex.macros.MacroSet
+          Macros given to ``convert()``, ``convert_many()`` or ``parse()``.
+          Only the definitions which a formula uses are converted with it.
+
+        Raises
+        ------
+        ValueError
+          If tex has anything but ``\newcommand`` definitions.
+        BlahtexException
+          If the definitions are not recognized by blahtex.
+        '''
+        from .macros import MacroSet
+        macros = MacroSet(tex)
+        self._thread_core().parse(tex, False)
+        return macros
+
+    @staticmethod
+    def _validation_result(result, offset):
+        if result is None:
+            return _VALID
+        code, arguments, position = result
+        if position is not None:
+            position -= offset
+            if position < 0: # in the definitions of macros
+                position = None
+        return ValidationResult(False, code, arguments, position)
+
+    def validate(self, latex, display_math: bool=False,
+                 macros=None) -> ValidationResult:
+        '''Check whether blahtex accepts a TeX-string, without converting.
+
+        The input is processed by blahtex as by ``convert()``, through the
+        tokenizer, the macro expansion, the parser and the layout tree, but
+        no MathML tree or string is made, so this is cheaper than
+        ``convert()``. The limits set by ``set_limits()`` are checked too,
+        except for ``max_nodes``.
+
+        >> bl.validate(r'\\frac{1}{')
+        ValidationResult(valid=False, code='UnmatchedOpenBrace', arguments=(), position=8)
+
+        Paramters
+        ---------
+        latex : str
+          Same as ``convert()``.
+        display_math: bool=False
+          Same as ``convert()``.
+        macros: blahtex.macros.MacroSet=None
+          Same as ``convert()``.
+
+        Returns
+        -------
+        ValidationResult
+          Whether latex is valid, and the error code, its arguments and its
+          position if not.
+        '''
+        offset = 0
+        if macros is not None:
+            latex = _to_str(latex)
+            applied = macros.apply(latex)
+            offset = len(applied) - len(latex)
+            latex = applied
+        core = self._thread_core()
+        self._local.inputted = True
+        try:
+            result = core.validate(latex, display_math, self._limits)
+        finally:
+            self._release(core)
+        return self._validation_result(result, offset)
+
+    def validate_many(self, items, macros=None) -> list:
+        '''Validate many TeX-strings in one native call.
+
+        Paramters
+        ---------
+        items : iterable
+          Same as ``convert_many()``.
+        macros: blahtex.macros.MacroSet=None
+          Same as ``convert()``.
+
+        Returns
+        -------
+        list
+          ValidationResult for each item.
+        '''
+        offsets = None
+        if macros is not None:
+            applied, offsets = [], []
+            for item in items:
+                if isinstance(item, _STRING_TYPES):
+                    latex, display_math = _to_str(item), False
+                else:
+                    latex, display_math = _to_str(item[0]), item[1]
+                text = macros.apply(latex)
+                applied.append((text, display_math))
+                offsets.append(len(text) - len(latex))
+            items = applied
+        core = self._thread_core()
+        try:
+            results = core.validate_many(items, self._limits)
+            if results:
+                self._local.inputted = True
+        finally:
+            self._release(core)
+        if offsets is None:
+            return [_VALID if r is None else self._validation_result(r, 0)
+                    for r in results]
+        return [self._validation_result(r, offset)
+                for r, offset in zip(results, offsets)]
+
+    def get_mathml_bytes(self) -> bytes:
+        '''Get MathML converted by blahtex as UTF-8 bytes.
+
+        Same as ``get_mathml().encode('utf-8')``, but the whole ``<math>``
+        element is encoded natively without making a str.
+        '''
+        core = self._thread_core()
+        if not self._local.inputted:
+            raise ValueError("no TeX-string is processed")
+        return core.get_mathml_bytes()
+
     def get_purified_tex(self) -> str:
-        if not self._inputted:
+        core = self._thread_core()
+        if not self._local.inputted:
             raise ValueError("no TeX-string is processed")
-        return self._core.get_purified_tex()
+        return core.get_purified_tex()
 
     def get_purified_tex_only(self) -> str:
-        if not self._inputted:
+        core = self._thread_core()
+        if not self._local.inputted:
             raise ValueError("no TeX-string is processed")
-        return self._core.get_purified_tex_only()
+        return core.get_purified_tex_only()
 
-    def convert(self, latex: str, display_math: bool=False) -> str:
+    def convert(self, latex: str, display_math: bool=False,
+                options: 'BlahtexOptions'=None, macros=None) -> str:
         '''Convert TeX-string to MathML.
 
         Paramters
         ---------
         s : str
           TeX/LaTeX/AMS-LaTeX string. Supported commands are listed on
-          a document of blahtex-0.9.
+          a document of blahtex-0.9. It can also be given as bytes or
+          memoryview of UTF-8.
         display_math: bool=Flase
           Input string are assumed at display-math environment. When this
           argmuent is False (default), TeX-stirng is assumed at inline-math.
+        options: BlahtexOptions=None
+          Options used for this conversion only, in place of the options
+          of this object.
+        macros: blahtex.macros.MacroSet=None
+          Macros made by ``compile_macros()`` which latex can use.
 
         Returns
         -------
@@ -387,6 +1051,332 @@ class Blahtex(object):
         ------
         BlahtexException
           If s is not recognized by blahtex.
+        LimitExceeded
+          If a limit set by ``set_limits()`` is exceeded. It is a subclass
+          of BlahtexException.
+        '''
+        if macros is not None:
+            latex = macros.apply(_to_str(latex))
+        cache = self._cache
+        core = self._thread_core()
+        native = None if options is None else options._native
+        if cache is None:
+            self._local.inputted = True
+            return self._convert(core, latex, display_math, native)
+        if options is None:
+            fingerprint = self._options_fingerprint()
+        else:
+            fingerprint = options.fingerprint
+        if self._dedup is None:
+            key = (_to_str(latex), bool(display_math), fingerprint)
+        else:
+            key = (canonical_key(latex), bool(display_math), fingerprint)
+        result = cache.get(key)
+        if result is None:
+            self._local.inputted = True
+            try:
+                result = self._convert(core, latex, display_math, native)
+            except LimitExceeded:
+                raise
+            except BlahtexException as e:
+                cache.put(key, _copy_exception(e))
+                raise
+            cache.put(key, result)
+        elif isinstance(result, BlahtexException):
+            raise _copy_exception(result)
+        return result
+
+    def convert_bytes(self, latex, display_math: bool=False,
+                      options: 'BlahtexOptions'=None) -> bytes:
+        '''Convert TeX-string to MathML encoded in UTF-8.
+
+        Same as ``convert()``, but returns bytes made natively from the
+        output of blahtex, without making a str.
+        '''
+        if self._cache is not None:
+            return self.convert(latex, display_math, options).encode('utf-8')
+        core = self._thread_core()
+        self._local.inputted = True
+        native = None if options is None else options._native
+        try:
+            return core.convert_bytes(latex, display_math, native,
+                                      self._limits)
+        finally:
+            self._release(core)
+
+    def convert_into(self, latex, out, display_math: bool=False,
+                     options: 'BlahtexOptions'=None) -> int:
+        '''Convert TeX-string and write the MathML in UTF-8 to out.
+
+        Paramters
+        ---------
+        latex : str
+          Same as ``convert()``.
+        out : bytearray, writable buffer or binary file
+          The MathML is appended to a bytearray, copied to the head of
+          other writable buffers like ``memoryview``, or written by the
+          ``write()`` method of files.
+        display_math: bool=False
+          Same as ``convert()``.
+        options: BlahtexOptions=None
+          Same as ``convert()``.
+
+        Returns
+        -------
+        int
+          Number of bytes of the MathML.
+
+        Raises
+        ------
+        ValueError
+          If a buffer is smaller than the MathML.
+        '''
+        if self._cache is not None:
+            data = self.convert_bytes(latex, display_math, options)
+            if isinstance(out, bytearray):
+                out += data
+            elif hasattr(out, 'write'):
+                out.write(data)
+            else:
+                view = memoryview(out).cast('B')
+                if len(view) < len(data):
+                    raise ValueError("buffer is too small")
+                view[:len(data)] = data
+            return len(data)
+        core = self._thread_core()
+        self._local.inputted = True
+        native = None if options is None else options._native
+        try:
+            return core.convert_into(latex, out, display_math, native,
+                                     self._limits)
+        finally:
+            self._release(core)
+
+    def convert_many(self, items, options: 'BlahtexOptions'=None,
+                     macros=None) -> list:
+        '''Convert many TeX-strings to MathML in one native call.
+
+        Paramters
+        ---------
+        items : iterable
+          TeX-strings, or pairs of ``(TeX-string, display_math)``. A bare
+          TeX-string is converted at inline-math.
+        options: BlahtexOptions=None
+          Options used for this conversion only, in place of the options
+          of this object.
+        macros: blahtex.macros.MacroSet=None
+          Macros made by ``compile_macros()`` which the items can use.
+
+        Returns
+        -------
+        list
+          MathML string for each item. When an item is not recognized by
+          blahtex, the ``BlahtexException`` is placed in the list instead
+          of being raised, so one bad input does not stop the batch. The
+          exception has ``code`` and ``arguments`` attributes.
+        '''
+        if macros is not None:
+            items = [macros.apply(_to_str(item))
+                     if isinstance(item, _STRING_TYPES)
+                     else (macros.apply(_to_str(item[0])), item[1])
+                     for item in items]
+        cache = self._cache
+        dedup = self._dedup
+        core = self._thread_core()
+        native = None if options is None else options._native
+        if cache is None and dedup is None:
+            results = self._convert_many(core, items, native)
+            if results and not self._release_trees:
+                self._local.inputted = True
+            return results
+        fingerprint = None
+        if cache is not None:
+            if options is None:
+                fingerprint = self._options_fingerprint()
+            else:
+                fingerprint = options.fingerprint
+        pairs = [(item, False) if isinstance(item, _STRING_TYPES) else item
+                 for item in items]
+        keys = self._cache_keys(pairs, fingerprint)
+        if cache is None:
+            results = [None] * len(keys)
+        else:
+            results = [cache.get(key) for key in keys]
+        missed = [i for i, result in enumerate(results) if result is None]
+        if missed:
+            # Each distinct key is converted once, by its first item.
+            distinct = collections.OrderedDict()
+            for i in missed:
+                distinct.setdefault(keys[i], i)
+            self._local.inputted = True
+            converted = dict(zip(distinct, self._convert_many(
+                core, [pairs[i] for i in distinct.values()], native)))
+            for i in missed:
+                results[i] = converted[keys[i]]
+            if cache is not None:
+                for key, result in converted.items():
+                    if not isinstance(result, LimitExceeded):
+                        cache.put(key, result)
+            if dedup is not None:
+                with dedup[0]:
+                    dedup[1] += len(missed)
+                    dedup[2] += len(distinct)
+        return results
+
+
+def _make_options(values: dict) -> 'BlahtexOptions':
+    return BlahtexOptions(**values)
+
+class BlahtexOptions(object):
+    r'''Immutable and hashable set of all options of blahtex.
+
+    The options are validated and compiled into native structures once,
+    when the object is created. A BlahtexOptions can be passed to
+    ``Blahtex.convert()`` and ``Blahtex.convert_many()`` to convert with
+    it without changing the options of the Blahtex object, or to
+    ``Blahtex.set_options()`` to set all options at once.
+
+    >> strict = BlahtexOptions(spacing=Blahtex.SPACING.STRICT)
+    >> numeric = strict.replace(mathml_encoding=Blahtex.ENCODING.NUMERIC)
+    >> bl.convert(r'\alpha', options=numeric)
+
+    Options not given are the same as the defaults of ``Blahtex()``.
+    The options are read as attributes, like ``strict.spacing``. Two
+    BlahtexOptions are equal if all of their options are equal.
+    '''
+
+    __slots__ = ('_native', '_values', '_fingerprint')
+
+    def __init__(self, **opts):
+        native = _blahtex.Options()
+        native.copy_options(Blahtex._default_core())
+        for k, v in opts.items():
+            Blahtex._set_option(native, k, v)
+        values = {}
+        for key in Blahtex._OPTION_NAMES:
+            values[key] = Blahtex._get_option(native, key)
+        object.__setattr__(self, '_native', native)
+        object.__setattr__(self, '_values', values)
+        object.__setattr__(self, '_fingerprint', _fingerprint(values))
+
+    def __getattr__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        raise AttributeError("BlahtexOptions is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError("BlahtexOptions is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, BlahtexOptions):
+            return NotImplemented
+        return self._fingerprint == other._fingerprint
+
+    def __hash__(self):
+        return hash(self._fingerprint)
+
+    def __repr__(self):
+        return 'BlahtexOptions({})'.format(', '.join(
+            '{}={!r}'.format(k, self._values[k])
+            for k in Blahtex._OPTION_NAMES))
+
+    def __reduce__(self):
+        return (_make_options, (self.as_dict(),))
+
+    @property
+    def fingerprint(self) -> str:
+        '''String identifying the options, used as a part of cache keys.'''
+        return self._fingerprint
+
+    def as_dict(self) -> dict:
+        '''Get the options as a dictionary, like ``Blahtex.get_options()``.'''
+        return dict(self._values)
+
+    def replace(self, **opts) -> 'BlahtexOptions':
+        '''Get a new BlahtexOptions with some options changed.'''
+        values = self.as_dict()
+        values.update(opts)
+        return BlahtexOptions(**values)
+
+
+class ParsedFormula(object):
+    '''Formula parsed by ``Blahtex.parse()``.
+
+    The native parse tree and layout tree of the formula are kept by the
+    handle, and rendered with any options without tokenizing or parsing
+    again. The options used when not given are the ones of the Blahtex
+    object at parsing. ``texvc_compatibility`` and ``display_math`` take
+    effect at parsing, so they are not changed by options given to the
+    render methods.
+
+    A handle keeps a native blahtex core holding the trees, which take
+    memory roughly proportional to the length of the TeX-string: a few
+    kilobytes for a typical formula, and up to hundreds of kilobytes for
+    large arrays. The memory is released when the handle is deleted.
+    A handle can be used from many threads; renderings of the same
+    handle run one at a time.
+    '''
+
+    FORMATS = ('mathml', 'mathml_bytes', 'purified_tex', 'purified_tex_only')
+
+    __slots__ = ('_native',)
+
+    def __init__(self, native):
+        self._native = native
+
+    @property
+    def display_math(self) -> bool:
+        return self._native.display_math
+
+    @staticmethod
+    def _options(options):
+        return None if options is None else options._native
+
+    def mathml(self, options: BlahtexOptions=None) -> str:
+        '''Render MathML, as ``Blahtex.get_mathml()``.'''
+        return self._native.render('mathml', self._options(options))
+
+    def mathml_bytes(self, options: BlahtexOptions=None) -> bytes:
+        '''Render MathML in UTF-8, as ``Blahtex.get_mathml_bytes()``.'''
+        return self._native.render('mathml_bytes', self._options(options))
+
+    def purified_tex(self, options: BlahtexOptions=None) -> str:
+        '''Render purified TeX, as ``Blahtex.get_purified_tex()``.'''
+        return self._native.render('purified_tex', self._options(options))
+
+    def purified_tex_only(self, options: BlahtexOptions=None) -> str:
+        '''Render purified TeX, as ``Blahtex.get_purified_tex_only()``.'''
+        return self._native.render('purified_tex_only',
+                                   self._options(options))
+
+    def render_all(self, requests) -> list:
+        '''Render many outputs in one native call.
+
+        >> raw = BlahtexOptions()
+        >> numeric = raw.replace(mathml_encoding=Blahtex.ENCODING.NUMERIC)
+        >> html, mail, tex = formula.render_all(
+        >>     [('mathml', raw), ('mathml', numeric), 'purified_tex'])
+
+        Paramters
+        ---------
+        requests : iterable
+          Names of formats in ``FORMATS``, or pairs of
+          ``(format, BlahtexOptions)``.
+
+        Returns
+        -------
+        list
+          Output for each request.
         '''
-        self.process_input(latex, display_math)
-        return self.get_mathml()
+        native = []
+        for request in requests:
+            if isinstance(request, str):
+                native.append((request, None))
+            else:
+                format, options = request
+                native.append((format, self._options(options)))
+        return self._native.render_all(native)
@@ -0,0 +1,188 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''Conversion from asyncio programs.
+
+Usage
+=====
+
+>> from blahtex.aio import AsyncBlahtex
+>> abl = AsyncBlahtex(max_concurrency=4, indented=True)
+>> mathml = await abl.convert(r'\sqrt{3}')
+>> async for mathml in abl.convert_many(formulas):
+>>     ...
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import os
+import threading
+import weakref
+
+from . import Blahtex
+
+
+class AsyncBlahtex(object):
+    '''Awaitable converter running conversions on a pool of threads.
+
+    Each thread of the pool uses its own native core of the Blahtex
+    object, and the conversion runs without the GIL, so the event loop
+    keeps running while formulas are converted. At most
+    ``max_concurrency`` conversions run at once; further calls wait for
+    a free thread, which gives backpressure to the callers.
+
+    When an awaiting task is cancelled, a conversion which has not been
+    started is dropped, and one already running is finished by its
+    thread and the result is discarded. The core stays consistent in
+    either case.
+
+    An AsyncBlahtex can be used by more than one event loop, one after
+    another or at once from different threads; ``max_concurrency`` is
+    then applied to each loop.
+
+    Paramters
+    ---------
+    max_concurrency : int=None
+      Number of conversions running at once. The default is the number
+      of CPUs.
+    blahtex : Blahtex=None
+      Converter to use. A new one is created from ``**opts`` if omitted.
+    **opts
+      Options of the new converter.
+    '''
+
+    def __init__(self, max_concurrency: int=None, blahtex: Blahtex=None,
+                 **opts):
+        if blahtex is None:
+            blahtex = Blahtex(**opts)
+        elif opts:
+            raise ValueError('Options cannot be given with blahtex')
+        self.blahtex = blahtex
+        self.max_concurrency = max_concurrency or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_concurrency)
+        # asyncio.Semaphore is bound to the loop using it first.
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Waiting for the running conversions in another thread keeps the
+        # event loop running.
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def _semaphore(self, loop):
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._semaphores[loop] = semaphore
+            return semaphore
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(loop)
+        await semaphore.acquire()
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+        # The slot is freed when the thread finishes, not when the caller
+        # stops waiting, so cancelled calls cannot oversubscribe the pool.
+        def release(f):
+            # A closed loop does not use the semaphore any more.
+            if not loop.is_closed():
+                try:
+                    loop.call_soon_threadsafe(semaphore.release)
+                except RuntimeError: # closed since
+                    pass
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    async def convert(self, latex: str, display_math: bool=False) -> str:
+        '''Convert TeX-string to MathML.
+
+        Same as ``Blahtex.convert()``, but awaitable.
+        '''
+        return await self._run(self.blahtex.convert, latex, display_math)
+
+    async def convert_many(self, items, chunksize: int=64):
+        '''Convert TeX-strings, yielding results in the order of the inputs.
+
+        Used as ``async for mathml in abl.convert_many(items)``. Inputs are
+        converted in chunks by ``Blahtex.convert_many()``, and at most
+        ``max_concurrency`` chunks are converted ahead of the consumer.
+        As ``Blahtex.convert_many()``, an input not recognized by blahtex
+        gives a ``BlahtexException`` instead of a string.
+
+        Paramters
+        ---------
+        items : iterable
+          TeX-strings, or pairs of ``(TeX-string, display_math)``.
+        chunksize : int=64
+          Number of inputs converted by one thread at once.
+        '''
+        items = iter(items)
+        pending = collections.deque()
+
+        def submit_next():
+            chunk = list(itertools.islice(items, chunksize))
+            if chunk:
+                pending.append(asyncio.ensure_future(
+                    self._run(self.blahtex.convert_many, chunk)))
+            return bool(chunk)
+
+        try:
+            while len(pending) < self.max_concurrency and submit_next():
+                pass
+            while pending:
+                results = await pending.popleft()
+                submit_next()
+                for result in results:
+                    yield result
+        finally:
+            for task in pending:
+                task.cancel()
+            # Retrieve the exceptions of the cancelled chunks.
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def close(self) -> None:
+        '''Shut down the threads after running conversions finish.
+
+        This blocks until they finish; ``async with`` waits for them
+        without blocking the event loop.
+        '''
+        self._executor.shutdown(wait=True)
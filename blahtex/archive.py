@@ -0,0 +1,544 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+r'''Indexed archive of MathML, for the output of bulk conversions.
+
+An archive is a single file of conversion results, written once from
+start to end by ``ArchiveWriter`` and read by ``ArchiveReader`` through
+``mmap``, so that a result is found by its formula id or its position
+without reading the rest, and its MathML is returned without a copy.
+Archives written by parallel workers are joined by ``merge_archives()``
+or by ``python -m blahtex.archive merge``.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> from blahtex.archive import ArchiveWriter, ArchiveReader
+>> with ArchiveWriter('formulas.bta') as writer:
+>>     writer.convert(Blahtex(), {'eq1': r'\sqrt{2}', 'eq2': r'x^2'})
+>> with ArchiveReader('formulas.bta') as reader:
+>>     bytes(reader.get('eq1')).decode('utf-8')
+
+Format
+======
+
+All numbers are little-endian. The file is:
+
+- header: ``b'BLAHTEXA'``, the version (uint32) and 4 zero bytes;
+- records, in the order of ``add()``: the kind (uint8, 0 for MathML and
+  1 for an error), the length of the id and of the data (uint32 each),
+  the id and the data, both UTF-8. The data of an error is the JSON of
+  ``[code, arguments]``;
+- the offset of each record (uint64), in the order of the records;
+- the table of ids: a uint64 for each record, made of the high bits of
+  the hash of its id followed by its position in ``B`` bits, where ``B``
+  is the number of bits of the number of records, sorted. The hash is
+  the first 8 bytes of SHA-1 of the id;
+- trailer: the number of records, the offset of the record offsets and
+  the offset of the table (uint64 each), and ``b'BLAHTEXZ'``.
+
+The index is written by ``close()``, so an archive whose writer did not
+finish, or was left by an exception, has no trailer and is refused by
+``ArchiveReader``.
+'''
+
+import argparse
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from . import Blahtex, BlahtexException, _blahtex
+from .cache import _make_exception
+
+MAGIC = b'BLAHTEXA'
+VERSION = 1
+_TRAILER_MAGIC = b'BLAHTEXZ'
+
+_HEADER = struct.Struct('<8sI4x')
+_RECORD = struct.Struct('<BII')
+_OFFSET = struct.Struct('<Q')
+_ENTRY = struct.Struct('<Q')
+_TRAILER = struct.Struct('<QQQ8s')
+
+_MATHML = 0
+_ERROR = 1
+
+ArchiveRecord = collections.namedtuple('ArchiveRecord',
+                                       ['id', 'mathml', 'error'])
+ArchiveRecord.__doc__ = '''A result read from an archive.
+
+id
+    Formula id, as a str.
+mathml
+    memoryview of the MathML in UTF-8, or None for an error.
+error
+    BlahtexException with ``code`` and ``arguments``, or None.
+'''
+
+
+def _id_bytes(formula_id) -> bytes:
+    # Ids are str in the archive; other ids (like line numbers) are
+    # stored and looked up as str(formula_id).
+    if not isinstance(formula_id, str):
+        formula_id = str(formula_id)
+    return formula_id.encode('utf-8')
+
+
+def _id_hash(data) -> int:
+    return int.from_bytes(hashlib.sha1(data).digest()[:8], 'little')
+
+
+def _encode_error(e: Exception) -> bytes:
+    code = getattr(e, 'code', None)
+    if code is None:
+        code, arguments = type(e).__name__, [str(e)]
+    else:
+        arguments = list(getattr(e, 'arguments', ()))
+    return json.dumps([code, arguments], ensure_ascii=False).encode('utf-8')
+
+
+class ArchiveWriter(object):
+    '''Writer of an archive, appending results one by one.
+
+    The file is written from start to end, and only the index of the
+    records (16 bytes for each) is kept in memory until ``close()``,
+    which writes it. It can be used as a context manager, closing the
+    archive at the end, or aborting it by an exception, so that the
+    records of a failed job are never read as a whole archive.
+
+    Paramters
+    ---------
+    path : str
+      Path of the archive. An existing file is replaced.
+    fsync : bool=False
+      Flush the archive to the disk at ``close()``.
+    '''
+
+    def __init__(self, path: str, fsync: bool=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, VERSION))
+        self._offset = _HEADER.size
+        self._offsets = array('Q')
+        self._hashes = array('Q')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _write(self, kind: int, id_data: bytes, data) -> int:
+        if self._file is None:
+            raise ValueError("archive is closed")
+        position = len(self._offsets)
+        self._offsets.append(self._offset)
+        self._hashes.append(_id_hash(id_data))
+        self._file.write(_RECORD.pack(kind, len(id_data), len(data)))
+        self._file.write(id_data)
+        self._file.write(data)
+        self._offset += _RECORD.size + len(id_data) + len(data)
+        return position
+
+    def add(self, formula_id, result) -> int:
+        '''Append the result of a formula.
+
+        Paramters
+        ---------
+        formula_id : str
+          Id of the formula. Other values are stored as ``str()`` of
+          them. When an id is added more than once, ``get()`` of the
+          reader returns the last one.
+        result : str or Exception
+          MathML, or the exception raised for the formula, like the items
+          of ``Blahtex.convert_many()``. ``code`` and ``arguments`` of a
+          BlahtexException are kept.
+
+        Returns
+        -------
+        int
+          Position of the record.
+        '''
+        if isinstance(result, Exception):
+            return self._write(_ERROR, _id_bytes(formula_id),
+                               _encode_error(result))
+        return self._write(_MATHML, _id_bytes(formula_id),
+                           result.encode('utf-8'))
+
+    def add_many(self, items) -> None:
+        '''Append ``(formula_id, result)`` pairs.'''
+        for formula_id, result in items:
+            self.add(formula_id, result)
+
+    def convert(self, blahtex: Blahtex, items, chunksize: int=1000) -> int:
+        '''Convert formulas and append their results.
+
+        Paramters
+        ---------
+        blahtex : Blahtex
+          Converter. The formulas are converted by ``convert_many()``,
+          so its cache is used.
+        items : iterable or dict
+          Pairs of ``(id, TeX-string)`` or triples of ``(id, TeX-string,
+          display_math)``, or a dict of TeX-strings by id. It is read
+          by chunks, so it may be a generator of any length.
+        chunksize : int=1000
+          Number of formulas converted at once.
+
+        Returns
+        -------
+        int
+          Number of appended records.
+        '''
+        if chunksize < 1:
+            raise ValueError("chunksize must be positive")
+        if isinstance(items, dict):
+            items = items.items()
+        count = 0
+        ids, chunk = [], []
+        for item in items:
+            ids.append(item[0])
+            chunk.append((item[1], item[2] if len(item) > 2 else False))
+            if len(chunk) >= chunksize:
+                self.add_many(zip(ids, blahtex.convert_many(chunk)))
+                count += len(chunk)
+                ids, chunk = [], []
+        if chunk:
+            self.add_many(zip(ids, blahtex.convert_many(chunk)))
+            count += len(chunk)
+        return count
+
+    def abort(self) -> None:
+        '''Close the archive without the index.
+
+        The records written are kept, but ``ArchiveReader`` refuses the
+        archive.
+        '''
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        self._offsets = self._hashes = None
+        f.close()
+
+    def close(self) -> None:
+        '''Write the index and close the archive.'''
+        f = self._file
+        if f is None:
+            return
+        self._file = None
+        try:
+            count = len(self._offsets)
+            positions = self._offset
+            table = positions + 8 * count
+            # The hashes become the table in place, sorted natively.
+            _blahtex.sort_archive_table(self._hashes)
+            for numbers in (self._offsets, self._hashes):
+                if sys.byteorder != 'little':
+                    numbers.byteswap()
+                f.write(numbers)
+            f.write(_TRAILER.pack(count, positions, table, _TRAILER_MAGIC))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+            self._offsets = self._hashes = None
+
+
+class ArchiveReader(object):
+    '''Reader of an archive mapped in memory.
+
+    MathML is returned as a memoryview of the mapped file, valid until
+    ``close()``; ``bytes(view).decode('utf-8')`` or ``str(view,
+    'utf-8')`` makes a str of it. The views must be released before
+    ``close()``, which raises BufferError otherwise. A reader can be
+    used by many threads, and as a context manager.
+
+    Paramters
+    ---------
+    path : str
+      Path of an archive written by ``ArchiveWriter``.
+
+    Raises
+    ------
+    ValueError
+      If the file is not a finished archive.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size + _TRAILER.size:
+                raise ValueError(
+                    "{} is not a blahtex archive".format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack_from(self._map, 0)
+        count, positions, table, end = _TRAILER.unpack_from(
+            self._map, size - _TRAILER.size)
+        if magic != MAGIC or end != _TRAILER_MAGIC:
+            self._map.close()
+            raise ValueError("{} is not a finished blahtex archive".format(
+                path))
+        if version != VERSION:
+            self._map.close()
+            raise ValueError("{} is an archive of version {}".format(
+                path, version))
+        self._view = memoryview(self._map)
+        self._count = count
+        self._positions = positions
+        self._table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def close(self) -> None:
+        '''Unmap the archive.'''
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if not self._map.closed:
+            self._map.close()  # BufferError while a view is alive
+
+    def _offset(self, position: int) -> int:
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError("archive position out of range")
+        return _OFFSET.unpack_from(self._map,
+                                   self._positions + 8 * position)[0]
+
+    def _read(self, offset: int):
+        # (kind, id, data, offset of the next record) of a record, with
+        # id and data as views.
+        kind, id_length, length = _RECORD.unpack_from(self._map, offset)
+        start = offset + _RECORD.size
+        end = start + id_length + length
+        return (kind, self._view[start:start + id_length],
+                self._view[start + id_length:end], end)
+
+    def find(self, formula_id) -> int:
+        '''Get the position of the last record of formula_id, or -1.'''
+        data = _id_bytes(formula_id)
+        bits = self._count.bit_length()
+        prefix = _id_hash(data) >> bits
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = _ENTRY.unpack_from(self._map, self._table + 8 * mid)[0]
+            if entry >> bits < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = -1
+        while lo < self._count:
+            entry = _ENTRY.unpack_from(self._map, self._table + 8 * lo)[0]
+            if entry >> bits != prefix:
+                break
+            position = entry & ((1 << bits) - 1)
+            if self._read(self._offset(position))[1] == data:
+                found = position
+            lo += 1
+        return found
+
+    def __contains__(self, formula_id):
+        return self.find(formula_id) >= 0
+
+    def _result(self, kind, data):
+        if kind == _ERROR:
+            raise _make_exception(*json.loads(bytes(data).decode('utf-8')))
+        return data
+
+    def get(self, formula_id) -> memoryview:
+        '''Get the MathML of a formula by its id.
+
+        Returns
+        -------
+        memoryview
+          MathML in UTF-8, without a copy.
+
+        Raises
+        ------
+        KeyError
+          If formula_id is not in the archive.
+        BlahtexException
+          If the formula was stored as an error.
+        '''
+        position = self.find(formula_id)
+        if position < 0:
+            raise KeyError(formula_id)
+        return self.get_at(position)
+
+    def get_at(self, position: int) -> memoryview:
+        '''Same as ``get()``, but by the position of the record.
+
+        Raises IndexError if position is out of range.
+        '''
+        kind, _, data, _ = self._read(self._offset(position))
+        return self._result(kind, data)
+
+    def record(self, position: int) -> ArchiveRecord:
+        '''Get the record at position as an ``ArchiveRecord``.'''
+        return self._record(self._read(self._offset(position)))
+
+    @staticmethod
+    def _record(read) -> ArchiveRecord:
+        kind, formula_id, data, _ = read
+        formula_id = bytes(formula_id).decode('utf-8')
+        if kind == _ERROR:
+            error = _make_exception(*json.loads(bytes(data).decode('utf-8')))
+            return ArchiveRecord(formula_id, None, error)
+        return ArchiveRecord(formula_id, data, None)
+
+    def _raw_records(self):
+        # The records read one after another, without the index.
+        offset = _HEADER.size
+        for _ in range(self._count):
+            read = self._read(offset)
+            offset = read[3]
+            yield read
+
+    def __iter__(self):
+        '''Iterate over the records in order, as ``ArchiveRecord``.'''
+        for read in self._raw_records():
+            yield self._record(read)
+
+    def ids(self):
+        '''Iterate over the formula ids in the order of the records.'''
+        for read in self._raw_records():
+            yield bytes(read[1]).decode('utf-8')
+
+
+def merge_archives(output: str, inputs, fsync: bool=False) -> int:
+    '''Join archives into one, as written by parallel workers.
+
+    The records are copied from the mapped inputs without decoding them,
+    in the order of inputs. When an id is in more than one input, the
+    record of the last input is found by ``get()``.
+
+    Paramters
+    ---------
+    output : str
+      Path of the new archive. It must not be one of inputs.
+    inputs : iterable of str
+      Paths of the archives.
+    fsync : bool=False
+      Flush the new archive to the disk.
+
+    Returns
+    -------
+    int
+      Number of records of the new archive.
+    '''
+    inputs = list(inputs)
+    if any(os.path.exists(output) and os.path.samefile(output, path)
+           for path in inputs):
+        raise ValueError("output must not be one of inputs")
+    with ArchiveWriter(output, fsync) as writer:
+        for path in inputs:
+            reader = ArchiveReader(path)
+            try:
+                for kind, formula_id, data, _ in reader._raw_records():
+                    writer._write(kind, formula_id, data)
+                    formula_id.release()
+                    data.release()
+            finally:
+                reader.close()
+        return len(writer)
+
+
+def main(argv=None) -> int:
+    '''Run the archive tool.'''
+    parser = argparse.ArgumentParser(
+        prog='python -m blahtex.archive',
+        description='Merge and inspect archives of MathML.')
+    commands = parser.add_subparsers(dest='command')
+    merge = commands.add_parser('merge', help='join archives into one')
+    merge.add_argument('-o', '--output', required=True,
+                       help='path of the new archive')
+    merge.add_argument('inputs', nargs='+', metavar='ARCHIVE')
+    merge.add_argument('--fsync', action='store_true',
+                       help='flush the new archive to the disk')
+    info = commands.add_parser('info', help='count records and errors')
+    info.add_argument('archive')
+    get = commands.add_parser('get', help='print the MathML of ids')
+    get.add_argument('archive')
+    get.add_argument('ids', nargs='+', metavar='ID')
+    args = parser.parse_args(argv)
+
+    if args.command == 'merge':
+        count = merge_archives(args.output, args.inputs, args.fsync)
+        sys.stderr.write('{} records in {}\n'.format(count, args.output))
+        return 0
+    if args.command == 'info':
+        with ArchiveReader(args.archive) as reader:
+            errors = sum(1 for r in reader if r.error is not None)
+            print(json.dumps({'records': len(reader), 'errors': errors,
+                              'bytes': os.path.getsize(args.archive)}))
+        return 0
+    if args.command == 'get':
+        status = 0
+        with ArchiveReader(args.archive) as reader:
+            for formula_id in args.ids:
+                try:
+                    print(str(reader.get(formula_id), 'utf-8'))
+                except KeyError:
+                    sys.stderr.write('{}: not found\n'.format(formula_id))
+                    status = 1
+                except BlahtexException as e:
+                    sys.stderr.write('{}: {}\n'.format(formula_id, e))
+                    status = 1
+        return status
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,377 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''Caches of conversion results for ``Blahtex.set_cache()``.
+
+A cache maps a key ``(TeX-string, display_math, fingerprint)`` to a
+conversion result, which is a MathML string or a ``BlahtexException``.
+``fingerprint`` is a string identifying the options of the converter.
+``LRUCache`` keeps the results in memory, and ``SQLiteCache`` keeps them
+in a file shared by processes and kept across restarts. Any object with
+``get(key)``, ``put(key, value)``, ``info()`` and ``clear()`` methods can
+be used as a cache.
+'''
+
+import collections
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from . import BlahtexException, __version__, _blahtex
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo',
+    ['hits', 'misses', 'evictions', 'currsize', 'currbytes',
+     'maxsize', 'maxbytes'])
+
+
+def _entry_size(key, value):
+    if isinstance(value, str):
+        size = sys.getsizeof(value)
+    else:
+        size = sys.getsizeof(str(value))
+    return sys.getsizeof(key[0]) + size
+
+
+class LRUCache(object):
+    '''In-memory cache discarding the least recently used entries.
+
+    Paramters
+    ---------
+    maxsize : int=1024
+      Maximum number of entries, or None for no limit.
+    maxbytes : int=None
+      Maximum memory used by the TeX-strings and the results, in bytes,
+      or None for no limit.
+    '''
+
+    def __init__(self, maxsize: int=1024, maxbytes: int=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+
+    def get(self, key):
+        '''Get the result cached for key, or None.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value) -> None:
+        '''Cache value for key, evicting old entries if necessary.'''
+        size = _entry_size(key, value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and (
+                    (self.maxsize is not None and
+                     len(self._entries) > self.maxsize) or
+                    (self.maxbytes is not None and
+                     self._bytes > self.maxbytes)):
+                _, (_, s) = self._entries.popitem(last=False)
+                self._bytes -= s
+                self._evictions += 1
+
+    def info(self) -> CacheInfo:
+        '''Get statistics of the cache.'''
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions,
+                             len(self._entries), self._bytes,
+                             self.maxsize, self.maxbytes)
+
+    def clear(self) -> None:
+        '''Remove all entries and reset the statistics.'''
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+
+def _make_exception(code: str, arguments) -> BlahtexException:
+    e = BlahtexException('{}: {}'.format(code, ', '.join(arguments)))
+    e.code = code
+    e.arguments = tuple(arguments)
+    return e
+
+
+class SQLiteCache(object):
+    '''Persistent cache stored in a SQLite database.
+
+    Many processes can use the same file at once. Entries are keyed by a
+    hash of the TeX-string, display_math, the options, the version of
+    blahtex-py and the revision of blahtexml built into it, so that results
+    of an older version of either are never returned.
+    When the file grows over ``maxbytes``, the least recently used
+    entries are removed.
+
+    Paramters
+    ---------
+    path : str
+      Path of the database file. It is created if it does not exist.
+    maxbytes : int=None
+      Maximum size of the stored results in bytes, or None for no limit.
+    timeout : float=30.0
+      Seconds to wait for a lock held by another process.
+    '''
+
+    # Access times are updated at most once in this many seconds, so that
+    # hits are usually read-only.
+    ATIME_RESOLUTION = 3600
+    # The total size is checked against maxbytes every this many puts.
+    CHECK_INTERVAL = 256
+    # Entries are evicted in batches of this many, oldest first.
+    EVICT_BATCH = 256
+
+    def __init__(self, path: str, maxbytes: int=None, timeout: float=30.0):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._evictions = 0
+        self._puts = 0
+        with self._connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results ('
+                       ' key BLOB PRIMARY KEY,'
+                       ' failed INTEGER NOT NULL,'
+                       ' value TEXT NOT NULL,'
+                       ' size INTEGER NOT NULL,'
+                       ' atime INTEGER NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_atime'
+                       ' ON results (atime)')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def _hash(key) -> bytes:
+        latex, display_math, fingerprint = key
+        h = hashlib.sha256()
+        for part in (__version__, _blahtex.blahtexml_revision, fingerprint,
+                     'D' if display_math else 'I', latex):
+            data = part.encode('utf-8')
+            h.update(str(len(data)).encode('ascii') + b':' + data)
+        return h.digest()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, BlahtexException):
+            code = getattr(value, 'code', str(value))
+            arguments = list(getattr(value, 'arguments', ()))
+            return 1, json.dumps([code, arguments])
+        return 0, value
+
+    def get(self, key):
+        '''Get the result cached for key, or None.'''
+        h = self._hash(key)
+        db = self._connection()
+        row = db.execute('SELECT failed, value, atime FROM results'
+                         ' WHERE key = ?', (h,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        failed, value, atime = row
+        now = int(time.time())
+        if now - atime > self.ATIME_RESOLUTION:
+            with db:
+                db.execute('UPDATE results SET atime = ? WHERE key = ?',
+                           (now, h))
+        if failed:
+            return _make_exception(*json.loads(value))
+        return value
+
+    def put(self, key, value) -> None:
+        '''Cache value for key.'''
+        self.put_many([(key, value)])
+
+    def put_many(self, items) -> None:
+        '''Cache many ``(key, value)`` pairs in one transaction.'''
+        rows = []
+        now = int(time.time())
+        for key, value in items:
+            failed, text = self._encode(value)
+            rows.append((self._hash(key), failed, text,
+                         len(text.encode('utf-8')), now))
+        db = self._connection()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO results'
+                           ' (key, failed, value, size, atime)'
+                           ' VALUES (?, ?, ?, ?, ?)', rows)
+        with self._lock:
+            before = self._puts
+            self._puts += len(rows)
+            check = (self._puts // self.CHECK_INTERVAL !=
+                     before // self.CHECK_INTERVAL)
+        if check:
+            self.evict()
+
+    def evict(self) -> int:
+        '''Remove least recently used entries over ``maxbytes``.
+
+        Returns
+        -------
+        int
+          Number of removed entries.
+        '''
+        if self.maxbytes is None:
+            return 0
+        db = self._connection()
+        removed = 0
+        with db:
+            total = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total <= self.maxbytes:
+                return 0
+            # Remove down to 90% of maxbytes, so that eviction does not
+            # run again on the next few puts.
+            target = total - self.maxbytes * 9 // 10
+            while target > 0:
+                # The oldest entries are found by the index on atime.
+                keys = []
+                for h, size in db.execute(
+                        'SELECT key, size FROM results ORDER BY atime'
+                        ' LIMIT ?', (self.EVICT_BATCH,)):
+                    if target <= 0:
+                        break
+                    keys.append((h,))
+                    target -= size
+                if not keys:
+                    break
+                db.executemany('DELETE FROM results WHERE key = ?', keys)
+                removed += len(keys)
+        with self._lock:
+            self._evictions += removed
+        return removed
+
+    def compact(self) -> None:
+        '''Evict old entries and give the free space back to the OS.'''
+        self.evict()
+        db = self._connection()
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        db.execute('VACUUM')
+
+    def warm(self, blahtex, source, chunksize: int=1000) -> int:
+        '''Convert a corpus and store the results which are not cached yet.
+
+        Paramters
+        ---------
+        blahtex : Blahtex
+          Converter used for the corpus. Its options are a part of keys.
+        source : str or iterable
+          Path of a text file with one inline TeX-string per line, or an
+          iterable of TeX-strings or ``(TeX-string, display_math)`` pairs.
+        chunksize : int=1000
+          Number of inputs converted and stored in one transaction.
+
+        Returns
+        -------
+        int
+          Number of newly stored entries.
+        '''
+        if isinstance(source, str):
+            with open(source, encoding='utf-8') as f:
+                return self.warm(blahtex, (line.rstrip('\r\n') for line in f
+                                           if line.strip()), chunksize)
+        fingerprint = blahtex._options_fingerprint()
+        db = self._connection()
+        stored = 0
+        chunk = []
+        source = iter(source)
+        while True:
+            for item in source:
+                if isinstance(item, str):
+                    item = (item, False)
+                chunk.append((item[0], bool(item[1])))
+                if len(chunk) >= chunksize:
+                    break
+            if not chunk:
+                return stored
+            # Keyed as Blahtex.convert() looks them up, also after
+            # set_dedup().
+            missing = collections.OrderedDict()
+            for key, item in zip(blahtex._cache_keys(chunk, fingerprint),
+                                 chunk):
+                if key not in missing and db.execute(
+                        'SELECT 1 FROM results WHERE key = ?',
+                        (self._hash(key),)).fetchone() is None:
+                    missing[key] = item
+            # Converted as by convert_many(), with the limits and stats.
+            results = blahtex._convert_many(
+                blahtex._thread_core(), list(missing.values()), None)
+            self.put_many(zip(missing, results))
+            stored += len(missing)
+            chunk = []
+
+    def info(self) -> CacheInfo:
+        '''Get statistics of the cache.
+
+        The counters are of this object, and the sizes are of the file.
+        '''
+        count, total = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions,
+                             count, total, None, self.maxbytes)
+
+    def clear(self) -> None:
+        '''Remove all entries and reset the statistics.'''
+        with self._connection() as db:
+            db.execute('DELETE FROM results')
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+    def close(self) -> None:
+        '''Close the connection of the calling thread.'''
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
@@ -0,0 +1,268 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''Command line converter of many formulas.
+
+Usage
+=====
+
+  python -m blahtex [options] [FILE ...]
+
+Each line of FILE (or of stdin) is a TeX-string, or with ``--jsonl`` (the
+default for ``*.jsonl`` files) a JSON object like
+``{"id": 12, "tex": "\\frac{1}{2}", "display": true}``. Results are
+written as JSON lines ``{"id": 12, "mathml": "<math ...>"}``, or
+``{"id": 12, "error": {"code": ..., "arguments": [...], "message": ...}}``
+if the input was not converted. With ``--archive``, the results are
+written to an archive of ``blahtex.archive`` instead. Inputs are read and
+converted chunk by chunk, so memory does not grow with the size of the
+input.
+'''
+
+import argparse
+import collections
+import enum
+import itertools
+import json
+import sys
+import time
+
+from . import Blahtex, BlahtexException, __version__
+
+_JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+
+
+def _option_arguments(parser):
+    # Arguments for the options of Blahtex, by the types of the defaults.
+    group = parser.add_argument_group('blahtex options')
+    defaults = Blahtex().get_options()
+    for name in Blahtex._OPTION_NAMES:
+        flag = '--' + name.replace('_', '-')
+        value = defaults[name]
+        if isinstance(value, bool):
+            group.add_argument(flag, dest=name, action='store_const',
+                               const=True, default=None)
+        elif isinstance(value, enum.Enum):
+            names = [m.name.lower() for m in type(value)]
+            group.add_argument(flag, dest=name, choices=names, default=None)
+        else:
+            group.add_argument(flag, dest=name, default=None,
+                               metavar='TEXT')
+
+
+def _options(args):
+    options = {}
+    defaults = Blahtex().get_options()
+    for name in Blahtex._OPTION_NAMES:
+        value = getattr(args, name)
+        if value is None:
+            continue
+        if isinstance(defaults[name], enum.Enum):
+            value = type(defaults[name])[value.upper()]
+        options[name] = value
+    return options
+
+
+def _records(paths, jsonl, display):
+    # Yields (id, TeX-string, display_math), or (id, None, error message)
+    # for a bad JSON line.
+    for path in paths:
+        is_jsonl = jsonl
+        if is_jsonl is None:
+            is_jsonl = path.endswith(_JSONL_SUFFIXES)
+        if path == '-':
+            f = sys.stdin
+        else:
+            f = open(path, encoding='utf-8')
+        try:
+            for lineno, line in enumerate(f, 1):
+                ident = lineno if len(paths) == 1 else '{}:{}'.format(
+                    path, lineno)
+                line = line.rstrip('\r\n')
+                if not line.strip():
+                    continue
+                if not is_jsonl:
+                    yield ident, line, display
+                    continue
+                try:
+                    obj = json.loads(line)
+                    tex = obj['tex']
+                    if not isinstance(tex, str):
+                        raise TypeError('"tex" must be a string')
+                    yield (obj.get('id', ident), tex,
+                           bool(obj.get('display', display)))
+                except (ValueError, TypeError, KeyError) as e:
+                    if isinstance(e, KeyError):
+                        e = 'no "tex" field'
+                    yield ident, None, 'invalid JSON line: {}'.format(e)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def _error(e):
+    if isinstance(e, BlahtexException):
+        return {'code': e.code, 'arguments': list(e.arguments),
+                'message': str(e)}
+    return {'code': type(e).__name__, 'arguments': [], 'message': str(e)}
+
+
+def _convert(records, args, options):
+    # Yields (id, result) in the order of records.  A bad JSON line is
+    # converted as an empty string, and gives a ValueError as the result.
+    pending = collections.deque()
+
+    def items():
+        for ident, tex, display in records:
+            if tex is None:
+                pending.append((ident, ValueError(display)))
+                tex, display = '', False
+            else:
+                pending.append((ident, None))
+            yield tex, display
+
+    if args.jobs == 1:
+        bt = Blahtex(**options)
+        source = items()
+
+        def results():
+            while True:
+                chunk = list(itertools.islice(source, args.chunksize))
+                if not chunk:
+                    return
+                for result in bt.convert_many(chunk):
+                    yield result
+    else:
+        from .parallel import ConverterPool
+
+        def results():
+            with ConverterPool(args.jobs or None, args.chunksize,
+                               **options) as pool:
+                for result in pool.imap(items()):
+                    yield result
+
+    for result in results():
+        ident, error = pending.popleft()
+        yield ident, result if error is None else error
+
+
+def main(argv=None) -> int:
+    '''Run the command line converter.
+
+    Returns
+    -------
+    int
+      Exit status: 0 if every input was converted, 1 otherwise.
+    '''
+    parser = argparse.ArgumentParser(
+        prog='python -m blahtex',
+        description='Convert TeX-strings to MathML, one per line.')
+    parser.add_argument('files', nargs='*', default=['-'], metavar='FILE',
+                        help='input files; "-" or none for stdin')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file; "-" (default) for stdout')
+    fmt = parser.add_mutually_exclusive_group()
+    fmt.add_argument('--jsonl', dest='jsonl', action='store_const',
+                     const=True, default=None,
+                     help='read JSON lines with "id", "tex" and "display"')
+    fmt.add_argument('--lines', dest='jsonl', action='store_const',
+                     const=False, help='read a TeX-string per line')
+    parser.add_argument('--text', action='store_true',
+                        help='write only MathML, a line per input; errors '
+                             'make empty lines and are reported to stderr')
+    parser.add_argument('--archive', action='store_true',
+                        help='write an indexed archive of blahtex.archive '
+                             'to the output file')
+    parser.add_argument('-d', '--display', action='store_true',
+                        help='convert at display-math by default')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes; 0 for the number of CPUs')
+    parser.add_argument('--chunksize', type=int, default=256,
+                        help='inputs converted at once (default 256)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not print the summary to stderr')
+    parser.add_argument('--version', action='version', version=__version__)
+    _option_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.jobs < 0 or args.chunksize < 1:
+        parser.error('--jobs and --chunksize must be positive')
+    if args.archive and (args.text or args.output == '-'):
+        parser.error('--archive needs --output and cannot be used '
+                     'with --text')
+    options = _options(args)
+
+    if args.archive:
+        from .archive import ArchiveWriter
+        out = ArchiveWriter(args.output)
+    elif args.output == '-':
+        out = sys.stdout
+    else:
+        out = open(args.output, 'w', encoding='utf-8')
+    count = errors = 0
+    start = time.perf_counter()
+    try:
+        records = _records(args.files, args.jsonl, args.display)
+        for ident, result in _convert(records, args, options):
+            count += 1
+            if args.archive:
+                errors += isinstance(result, Exception)
+                out.add(ident, result)
+                continue
+            if isinstance(result, Exception):
+                errors += 1
+                error = {'id': ident, 'error': _error(result)}
+                if args.text:
+                    out.write('\n')
+                    sys.stderr.write(json.dumps(error, ensure_ascii=False)
+                                     + '\n')
+                    continue
+                record = error
+            elif args.text:
+                out.write(result.replace('\n', ' ') + '\n')
+                continue
+            else:
+                record = {'id': ident, 'mathml': result}
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    except BaseException:
+        if args.archive:
+            out.abort()
+        raise
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        sys.stderr.write(
+            '{} formulas, {} errors in {:.3f} s ({:.0f} formulas/s)\n'.format(
+                count, errors, elapsed, count / elapsed if elapsed else 0))
+    return 1 if errors else 0
@@ -0,0 +1,184 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Conversion of columns of Arrow, NumPy and pandas.
+
+This module needs pyarrow; blahtex itself does not.
+
+Usage
+=====
+
+>> import pyarrow.parquet as pq
+>> from blahtex import Blahtex
+>> from blahtex.columnar import convert_column
+>> table = pq.read_table('formulas.parquet')
+>> mathml, errors = convert_column(Blahtex(), table['tex'],
+>>                                 display_math=table['display'])
+'''
+
+import os
+
+from . import Blahtex
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("blahtex.columnar needs pyarrow") from None
+    return pyarrow
+
+
+def _string_array(pa, column):
+    # Arrow array or chunked array of strings from a column of any kind.
+    if not isinstance(column, (pa.Array, pa.ChunkedArray)):
+        column = pa.array(column, from_pandas=True)
+    if pa.types.is_string(column.type) or \
+       pa.types.is_large_string(column.type):
+        return column
+    if pa.types.is_null(column.type) or str(column.type) == 'string_view':
+        return column.cast(pa.string())
+    raise TypeError("column must be of strings, not {}".format(column.type))
+
+
+def _display_array(pa, display_math, length):
+    # Arrow boolean array without nulls, or None if all are inline-math.
+    if display_math is None or display_math is False:
+        return None
+    if display_math is True:
+        return _all_true(pa, length)
+    if not isinstance(display_math, (pa.Array, pa.ChunkedArray)):
+        display_math = pa.array(display_math, pa.bool_(), from_pandas=True)
+    if isinstance(display_math, pa.ChunkedArray):
+        display_math = display_math.combine_chunks()
+    if len(display_math) != length:
+        raise ValueError("display_math must be as long as the column")
+    if display_math.type != pa.bool_():
+        display_math = display_math.cast(pa.bool_())
+    if display_math.null_count:
+        display_math = display_math.fill_null(False)
+    return display_math
+
+
+def _all_true(pa, length):
+    bits = pa.py_buffer(b'\xff' * ((length + 7) // 8))
+    return pa.Array.from_buffers(pa.bool_(), length, [None, bits])
+
+
+def _from_buffers(pa, length, result):
+    large, offsets, data, validity, nulls = result
+    if validity is not None:
+        validity = pa.py_buffer(validity)
+    return pa.Array.from_buffers(
+        pa.large_string() if large else pa.string(), length,
+        [validity, pa.py_buffer(offsets), pa.py_buffer(data)],
+        null_count=nulls)
+
+
+def _convert_chunk(pa, core, chunk, display, threads, limits):
+    length = len(chunk)
+    if length == 0:
+        return pa.array([], pa.string()), pa.array([], pa.string())
+    validity, offsets, data = chunk.buffers()
+    if chunk.null_count == 0:
+        validity = None
+    display_bits, display_offset = None, 0
+    if display is not None:
+        display_bits = display.buffers()[1]
+        display_offset = display.offset
+    mathml, errors = core.convert_column(
+        offsets, data, pa.types.is_large_string(chunk.type), chunk.offset,
+        length, validity, display_bits, display_offset, threads, limits)
+    return (_from_buffers(pa, length, mathml),
+            _from_buffers(pa, length, errors))
+
+
+def _chunked(pa, arrays):
+    if any(pa.types.is_large_string(a.type) for a in arrays):
+        arrays = [a.cast(pa.large_string()) for a in arrays]
+        return pa.chunked_array(arrays, pa.large_string())
+    return pa.chunked_array(arrays, pa.string())
+
+
+def convert_column(blahtex: Blahtex, column, display_math=None,
+                   threads: int=None):
+    '''Convert a column of TeX-strings to a column of MathML.
+
+    The strings are read natively from the buffers of the Arrow array,
+    without making a Python object for each of them, and converted by
+    native threads without the GIL. The options and the limits of
+    ``blahtex`` are used; its cache and stats are not.
+
+    Paramters
+    ---------
+    blahtex : Blahtex
+      Converter with the options.
+    column : pyarrow.Array, pyarrow.ChunkedArray, numpy.ndarray, ...
+      TeX-strings, as an Arrow string or large_string array, or anything
+      ``pyarrow.array()`` takes, like a NumPy unicode or object array or
+      a pandas Series. Nulls (and NaN and None of NumPy and pandas) give
+      nulls.
+    display_math : bool or column of bool=None
+      Whether each TeX-string is display-math, or one value for all.
+      Nulls are inline-math.
+    threads : int=None
+      Number of native threads. The default is the number of CPUs.
+
+    Returns
+    -------
+    (mathml, errors)
+      Arrow string arrays as long as the column (chunked arrays if the
+      column is chunked). A row has MathML in ``mathml`` and null in
+      ``errors``, or null in ``mathml`` and the message of the error,
+      like ``str(BlahtexException)``, in ``errors``. Null rows are null
+      in both.
+    '''
+    pa = _pyarrow()
+    column = _string_array(pa, column)
+    display = _display_array(pa, display_math, len(column))
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads < 1:
+        raise ValueError("threads must be positive")
+    core = blahtex._thread_core()
+    limits = blahtex._limits
+    if isinstance(column, pa.Array):
+        return _convert_chunk(pa, core, column, display, threads, limits)
+    mathml, errors = [], []
+    start = 0
+    for chunk in column.chunks:
+        part = None
+        if display is not None:
+            part = display.slice(start, len(chunk))
+        m, e = _convert_chunk(pa, core, chunk, part, threads, limits)
+        mathml.append(m)
+        errors.append(e)
+        start += len(chunk)
+    return _chunked(pa, mathml), _chunked(pa, errors)
@@ -0,0 +1,193 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''Replacement of math embedded in documents by MathML.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> from blahtex.document import DocumentConverter
+>> converter = DocumentConverter(Blahtex())
+>> with open('paper.md') as src, open('paper.html', 'w') as dst:
+>>     for chunk in converter.convert(src):
+>>         dst.write(chunk)
+'''
+
+import itertools
+import re
+
+from . import Blahtex, BlahtexException
+
+# Opening delimiter: (closing delimiter, display_math)
+DELIMITERS = {
+    '$$': ('$$', True),
+    '$': ('$', False),
+    '\\[': ('\\]', True),
+    '\\(': ('\\)', False),
+    '<math>': ('</math>', False),
+}
+
+# Closing delimiter: regex finding it after the opening one. Escaped
+# characters like ``\$`` are matched without the group, and skipped.
+_CLOSERS = {
+    '$$': re.compile(r'\\.|(\$\$)', re.S),
+    '$': re.compile(r'\\.|(\$)', re.S),
+    '\\]': re.compile(r'(\\\])|\\.', re.S),
+    '\\)': re.compile(r'(\\\))|\\.', re.S),
+    '</math>': re.compile(r'(</math>)'),
+}
+
+# Number of characters kept back at the end of a chunk, enough to see
+# the whole of any opening delimiter.
+_HOLD = max(len(d) for d in DELIMITERS) - 1
+
+
+def keep_source(latex, display_math, source, error):
+    '''Fallback leaving the math which failed to convert as it is.'''
+    return source
+
+
+class DocumentConverter(object):
+    r'''Converter replacing math in text by MathML, chunk by chunk.
+
+    Math is delimited by ``$...$``, ``\(...\)`` or ``<math>...</math>``
+    for inline-math, and by ``$$...$$`` or ``\[...\]`` for display-math.
+    ``\$`` in text is a literal dollar sign. Delimiters may be split
+    between chunks. Memory used is bounded by the chunk size and
+    ``max_math_length``, not by the size of the document.
+
+    Paramters
+    ---------
+    blahtex : Blahtex
+      Converter of the math.
+    delimiters : iterable=None
+      Opening delimiters to recognize, out of the keys of ``DELIMITERS``.
+      All of them are recognized by default.
+    fallback : callable=keep_source
+      Called as ``fallback(latex, display_math, source, error)`` when
+      ``error``, a ``BlahtexException``, is raised on conversion. It
+      returns the string written in place of ``source``, which is the
+      math including the delimiters.
+    max_math_length : int=65536
+      Math longer than this is not converted, and its opening delimiter
+      is taken as text.
+    '''
+
+    def __init__(self, blahtex: Blahtex, delimiters=None,
+                 fallback=keep_source, max_math_length: int=65536):
+        if delimiters is None:
+            delimiters = DELIMITERS
+        delimiters = sorted(delimiters, key=len, reverse=True)
+        for d in delimiters:
+            if d not in DELIMITERS:
+                raise ValueError("Unknown delimiter '{}'".format(d))
+        self.blahtex = blahtex
+        self.fallback = fallback
+        self.max_math_length = max_math_length
+        self._openers = frozenset(delimiters)
+        self._text_re = re.compile(
+            '|'.join([r'\\[\\$]'] + [re.escape(d) for d in delimiters]))
+
+    def _render(self, latex, display_math, source):
+        try:
+            return self.blahtex.convert(latex, display_math)
+        except BlahtexException as e:
+            return self.fallback(latex, display_math, source, e)
+
+    def convert(self, source):
+        '''Convert a document, yielding chunks of the result.
+
+        Paramters
+        ---------
+        source : iterable or file
+          Chunks of the document as strings, or a text file.
+        '''
+        if hasattr(source, 'read'):
+            source = iter(lambda: source.read(8192), '')
+        buf = ''
+        pos = 0        # start of the data not written yet
+        scan = 0       # where to search for the next delimiter
+        opener = None  # opening delimiter while in math
+        content = 0    # start of the math after the opening delimiter
+        for chunk in itertools.chain(source, [None]):
+            final = chunk is None
+            buf = buf[pos:] + (chunk or '')
+            scan -= pos
+            content -= pos
+            pos = 0
+            out = []
+            while True:
+                if opener is None:
+                    limit = len(buf) if final else len(buf) - _HOLD
+                    m = self._text_re.search(buf, scan)
+                    while (m is not None and m.start() < limit and
+                           m.group(0) not in self._openers):
+                        scan = m.end()
+                        m = self._text_re.search(buf, scan)
+                    if m is None or m.start() >= limit:
+                        scan = max(scan, limit)
+                        out.append(buf[pos:scan])
+                        pos = scan
+                        break
+                    out.append(buf[pos:m.start()])
+                    pos = m.start()
+                    opener = m.group(0)
+                    content = scan = m.end()
+                else:
+                    closer, display_math = DELIMITERS[opener]
+                    for m in _CLOSERS[closer].finditer(buf, scan):
+                        if m.group(1) is not None:
+                            break
+                        scan = m.end()
+                    else:
+                        m = None
+                    if m is not None:
+                        out.append(self._render(buf[content:m.start()],
+                                                display_math,
+                                                buf[pos:m.end()]))
+                        pos = scan = m.end()
+                        opener = None
+                    elif final or len(buf) - content > self.max_math_length:
+                        # Unclosed or too long; the opening delimiter is
+                        # taken as text, and the rest is scanned again.
+                        out.append(opener)
+                        pos = scan = content
+                        opener = None
+                    else:
+                        break
+            result = ''.join(out)
+            if result:
+                yield result
+
+    def convert_string(self, text: str) -> str:
+        '''Convert a whole document in a string.'''
+        return ''.join(self.convert([text]))
@@ -0,0 +1,314 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''Incremental conversion of a formula edited again and again.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> from blahtex.incremental import IncrementalSession
+>> session = IncrementalSession(Blahtex(), display_math=True)
+>> session.convert(r'\begin{aligned} a &= b \\ c &= d \end{aligned}')
+>> session.convert(r'\begin{aligned} a &= b \\ c &= d + 1 \end{aligned}')
+'''
+
+import collections
+import re
+
+from . import Blahtex, BlahtexException
+
+# Environments whose rows are separated by \\ at the top level.
+ROW_ENVIRONMENTS = frozenset([
+    'aligned', 'gathered', 'array', 'matrix', 'pmatrix', 'bmatrix',
+    'Bmatrix', 'vmatrix', 'Vmatrix', 'smallmatrix', 'cases'])
+
+# Commands changing attributes of the whole table, not only of their row.
+_TABLE_COMMANDS = frozenset([
+    '\\hline', '\\cline', '\\multicolumn', '\\tag', '\\label', '\\notag',
+    '\\nonumber'])
+
+# Commands changing the whole formula, or the meaning of what follows
+# them in other rows.
+_GLOBAL_COMMANDS = frozenset([
+    '\\strictspacing', '\\newcommand', '\\renewcommand', '\\def'])
+
+# Numbers of shapes of rows checked for a frame, before forgetting them.
+_MAX_TABLES = 256
+
+_TOKEN = re.compile(r'\\[A-Za-z]+|\\.|.', re.S)
+_BEGIN = re.compile(r'\\begin\s*\{([A-Za-z]+\*?)\}')
+_END = re.compile(r'\\end\s*\{([A-Za-z]+\*?)\}')
+_ROW_TAG = re.compile(r'<(/?)(mtable|mtr|mlabeledtr)\b[^>]*>')
+_OPEN = ('{', '\\begin', '\\left')
+_CLOSE = ('}', '\\end', '\\right')
+
+# Input split at the rows of its environment.  frame is the text around
+# the rows, columns the numbers of cells of the rows, and commands the
+# _GLOBAL_COMMANDS in the input.
+_Split = collections.namedtuple('_Split',
+                                ['frame', 'rows', 'columns', 'commands'])
+
+SessionInfo = collections.namedtuple(
+    'SessionInfo', ['full_conversions', 'row_conversions', 'reused_rows'])
+
+
+def _split(latex):
+    # Splits latex of the form "head \begin{env} rows \end{env} tail",
+    # at the first of the environments.  Returns None if it is not of the
+    # form, or if a row has anything which may change the rest of the
+    # table or the whole formula.
+    commands = set()
+    tokens = iter(_TOKEN.finditer(latex))
+    for m in tokens:
+        if m.group() in _GLOBAL_COMMANDS:
+            commands.add(m.group())
+        elif m.group() == '\\begin':
+            begin = _BEGIN.match(latex, m.start())
+            if begin and begin.group(1) in ROW_ENVIRONMENTS:
+                break
+    else:
+        return None
+    env = begin.group(1)
+    body = begin.end()
+    if env == 'array':
+        spec = re.compile(r'\s*\{[^{}]*\}').match(latex, body)
+        if spec is None:
+            return None
+        body = spec.end()
+    rows, columns = [], []
+    start, cells = body, 1
+    depth = 0
+    for m in tokens:
+        if m.start() < body:
+            continue
+        t = m.group()
+        if t in _TABLE_COMMANDS or t in _GLOBAL_COMMANDS:
+            return None
+        if depth == 0:
+            if t == '\\\\':
+                rows.append(latex[start:m.start()])
+                columns.append(cells)
+                start, cells = m.end(), 1
+                continue
+            elif t == '&':
+                cells += 1
+            elif t == '\\end':
+                end = _END.match(latex, m.start())
+                if end is None or end.group(1) != env:
+                    return None
+                rows.append(latex[start:m.start()])
+                columns.append(cells)
+                if any(row.lstrip().startswith('[') for row in rows[1:]):
+                    return None # \\[length]
+                commands.update(n.group() for n in tokens
+                                if n.group() in _GLOBAL_COMMANDS)
+                return _Split((latex[:body], latex[m.start():]),
+                              rows, tuple(columns), frozenset(commands))
+        if t in _OPEN:
+            depth += 1
+        elif t in _CLOSE:
+            depth -= 1
+            if depth < 0:
+                return None
+    return None
+
+
+def _table_rows(mathml):
+    # Finds the rows of the first table in MathML.  Returns the text
+    # before them, the rows, the separators between them and the text
+    # after them, or None.
+    tables = 0
+    rows = []
+    row_start = None
+    nested = 0
+    for m in _ROW_TAG.finditer(mathml):
+        closing, tag = m.group(1) == '/', m.group(2)
+        if tag == 'mtable':
+            if closing:
+                tables -= 1
+                if tables == 0:
+                    break
+            else:
+                tables += 1
+            continue
+        if tables != 1:
+            continue
+        if not closing:
+            if nested == 0:
+                row_start = m.start()
+            nested += 1
+        else:
+            nested -= 1
+            if nested == 0:
+                rows.append((row_start, m.end()))
+    if not rows:
+        return None
+    separators = [mathml[a[1]:b[0]] for a, b in zip(rows, rows[1:])]
+    return (mathml[:rows[0][0]], [mathml[a:b] for a, b in rows],
+            separators, mathml[rows[-1][1]:])
+
+
+class IncrementalSession(object):
+    r'''Converter of one formula under editing, reusing MathML of rows.
+
+    The input is split into the rows of its top level environment, like
+    ``aligned`` or ``array``, and the MathML of each row is kept. On the
+    next input, only the rows which changed are converted, each alone in
+    the same environment, and the MathML of the whole is made by joining
+    the rows in the table of the previous output.
+
+    The first time a shape (the text around the rows, the options, and
+    the number of rows and of cells in each row) is seen, the formula is
+    converted as a whole and the joined rows are checked to be the same
+    as it; if not, inputs of that shape are always converted as a whole.
+    So the joining is checked only on the first input of each shape, and
+    later inputs of a shape which passed are trusted to give the same
+    output as ``Blahtex.convert()``.
+    Inputs without such an environment, or with rows having commands
+    changing the whole table like ``\hline``, or the whole formula like
+    ``\strictspacing`` or ``\newcommand``, are converted as a whole too.
+    Rows are the smallest parts reused, since blahtex lays out a cell by
+    its column and spaces a group by its neighbours.
+
+    Paramters
+    ---------
+    blahtex : Blahtex
+      Converter used with its options.
+    display_math : bool=False
+      Same as ``Blahtex.convert()``.
+    '''
+
+    def __init__(self, blahtex: Blahtex, display_math: bool=False):
+        self.blahtex = blahtex
+        self.display_math = display_math
+        self._frame = None   # frame and options of the rows below
+        self._rows = {}      # row -> MathML of the row
+        self._tables = {}    # numbers of cells -> (head, separator, tail)
+        self._last = (None, None, None)
+        self._full = self._converted = self._reused = 0
+
+    def _convert_whole(self, latex):
+        self._full += 1
+        return self.blahtex.convert(latex, self.display_math)
+
+    def _fragments(self, split):
+        # MathML of each row, converting the new ones alone.  None if a
+        # row fails or does not make one row.
+        missing = [row for row in set(split.rows) if row not in self._rows]
+        head, tail = split.frame
+        results = self.blahtex.convert_many(
+            [(head + row + tail, self.display_math) for row in missing])
+        rows = {}
+        for row, result in zip(missing, results):
+            if isinstance(result, BlahtexException):
+                return None
+            table = _table_rows(result)
+            if table is None or len(table[1]) != 1:
+                return None
+            rows[row] = table[1][0]
+        self._converted += len(missing)
+        self._reused += len(split.rows) - len(missing)
+        for row in split.rows:
+            if row not in rows:
+                rows[row] = self._rows[row]
+        self._rows = rows
+        return [rows[row] for row in split.rows]
+
+    def _learn(self, latex, split):
+        # Converts latex as a whole, and checks whether its rows can be
+        # joined for the numbers of cells.
+        mathml = self._convert_whole(latex)
+        self._tables[split.columns] = None
+        table = _table_rows(mathml)
+        if table is None or len(table[1]) != len(split.rows):
+            return mathml
+        head, rows, separators, tail = table
+        if len(set(separators)) > 1 or self._fragments(split) != rows:
+            return mathml
+        self._tables[split.columns] = (
+            head, separators[0] if separators else '', tail)
+        return mathml
+
+    def convert(self, latex: str) -> str:
+        '''Convert the formula as edited.
+
+        Returns
+        -------
+        str
+          MathML, the same as ``Blahtex.convert(latex, display_math)``.
+
+        Raises
+        ------
+        BlahtexException
+          If latex is not recognized by blahtex.
+        '''
+        fingerprint = self.blahtex._options_fingerprint()
+        last_latex, last_fingerprint, last_mathml = self._last
+        if latex == last_latex and fingerprint == last_fingerprint:
+            return last_mathml
+        split = _split(latex)
+        if split is None:
+            mathml = self._convert_whole(latex)
+        else:
+            frame = (split.frame, split.commands, fingerprint)
+            if frame != self._frame:
+                self._frame, self._rows, self._tables = frame, {}, {}
+            elif len(self._tables) > _MAX_TABLES:
+                self._tables = {}
+            if split.columns not in self._tables:
+                mathml = self._learn(latex, split)
+            elif self._tables[split.columns] is None:
+                mathml = self._convert_whole(latex)
+            else:
+                mathml = self._join(latex, split)
+        self._last = (latex, fingerprint, mathml)
+        return mathml
+
+    def _join(self, latex, split):
+        fragments = self._fragments(split)
+        if fragments is None:
+            # let blahtex report the error of the whole
+            return self._convert_whole(latex)
+        head, separator, tail = self._tables[split.columns]
+        return head + separator.join(fragments) + tail
+
+    def info(self) -> SessionInfo:
+        '''Get counts of conversions of whole formulas and of rows, and of
+        rows reused.'''
+        return SessionInfo(self._full, self._converted, self._reused)
+
+    def reset(self) -> None:
+        '''Forget the previous input and the MathML of its rows.'''
+        self._frame = None
+        self._rows = {}
+        self._tables = {}
+        self._last = (None, None, None)
@@ -0,0 +1,184 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''Macro preambles compiled once and shared by conversions.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> bl = Blahtex()
+>> macros = bl.compile_macros(r'\newcommand{\R}{\mathbb{R}}'
+>>                            r'\newcommand{\norm}[1]{\left\| #1 \right\|}')
+>> bl.convert(r'\norm{x} \in \R', macros=macros)
+'''
+
+import re
+
+_CONTROL_SEQUENCE = re.compile(r'\\(?:[A-Za-z]+|.)', re.S)
+_SPACES = re.compile(r'(?:\s|%[^\n]*(?:\n|$))*')
+_NEWCOMMAND = re.compile(r'\\newcommand(?![A-Za-z])')
+_ARGUMENT_COUNT = re.compile(r'\[\s*([1-9])\s*\]')
+
+
+def _skip_spaces(tex, pos):
+    return _SPACES.match(tex, pos).end()
+
+
+def _group(tex, pos):
+    # Returns the end of the brace group starting at pos.
+    if pos >= len(tex) or tex[pos] != '{':
+        raise ValueError("'{{' expected at {}".format(pos))
+    depth = 0
+    while pos < len(tex):
+        c = tex[pos]
+        if c == '\\':
+            pos += 2
+            continue
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    raise ValueError('unbalanced braces in macro definition')
+
+
+def parse_definitions(tex: str) -> list:
+    r'''Split a preamble into ``(name, definition)`` pairs.
+
+    The preamble must consist of ``\newcommand`` definitions only,
+    separated by spaces or comments.
+
+    Raises
+    ------
+    ValueError
+      If the preamble has anything else.
+    '''
+    definitions = []
+    pos = _skip_spaces(tex, 0)
+    while pos < len(tex):
+        m = _NEWCOMMAND.match(tex, pos)
+        if m is None:
+            raise ValueError(
+                r'only \newcommand is allowed in a macro preamble, '
+                'found {!r}'.format(tex[pos:pos + 20]))
+        start = pos
+        pos = _skip_spaces(tex, m.end())
+        if tex.startswith('{', pos):
+            end = _group(tex, pos)
+            name = tex[pos + 1:end - 1].strip()
+        else:
+            n = _CONTROL_SEQUENCE.match(tex, pos)
+            if n is None:
+                raise ValueError('macro name expected at {}'.format(pos))
+            end = n.end()
+            name = n.group(0)
+        if _CONTROL_SEQUENCE.fullmatch(name) is None:
+            raise ValueError('bad macro name {!r}'.format(name))
+        pos = _skip_spaces(tex, end)
+        n = _ARGUMENT_COUNT.match(tex, pos)
+        if n is not None:
+            pos = _skip_spaces(tex, n.end())
+        pos = _group(tex, pos)
+        definitions.append((name, tex[start:pos]))
+        pos = _skip_spaces(tex, pos)
+    return definitions
+
+
+class MacroSet(object):
+    r'''Immutable table of macros compiled from a preamble.
+
+    Made by ``Blahtex.compile_macros()``. Instead of the whole preamble,
+    a conversion using a MacroSet is given only the definitions of the
+    macros which the formula uses, directly or through other macros, so
+    that each formula pays only for what it uses.
+    '''
+
+    __slots__ = ('_definitions', '_order', '_closure')
+
+    def __init__(self, tex: str):
+        definitions = parse_definitions(tex)
+        order = {}
+        bodies = {}
+        for i, (name, definition) in enumerate(definitions):
+            order[name] = i
+            bodies[name] = definition
+        # Macros needed by each macro, including itself.
+        uses = {}
+        for name, definition in bodies.items():
+            uses[name] = set(cs for cs in _CONTROL_SEQUENCE.findall(
+                definition) if cs in bodies and cs != name)
+        closure = {}
+        for name in bodies:
+            needed = set()
+            stack = [name]
+            while stack:
+                n = stack.pop()
+                if n not in needed:
+                    needed.add(n)
+                    stack.extend(uses[n])
+            closure[name] = frozenset(needed)
+        object.__setattr__(self, '_definitions', bodies)
+        object.__setattr__(self, '_order', order)
+        object.__setattr__(self, '_closure', closure)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("MacroSet is immutable")
+
+    def __len__(self):
+        return len(self._definitions)
+
+    def __contains__(self, name):
+        return name in self._definitions
+
+    @property
+    def names(self) -> frozenset:
+        '''Names of the macros, like ``'\\R'``.'''
+        return frozenset(self._definitions)
+
+    def preamble_for(self, latex: str) -> str:
+        '''Get the definitions needed by latex, in the order of the preamble.'''
+        needed = set()
+        closure = self._closure
+        for cs in set(_CONTROL_SEQUENCE.findall(latex)):
+            c = closure.get(cs)
+            if c is not None:
+                needed.update(c)
+        if not needed:
+            return ''
+        return ''.join(self._definitions[name]
+                       for name in sorted(needed, key=self._order.get))
+
+    def apply(self, latex: str) -> str:
+        '''Get latex prefixed by the definitions it needs.'''
+        return self.preamble_for(latex) + latex
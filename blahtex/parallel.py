@@ -0,0 +1,196 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''Conversion with a pool of worker processes.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> from blahtex.parallel import ConverterPool
+>> with ConverterPool(spacing=Blahtex.SPACING.STRICT) as pool:
+>>     for mathml in pool.imap(formulas, chunksize=200):
+>>         ...
+'''
+
+import collections
+import concurrent.futures
+import itertools
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from . import Blahtex
+
+_WARMUP_INPUT = r'\frac{1}{2}'
+
+# Blahtex object of a worker process, created by _init_worker().
+_converter = None
+
+
+def _init_worker(options, limits):
+    global _converter
+    _converter = Blahtex(**options)
+    _converter.set_limits(**limits)
+    _converter.convert(_WARMUP_INPUT)
+
+
+def _convert_chunk(chunk):
+    return _converter.convert_many(chunk)
+
+
+class ConverterPool(object):
+    '''Pool of worker processes converting TeX-strings to MathML.
+
+    Each worker builds one Blahtex object from a snapshot of options when
+    it starts, and converts the inputs sent to it in chunks.
+
+    Paramters
+    ---------
+    processes : int=None
+      Number of worker processes. The default is the number of CPUs.
+    chunksize : int=100
+      Number of inputs sent to a worker at once.
+    max_pending : int=None
+      Number of chunks submitted ahead of the one being returned.
+      The default is twice the number of worker processes.
+    blahtex : Blahtex=None
+      Options and limits of the workers are copied from this object.
+    **opts
+      Options of the workers, overriding the ones of ``blahtex``.
+    '''
+
+    def __init__(self, processes: int=None, chunksize: int=100,
+                 max_pending: int=None, blahtex: Blahtex=None, **opts):
+        if chunksize < 1:
+            raise ValueError("chunksize must be positive")
+        options = {}
+        limits = {}
+        if blahtex is not None:
+            options.update(blahtex.get_options())
+            limits = blahtex.get_limits()
+        options.update(opts)
+        Blahtex(**options) # validate options here, not in the workers
+        self._options = options
+        self._limits = limits
+        self._processes = processes or os.cpu_count() or 1
+        self._executor = self._new_executor()
+        if max_pending is None:
+            max_pending = 2 * self._processes
+        self.chunksize = chunksize
+        self.max_pending = max(1, max_pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self._processes,
+            initializer=_init_worker,
+            initargs=(self._options, self._limits))
+
+    def _restart(self):
+        self._executor.shutdown(wait=False)
+        self._executor = self._new_executor()
+
+    def _isolate(self, chunk):
+        # Convert one by one the inputs of a chunk which broke the pool
+        # twice; only the input killing a worker gets the error.
+        results = []
+        for item in chunk:
+            try:
+                future = self._executor.submit(_convert_chunk, [item])
+                results.extend(future.result())
+            except BrokenProcessPool as e:
+                self._restart()
+                results.append(e)
+        return results
+
+    def imap(self, items, chunksize: int=None):
+        '''Convert TeX-strings lazily, keeping the order of the inputs.
+
+        Paramters
+        ---------
+        items : iterable
+          TeX-strings, or pairs of ``(TeX-string, display_math)``.
+        chunksize : int=None
+          Overrides ``chunksize`` of the pool.
+
+        Returns
+        -------
+        iterator
+          MathML string for each input. As ``Blahtex.convert_many()``,
+          an input not recognized by blahtex gives a ``BlahtexException``
+          instead of a string. When a worker process dies, the pool is
+          restarted and the chunk is retried; an input which kills a worker
+          again gives a ``BrokenProcessPool`` exception.
+        '''
+        chunksize = chunksize or self.chunksize
+        items = iter(items)
+        pending = collections.deque()
+
+        def submit_next():
+            chunk = list(itertools.islice(items, chunksize))
+            if chunk:
+                future = self._executor.submit(_convert_chunk, chunk)
+                pending.append((chunk, future, False))
+            return bool(chunk)
+
+        while len(pending) < self.max_pending and submit_next():
+            pass
+        while pending:
+            chunk, future, retried = pending.popleft()
+            try:
+                results = future.result()
+            except BrokenProcessPool:
+                self._restart()
+                resubmitted = [
+                    (c, self._executor.submit(_convert_chunk, c), r)
+                    for c, _, r in pending]
+                pending.clear()
+                pending.extend(resubmitted)
+                if not retried:
+                    future = self._executor.submit(_convert_chunk, chunk)
+                    pending.appendleft((chunk, future, True))
+                    continue
+                results = self._isolate(chunk)
+            for result in results:
+                yield result
+            submit_next()
+
+    def map(self, items, chunksize: int=None) -> list:
+        '''Same as ``imap()``, but returns a list.'''
+        return list(self.imap(items, chunksize))
+
+    def close(self) -> None:
+        '''Shut down the worker processes.'''
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,221 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+r'''Purified TeX of many formulas in one document, one page per formula.
+
+Each document is typeset by one run of LaTeX, and every formula is in its
+own ``preview`` environment, so it is a page of the output (PDF or DVI)
+which can be cut into an image.
+
+Usage
+=====
+
+>> from blahtex import Blahtex
+>> from blahtex.preview import preview_documents
+>> bt = Blahtex(use_preview_package=True)
+>> for n, doc in enumerate(preview_documents(bt, formulas.items())):
+>>     with open('batch{}.tex'.format(n), 'w') as f:
+>>         f.write(doc.tex)
+>>     for formula_id, page in doc.pages.items():
+>>         ... # page.page of batch{n}.pdf is the image of formula_id
+'''
+
+import collections
+import hashlib
+
+from . import Blahtex, BlahtexException
+
+_BEGIN_DOCUMENT = '\\begin{document}'
+_END_DOCUMENT = '\\end{document}'
+_PREVIEW_PACKAGE = '\\usepackage[active,tightpage]{preview}'
+
+PreviewPage = collections.namedtuple(
+    'PreviewPage', ['document', 'page', 'marker'])
+PreviewPage.__doc__ = '''Place of a formula in the output of preview_documents().
+
+document
+    Index of the document, counted from 0.
+page
+    Page of the formula in the output of the document, counted from 1.
+marker
+    Name of the formula written to the TeX log as ``blahtex-marker:NAME``
+    before its page. It is made from the formula id and the purified TeX,
+    so it is unique in a document, even for formulas of the same TeX, and
+    the same for the same id, formula and options in every run.
+'''
+
+
+class PreviewDocument(object):
+    '''A LaTeX document made by ``preview_documents()``.
+
+    Attributes
+    ----------
+    tex : str
+      The whole LaTeX document.
+    pages : collections.OrderedDict
+      PreviewPage of each formula id, in the order of the pages.
+    errors : dict
+      BlahtexException of each formula id which blahtex did not accept.
+      The formula is not in the document.
+    '''
+
+    __slots__ = ('tex', 'pages', 'errors')
+
+    def __init__(self, tex: str, pages, errors):
+        self.tex = tex
+        self.pages = pages
+        self.errors = errors
+
+    def __repr__(self):
+        return '<PreviewDocument of {} pages, {} errors>'.format(
+            len(self.pages), len(self.errors))
+
+
+def _split_document(purified):
+    # (preamble lines, body) of a document made by get_purified_tex().
+    begin = purified.index(_BEGIN_DOCUMENT)
+    end = purified.rindex(_END_DOCUMENT)
+    preamble = purified[:begin].splitlines()
+    body = purified[begin + len(_BEGIN_DOCUMENT):end].strip('\n')
+    return [line for line in preamble if line.strip()], body
+
+
+def _merge_preamble(merged, lines):
+    # Adds the lines not in merged yet, each after the line before it in
+    # lines, so that packages stay in the order blahtex writes them.
+    seen = set(merged)
+    at = 0
+    for line in lines:
+        if line in seen:
+            at = merged.index(line) + 1
+        else:
+            merged.insert(at, line)
+            seen.add(line)
+            at += 1
+
+
+class _Builder(object):
+
+    def __init__(self, index):
+        self.index = index
+        self.preamble = []
+        self.bodies = []
+        self.pages = collections.OrderedDict()
+        self.errors = {}
+        self.size = 0
+
+    def add(self, formula_id, preamble, body):
+        _merge_preamble(self.preamble, preamble)
+        self.size += len(body.encode('utf-8'))
+        # The id is a part of the marker, so that formulas of the same TeX
+        # on different pages have different markers.
+        name = '{!r}\n{}'.format(formula_id, body)
+        marker = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        if '\\begin{preview}' not in body:
+            body = '\\begin{preview}\n' + body + '\n\\end{preview}'
+        text = '\\typeout{{blahtex-marker:{}}}\n{}\n'.format(marker, body)
+        self.bodies.append(text)
+        self.pages[formula_id] = PreviewPage(
+            self.index, len(self.pages) + 1, marker)
+
+    def document(self):
+        preamble = list(self.preamble)
+        if not any(line.rstrip().endswith('{preview}') for line in preamble):
+            preamble.append(_PREVIEW_PACKAGE)
+        tex = ''.join(['\n'.join(preamble), '\n', _BEGIN_DOCUMENT, '\n'] +
+                      self.bodies + [_END_DOCUMENT, '\n'])
+        return PreviewDocument(tex, self.pages, self.errors)
+
+
+def preview_documents(blahtex: Blahtex, items, max_formulas: int=1000,
+                      max_size: int=4 << 20):
+    '''Make LaTeX documents with the purified TeX of many formulas.
+
+    The preamble of ``get_purified_tex()`` (with ``latex_preamble`` and
+    the packages chosen by ``use_ucs_package``, ``use_cjk_package``,
+    ``use_preview_package`` and ``japanese_font``) is written once in
+    each document, and each formula is in its own ``preview``
+    environment, after a ``\\typeout`` of its marker. The preview package
+    is loaded with ``active,tightpage`` if the preamble does not load it.
+
+    Paramters
+    ---------
+    blahtex : Blahtex
+      Converter with the options of the formulas.
+    items : iterable or dict
+      Pairs of ``(id, TeX-string)`` or triples of ``(id, TeX-string,
+      display_math)``, or a dict of TeX-strings by id. The ids are
+      hashable, and unique.
+    max_formulas : int=1000
+      Maximum number of formulas of a document.
+    max_size : int=4194304
+      A new document is started when the bodies of the formulas in a
+      document would be larger than this, in bytes of UTF-8. A formula
+      larger than this is in a document alone.
+
+    Returns
+    -------
+    iterator
+      PreviewDocument, made when it is full or at the end of the items.
+      A formula not accepted by blahtex is in ``errors`` of the document
+      being made.
+    '''
+    if max_formulas < 1:
+        raise ValueError("max_formulas must be positive")
+    if isinstance(items, dict):
+        items = items.items()
+    builder = _Builder(0)
+    for item in items:
+        formula_id, latex = item[0], item[1]
+        display_math = item[2] if len(item) > 2 else False
+        try:
+            blahtex.process_input(latex, display_math)
+            purified = blahtex.get_purified_tex()
+        except BlahtexException as e:
+            builder.errors[formula_id] = e
+            continue
+        preamble, body = _split_document(purified)
+        size = len(body.encode('utf-8'))
+        if builder.pages and (len(builder.pages) >= max_formulas or
+                              builder.size + size > max_size):
+            yield builder.document()
+            builder = _Builder(builder.index + 1)
+        builder.add(formula_id, preamble, body)
+    if builder.pages or builder.errors:
+        yield builder.document()
+
+
+def preview_document(blahtex: Blahtex, items) -> PreviewDocument:
+    '''Same as ``preview_documents()``, but makes a single document.'''
+    for document in preview_documents(blahtex, items,
+                                      max_formulas=float('inf'),
+                                      max_size=float('inf')):
+        return document
+    return _Builder(0).document()
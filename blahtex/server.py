@@ -0,0 +1,421 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+r'''HTTP/JSON server converting TeX-strings, for programs not in Python.
+
+Usage
+=====
+
+  python -m blahtex.server [--host HOST] [--port PORT | --unix PATH]
+                           [-w WORKERS] [blahtex options]
+
+Endpoints
+---------
+
+POST /convert
+    ``{"tex": "\\sqrt{2}", "display": false}`` gives ``{"mathml": ...}``,
+    or status 422 and ``{"error": {"code", "arguments", "message"}}``.
+POST /convert_many
+    ``{"items": ["x^2", {"id": 1, "tex": "y", "display": true}, ...]}``
+    gives ``{"results": [{"mathml": ...}, {"id": 1, "error": ...}, ...]}``
+    in the order of the items.
+GET /metrics
+    Counts of requests, errors and conversions, histograms of the
+    latency of requests and the resident memory of the process, in the
+    text format of Prometheus.
+GET /health
+    ``{"status": "ok"}``.
+
+Connections are kept alive (HTTP/1.1), and requests sent one after
+another on a connection without waiting for the responses are answered
+in order.
+'''
+
+import argparse
+import bisect
+import concurrent.futures
+import http.server
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from . import Blahtex, BlahtexException, _blahtex
+
+_WARMUP_INPUT = r'\frac{1}{2}'
+
+# Upper bounds of the buckets of latency histograms, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5)
+
+
+class Metrics(object):
+    '''Counters and latency histograms of a server, by endpoint.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}   # (endpoint, status) -> count
+        self._latency = {}    # endpoint -> [bucket counts, sum, count]
+        self._conversions = 0
+        self._errors = {}     # error code -> count
+
+    def record_request(self, endpoint: str, status: int,
+                       seconds: float) -> None:
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            hist = self._latency.get(endpoint)
+            if hist is None:
+                hist = self._latency[endpoint] = [
+                    [0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            hist[0][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            hist[1] += seconds
+            hist[2] += 1
+
+    def record_results(self, results) -> None:
+        with self._lock:
+            for result in results:
+                self._conversions += 1
+                if isinstance(result, BlahtexException):
+                    code = result.code
+                    self._errors[code] = self._errors.get(code, 0) + 1
+
+    def as_dict(self) -> dict:
+        '''Get a snapshot of the metrics.'''
+        with self._lock:
+            return {
+                'requests': dict(self._requests),
+                'latency': {k: (list(v[0]), v[1], v[2])
+                            for k, v in self._latency.items()},
+                'conversions': self._conversions,
+                'conversion_errors': dict(self._errors),
+            }
+
+    def exposition(self) -> str:
+        '''Get the metrics in the text format of Prometheus.'''
+        m = self.as_dict()
+        lines = [
+            '# TYPE blahtex_requests_total counter',
+        ]
+        for (endpoint, status), n in sorted(m['requests'].items()):
+            lines.append('blahtex_requests_total{endpoint="%s",status="%d"} %d'
+                         % (endpoint, status, n))
+        lines.append('# TYPE blahtex_conversions_total counter')
+        lines.append('blahtex_conversions_total %d' % m['conversions'])
+        lines.append('# TYPE blahtex_conversion_errors_total counter')
+        for code, n in sorted(m['conversion_errors'].items()):
+            lines.append('blahtex_conversion_errors_total{code="%s"} %d'
+                         % (code, n))
+        lines.append('# TYPE blahtex_request_seconds histogram')
+        for endpoint, (buckets, total, count) in sorted(m['latency'].items()):
+            cumulative = 0
+            bounds = [repr(b) for b in LATENCY_BUCKETS] + ['+Inf']
+            for bound, n in zip(bounds, buckets):
+                cumulative += n
+                lines.append('blahtex_request_seconds_bucket'
+                             '{endpoint="%s",le="%s"} %d'
+                             % (endpoint, bound, cumulative))
+            lines.append('blahtex_request_seconds_sum{endpoint="%s"} %r'
+                         % (endpoint, total))
+            lines.append('blahtex_request_seconds_count{endpoint="%s"} %d'
+                         % (endpoint, count))
+        resident, peak = _blahtex.resident_memory()
+        for name, value in (('resident_memory_bytes', resident),
+                            ('peak_resident_memory_bytes', peak)):
+            if value is not None:
+                lines.append('# TYPE blahtex_%s gauge' % name)
+                lines.append('blahtex_%s %d' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class _BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _error(e):
+    return {'code': e.code, 'arguments': list(e.arguments),
+            'message': str(e)}
+
+
+def _read_item(item):
+    # (id or None, TeX-string, display_math) of an item of a request.
+    if isinstance(item, str):
+        ident, tex, display = None, item, False
+    elif isinstance(item, dict) and isinstance(item.get('tex'), str):
+        ident, tex = item.get('id'), item['tex']
+        display = bool(item.get('display', False))
+    else:
+        raise _BadRequest(400, 'an item must be a string or an object with '
+                               'a "tex" string')
+    try:
+        tex.encode('utf-8')
+    except UnicodeEncodeError:
+        # JSON may escape lone surrogates, which are not characters
+        raise _BadRequest(400, 'a "tex" string must be valid Unicode')
+    return ident, tex, display
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'blahtex'
+
+    def address_string(self):
+        # client_address is empty on Unix sockets
+        return self.client_address[0] if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_error(self, status, code, message):
+        return self._send(status, {'error': {
+            'code': code, 'arguments': [], 'message': message}})
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return status
+
+    def _read_json(self):
+        # The body is not read on errors here, so the connection is closed.
+        length = self.headers.get('Content-Length')
+        self.close_connection = True
+        if length is None:
+            raise _BadRequest(411, 'Content-Length is required')
+        try:
+            length = int(length)
+        except ValueError:
+            raise _BadRequest(400, 'bad Content-Length')
+        if length < 0 or length > self.server.max_body:
+            raise _BadRequest(413, 'request body is too large')
+        self.close_connection = False
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError as e:
+            raise _BadRequest(400, 'bad JSON: {}'.format(e))
+
+    def _convert(self):
+        request = self._read_json()
+        if not isinstance(request, dict):
+            raise _BadRequest(400, 'request must be an object')
+        _, tex, display = _read_item(request)
+        result = self.server.convert_many([(tex, display)])[0]
+        if isinstance(result, BlahtexException):
+            return self._send(422, {'error': _error(result)})
+        return self._send(200, {'mathml': result})
+
+    def _convert_many(self):
+        request = self._read_json()
+        items = request.get('items') if isinstance(request, dict) else None
+        if not isinstance(items, list):
+            raise _BadRequest(400, 'request must have a list of "items"')
+        items = [_read_item(item) for item in items]
+        results = self.server.convert_many([i[1:] for i in items])
+        response = []
+        for (ident, _, _), result in zip(items, results):
+            if isinstance(result, BlahtexException):
+                r = {'error': _error(result)}
+            else:
+                r = {'mathml': result}
+            if ident is not None:
+                r['id'] = ident
+            response.append(r)
+        return self._send(200, {'results': response})
+
+    _ROUTES = {
+        ('POST', '/convert'): _convert,
+        ('POST', '/convert_many'): _convert_many,
+        ('GET', '/metrics'): lambda self: self._send(
+            200, self.server.metrics.exposition().encode('utf-8'),
+            'text/plain; version=0.0.4'),
+        ('GET', '/health'): lambda self: self._send(200, {'status': 'ok'}),
+    }
+
+    def _handle(self, method):
+        start = time.perf_counter()
+        path = self.path.split('?', 1)[0]
+        route = self._ROUTES.get((method, path))
+        endpoint = path.lstrip('/') if route is not None else 'other'
+        status = 500
+        try:
+            if route is None:
+                raise _BadRequest(404, 'no such endpoint')
+            status = route(self)
+        except _BadRequest as e:
+            status = self._send_error(e.status, 'BadRequest', str(e))
+        except Exception as e:
+            # The request may be left unread, so the connection is closed.
+            self.log_error('error on %s: %r', path, e)
+            self.close_connection = True
+            status = self._send_error(500, 'InternalError', str(e))
+        finally:
+            self.server.metrics.record_request(
+                endpoint, status, time.perf_counter() - start)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class ConversionServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''HTTP server converting TeX-strings with a pool of warmed threads.
+
+    Each connection is served by its own thread, and conversions run on
+    a fixed pool of worker threads. The workers keep their native
+    blahtex cores (see ``Blahtex``), which are warmed up before the server
+    accepts requests, and convert without holding the GIL.
+
+    Paramters
+    ---------
+    address : (str, int) or str
+      Host and port to listen on, or the path of a Unix socket.
+    workers : int=None
+      Number of worker threads. The default is the number of CPUs.
+    blahtex : Blahtex=None
+      Converter with the options of the server. Its limits set by
+      ``set_limits()`` apply to requests too.
+    max_body : int=16777216
+      Maximum size of a request body in bytes.
+    verbose : bool=False
+      Log each request to stderr.
+    **opts
+      Options of a Blahtex made when ``blahtex`` is not given.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, address, workers: int=None, blahtex: Blahtex=None,
+                 max_body: int=16 << 20, verbose: bool=False, **opts):
+        if isinstance(address, str):
+            self.address_family = socket.AF_UNIX
+        self.blahtex = blahtex if blahtex is not None else Blahtex(**opts)
+        self.metrics = Metrics()
+        self.max_body = max_body
+        self.verbose = verbose
+        workers = workers or os.cpu_count() or 1
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+        try:
+            self._warm_up(workers)
+            super().__init__(address, _Handler)
+        except BaseException:
+            self._executor.shutdown(wait=False)
+            raise
+
+    def _warm_up(self, workers):
+        # Starts every worker thread and converts once on each of them.
+        barrier = threading.Barrier(workers)
+
+        def warm_up():
+            self.blahtex.convert(_WARMUP_INPUT)
+            barrier.wait()
+
+        for future in [self._executor.submit(warm_up)
+                       for _ in range(workers)]:
+            future.result()
+
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            socketserver.TCPServer.server_bind(self)
+            self.server_name = 'localhost'
+            self.server_port = 0
+        else:
+            super().server_bind()
+
+    def convert_many(self, items) -> list:
+        '''Convert ``(TeX-string, display_math)`` pairs on a worker.'''
+        results = self._executor.submit(
+            self.blahtex.convert_many, items).result()
+        self.metrics.record_results(results)
+        return results
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+        if self.address_family == socket.AF_UNIX:
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+
+def main(argv=None) -> None:
+    '''Run the server until interrupted.'''
+    from .cli import _option_arguments, _options
+    parser = argparse.ArgumentParser(
+        prog='python -m blahtex.server',
+        description='Serve conversion of TeX-strings over HTTP/JSON.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix socket instead of TCP')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker threads (default: number of CPUs)')
+    parser.add_argument('--max-body', type=int, default=16 << 20,
+                        help='maximum request body in bytes')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log requests to stderr')
+    parser.add_argument('--release-trees', action='store_true',
+                        help='free the trees of each conversion when done')
+    limits = parser.add_argument_group('limits of each conversion')
+    for name in Blahtex._LIMIT_NAMES:
+        limits.add_argument('--' + name.replace('_', '-'), dest=name,
+                            type=float if name == 'deadline' else int)
+    _option_arguments(parser)
+    args = parser.parse_args(argv)
+
+    bt = Blahtex(**_options(args))
+    bt.set_limits(**{name: getattr(args, name)
+                     for name in Blahtex._LIMIT_NAMES})
+    bt.set_release_trees(args.release_trees)
+    address = args.unix if args.unix else (args.host, args.port)
+    with ConversionServer(address, args.workers, bt, args.max_body,
+                          args.verbose) as server:
+        print('Serving on {}'.format(args.unix or 'http://{}:{}/'.format(
+            *server.server_address[:2])), flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020, MURAMATSU Atshshi
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+'''Instrumentation of conversions, enabled by ``Blahtex.enable_stats()``.'''
+
+import collections
+import threading
+
+ConversionStats = collections.namedtuple(
+    'ConversionStats',
+    ['input_length', 'tokens', 'macro_definitions', 'macro_expansions',
+     'max_depth', 'parse_time', 'mathml_time', 'wrap_time', 'nodes',
+     'output_length', 'error'])
+ConversionStats.__doc__ = '''Stats of one conversion.
+
+input_length, output_length
+    Length of the TeX-string and of the MathML, in characters.
+tokens, macro_definitions, macro_expansions, max_depth
+    Counts of the TeX-string: tokens, ``\\newcommand`` definitions,
+    expansions of those macros including nested ones, and the deepest
+    nesting of groups, environments and ``\\left``/``\\right``.
+parse_time
+    Seconds of tokenizing, macro expansion, parsing and layout.
+mathml_time
+    Seconds of building the MathML tree and encoding it to XML.
+wrap_time
+    Seconds of building the ``<math>`` element.
+nodes
+    Number of MathML elements.
+error
+    Error code if the conversion failed, otherwise None.
+'''
+
+
+class PipelineStats(object):
+    '''Totals of the stats of conversions of a Blahtex object.'''
+
+    FIELDS = ('conversions', 'errors', 'input_length', 'tokens',
+              'macro_expansions', 'nodes', 'output_length',
+              'parse_time', 'mathml_time', 'wrap_time')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, stats: ConversionStats) -> None:
+        '''Add stats of a conversion to the totals.'''
+        with self._lock:
+            t = self._totals
+            t['conversions'] += 1
+            if stats.error is not None:
+                t['errors'] += 1
+            for key in self.FIELDS[2:]:
+                t[key] += getattr(stats, key)
+
+    def as_dict(self) -> dict:
+        '''Get a snapshot of the totals.'''
+        with self._lock:
+            return dict(self._totals)
+
+    def reset(self) -> None:
+        '''Set all the totals to zero.'''
+        with self._lock:
+            self._totals = dict.fromkeys(self.FIELDS, 0)
+
+    def __getattr__(self, key):
+        if key in PipelineStats.FIELDS:
+            return self.as_dict()[key]
+        raise AttributeError(key)
+
+    def __repr__(self):
+        return 'PipelineStats({})'.format(', '.join(
+            '{}={!r}'.format(k, v) for k, v in self.as_dict().items()))
@@ -69,6 +69,36 @@ def has_flag(compiler, flagname):
     return True
 
 
+def blahtexml_revision():
+    """Return the revision of the blahtexml submodule.
+
+    It is built into the extension as ``blahtexml_revision``, so that
+    results stored by another blahtex core are not reused. A hash of the
+    sources is used when the submodule is not a git checkout.
+    """
+    import hashlib
+    import os
+    import subprocess
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'blahtexml')
+    if os.path.exists(os.path.join(root, '.git')):
+        try:
+            revision = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=root,
+                stderr=subprocess.DEVNULL)
+            return revision.decode('ascii').strip()
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    core = os.path.join(root, 'Source', 'BlahtexCore')
+    if not os.path.isdir(core):
+        return 'unknown'
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(core)):
+        with open(os.path.join(core, name), 'rb') as f:
+            h.update(name.encode('utf-8') + b'\0' + f.read())
+    return 'sources-' + h.hexdigest()
+
+
 def cpp_flag(compiler):
     """Return the -std=c++[11/14/17] compiler flag.
 
@@ -92,7 +122,7 @@ class BuildExt(build_ext):
         'unix': [],
     }
     l_opts = {
-        'msvc': [],
+        'msvc': ['psapi.lib'],
         'unix': [],
     }
 
@@ -124,7 +154,8 @@ class BuildExt(build_ext):
         for ext in self.extensions:
             ext.define_macros = [
                 ('VERSION_INFO',
-                 '"{}"'.format(self.distribution.get_version()))
+                 '"{}"'.format(self.distribution.get_version())),
+                ('BLAHTEXML_REVISION', '"{}"'.format(blahtexml_revision())),
             ]
             ext.extra_compile_args = opts
             ext.extra_link_args = link_opts
@@ -160,6 +191,7 @@ setup(
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: Free Threading :: 2 - Beta',
 
         'Topic :: Scientific/Engineering :: Mathematics',
         'Topic :: Software Development :: Libraries :: Python Modules',
@@ -172,6 +204,13 @@ setup(
         'blahtex': ['py.typed'],
     },
     ext_modules=ext_modules,
+    entry_points={
+        'console_scripts': ['blahtex-convert = blahtex.cli:main',
+                            'blahtex-archive = blahtex.archive:main'],
+    },
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
     setup_requires=['pybind11>=2.5.0'],
     cmdclass={'build_ext': BuildExt},
     zip_safe=False,
@@ -32,38 +32,1869 @@
 
 #include <BlahtexCore/Interface.h>
 #include <pybind11/pybind11.h>
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <cstring>
+#include <cwchar>
+#include <cwctype>
+#include <exception>
+#include <limits>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+#if defined(_WIN32)
+#ifndef NOMINMAX
+#define NOMINMAX
+#endif
+#include <windows.h>
+#include <psapi.h>
+#elif defined(__APPLE__)
+#include <mach/mach.h>
+#include <sys/resource.h>
+#else
+#include <cstdio>
+#include <sys/resource.h>
+#include <unistd.h>
+#endif
 
 namespace py = pybind11;
 
+static const std::wstring MATHML_HEAD =
+    L"<math xmlns=\"http://www.w3.org/1998/Math/MathML\" display=\"";
+
+// An element of MathML read by ParseMathml().  The children are indices
+// in the vector of the elements, and the attribute values are kept
+// escaped, as they are written.
+struct MathmlElement {
+    std::wstring mName;
+    std::vector<std::pair<std::wstring, std::wstring> > mAttributes;
+    std::vector<size_t> mChildren;
+    std::wstring mText;
+};
+
+static bool IsXmlSpace(wchar_t c)
+{
+    return c == L' ' || c == L'\t' || c == L'\r' || c == L'\n';
+}
+
+static std::wstring TrimXmlSpace(const std::wstring& s)
+{
+    std::wstring::size_type begin = 0, end = s.size();
+    while (begin < end && IsXmlSpace(s[begin]))
+	begin++;
+    while (end > begin && IsXmlSpace(s[end - 1]))
+	end--;
+    return s.substr(begin, end - begin);
+}
+
+// Reads MathML as blahtex writes it: elements, attributes quoted by '"'
+// and text, without comments, CDATA or processing instructions.  The
+// element 0 is a <math> holding the top elements.  false is returned for
+// anything else.
+static bool ParseMathml(const std::wstring& mathml,
+			std::vector<MathmlElement>& elements)
+{
+    elements.assign(1, MathmlElement());
+    elements[0].mName = L"math";
+    std::vector<size_t> open(1, 0);
+    std::wstring::size_type i = 0, n = mathml.size();
+    while (i < n) {
+	if (mathml[i] != L'<') {
+	    std::wstring::size_type end = mathml.find(L'<', i);
+	    if (end == std::wstring::npos)
+		end = n;
+	    elements[open.back()].mText.append(mathml, i, end - i);
+	    i = end;
+	    continue;
+	}
+	i++;
+	if (i < n && mathml[i] == L'/') {
+	    std::wstring::size_type end = mathml.find(L'>', i);
+	    if (end == std::wstring::npos || open.size() < 2)
+		return false;
+	    std::wstring name =
+		TrimXmlSpace(mathml.substr(i + 1, end - i - 1));
+	    if (name != elements[open.back()].mName)
+		return false;
+	    open.pop_back();
+	    i = end + 1;
+	    continue;
+	}
+	std::wstring::size_type start = i;
+	while (i < n && ! IsXmlSpace(mathml[i]) && mathml[i] != L'>' &&
+	       mathml[i] != L'/')
+	    i++;
+	if (i == start)
+	    return false;
+	size_t index = elements.size();
+	elements.push_back(MathmlElement());
+	elements[index].mName.assign(mathml, start, i - start);
+	elements[open.back()].mChildren.push_back(index);
+	for (;;) {
+	    while (i < n && IsXmlSpace(mathml[i]))
+		i++;
+	    if (i >= n)
+		return false;
+	    if (mathml[i] == L'>') {
+		open.push_back(index);
+		i++;
+		break;
+	    }
+	    if (mathml[i] == L'/') {
+		if (i + 1 >= n || mathml[i + 1] != L'>')
+		    return false;
+		i += 2;
+		break;
+	    }
+	    start = i;
+	    while (i < n && mathml[i] != L'=' && ! IsXmlSpace(mathml[i]) &&
+		   mathml[i] != L'>' && mathml[i] != L'/')
+		i++;
+	    if (i == start || i + 1 >= n || mathml[i] != L'=' ||
+		mathml[i + 1] != L'"')
+		return false;
+	    std::wstring::size_type close = mathml.find(L'"', i + 2);
+	    if (close == std::wstring::npos)
+		return false;
+	    elements[index].mAttributes.push_back(std::make_pair(
+		mathml.substr(start, i - start),
+		mathml.substr(i + 2, close - i - 2)));
+	    i = close + 1;
+	}
+    }
+    return open.size() == 1;
+}
+
+// Number of characters of escaped text, counting an entity or a
+// surrogate pair as one.  named is set if there is a named entity, which
+// may be more than one character.
+static size_t CountCharacters(const std::wstring& text, bool& named)
+{
+    size_t count = 0;
+    named = false;
+    for (std::wstring::size_type i = 0; i < text.size(); i++, count++) {
+	if (text[i] == L'&') {
+	    std::wstring::size_type end = text.find(L';', i);
+	    if (end == std::wstring::npos)
+		continue;
+	    if (i + 1 < end && text[i + 1] != L'#')
+		named = true;
+	    i = end;
+	} else if (text[i] >= 0xD800 && text[i] < 0xDC00 &&
+		   i + 1 < text.size()) {
+	    i++;
+	}
+    }
+    return count;
+}
+
+static bool IsTokenElement(const std::wstring& name)
+{
+    return name == L"mi" || name == L"mn" || name == L"mo" ||
+	name == L"mtext" || name == L"ms";
+}
+
+// <mrow>, or <mstyle> without attributes, which only groups.
+static bool IsPlainRow(const MathmlElement& e)
+{
+    return e.mAttributes.empty() && (e.mName == L"mrow" ||
+				     e.mName == L"mstyle");
+}
+
+// Elements whose children are in an inferred <mrow>.
+static bool HasInferredRow(const std::wstring& name)
+{
+    return name == L"math" || name == L"msqrt" || name == L"mstyle" ||
+	name == L"merror" || name == L"mpadded" || name == L"mphantom" ||
+	name == L"menclose" || name == L"mtd";
+}
+
+// Whether an element is an embellished operator, whose form and spacing
+// are of the operator.  An <mrow> holding only one is not unwrapped, as
+// renderers differ about it.
+static bool IsEmbellished(const std::vector<MathmlElement>& elements,
+			  size_t index)
+{
+    const MathmlElement& e = elements[index];
+    if (e.mName == L"mo")
+	return true;
+    if (e.mChildren.empty())
+	return false;
+    if (e.mName == L"msub" || e.mName == L"msup" || e.mName == L"msubsup" ||
+	e.mName == L"munder" || e.mName == L"mover" ||
+	e.mName == L"munderover" || e.mName == L"mmultiscripts" ||
+	e.mName == L"mfrac" || e.mName == L"semantics" ||
+	(e.mChildren.size() == 1 && (e.mName == L"mrow" ||
+				     HasInferredRow(e.mName))))
+	return IsEmbellished(elements, e.mChildren[0]);
+    return false;
+}
+
+// Whether an attribute has the value which the element has without it.
+// Nothing is dropped under an <mstyle> setting the font, as the tokens
+// inherit it.
+static bool IsDefaultAttribute(const MathmlElement& e,
+			       const std::wstring& text, bool styled,
+			       const std::wstring& name,
+			       const std::wstring& value)
+{
+    if (styled || ! IsTokenElement(e.mName) ||
+	(name != L"mathvariant" && name != L"fontstyle"))
+	return false;
+    if (e.mName != L"mi")
+	return name == L"mathvariant" && value == L"normal";
+    // <mi> of a single character is italic, and of others normal.
+    bool named;
+    size_t count = CountCharacters(text, named);
+    if (value == L"normal")
+	return count > 1;
+    if (value == L"italic")
+	return count == 1 && ! named;
+    return false;
+}
+
+static bool SetsFont(const MathmlElement& e)
+{
+    if (e.mName != L"mstyle")
+	return false;
+    for (size_t i = 0; i < e.mAttributes.size(); i++) {
+	const std::wstring& name = e.mAttributes[i].first;
+	if (name == L"mathvariant" || name == L"fontstyle" ||
+	    name == L"fontweight" || name == L"fontfamily")
+	    return true;
+    }
+    return false;
+}
+
+static void WriteCompactElement(const std::vector<MathmlElement>& elements,
+				size_t index, bool styled,
+				std::wstring& out);
+
+static void WriteCompactChildren(const std::vector<MathmlElement>& elements,
+				 const MathmlElement& e, bool styled,
+				 std::wstring& out)
+{
+    const std::vector<size_t>* children = &e.mChildren;
+    if (HasInferredRow(e.mName) && children->size() == 1) {
+	const MathmlElement& row = elements[(*children)[0]];
+	if (row.mName == L"mrow" && row.mAttributes.empty())
+	    children = &row.mChildren;
+    }
+    for (size_t i = 0; i < children->size(); i++)
+	WriteCompactElement(elements, (*children)[i], styled, out);
+}
+
+static void WriteCompactElement(const std::vector<MathmlElement>& elements,
+				size_t index, bool styled,
+				std::wstring& out)
+{
+    while (IsPlainRow(elements[index]) &&
+	   elements[index].mChildren.size() == 1 &&
+	   ! IsEmbellished(elements, elements[index].mChildren[0]))
+	index = elements[index].mChildren[0];
+    const MathmlElement& e = elements[index];
+    std::wstring text;
+    if (e.mChildren.empty())
+	text = TrimXmlSpace(e.mText);
+    out += L'<';
+    out += e.mName;
+    for (size_t i = 0; i < e.mAttributes.size(); i++) {
+	const std::wstring& name = e.mAttributes[i].first;
+	const std::wstring& value = e.mAttributes[i].second;
+	if (IsDefaultAttribute(e, text, styled, name, value))
+	    continue;
+	out += L' ';
+	out += name;
+	out += L"=\"";
+	out += value;
+	out += L'"';
+    }
+    if (e.mChildren.empty() && text.empty()) {
+	out += L"/>";
+	return;
+    }
+    out += L'>';
+    out += text;
+    WriteCompactChildren(elements, e, styled || SetsFont(e), out);
+    out += L"</";
+    out += e.mName;
+    out += L'>';
+}
+
+// The smallest MathML rendered the same as the body of <math> written by
+// blahtex: no whitespace between the elements, no <mrow> around a single
+// element or filling an inferred <mrow>, no attributes with the default
+// value, and empty elements closed by "/>".  The body is returned as it
+// is if it cannot be read.
+static std::wstring CompactMathml(const std::wstring& mathml)
+{
+    std::vector<MathmlElement> elements;
+    if (! ParseMathml(mathml, elements))
+	return mathml;
+    for (size_t i = 0; i < elements.size(); i++) {
+	if (! elements[i].mChildren.empty() &&
+	    ! TrimXmlSpace(elements[i].mText).empty())
+	    return mathml;  // mixed content
+    }
+    std::wstring out;
+    out.reserve(mathml.size());
+    WriteCompactChildren(elements, elements[0], false, out);
+    return out;
+}
+
+// Builds the complete <math> element around the body returned by
+// Interface::GetMathml().  The indented form matches
+// textwrap.indent(body, "  ") used by Blahtex.get_mathml().  The compact
+// form is never indented.
+static std::wstring WrapMathml(const std::wstring& body, bool displayMath,
+			       bool indented, bool compact)
+{
+    std::wstring result = MATHML_HEAD;
+    result += displayMath ? L"block\">" : L"inline\">";
+    if (compact) {
+	result += CompactMathml(body);
+	result += L"</math>";
+	return result;
+    }
+    if (! indented) {
+	result += body;
+	result += L"</math>";
+	return result;
+    }
+    result += L"\n";
+    std::wstring::size_type pos = 0;
+    while (pos < body.size()) {
+	std::wstring::size_type end = body.find(L'\n', pos);
+	end = (end == std::wstring::npos) ? body.size() : end + 1;
+	if (body.find_first_not_of(L" \t\r\n\f\v", pos) < end)
+	    result += L"  ";
+	result.append(body, pos, end - pos);
+	pos = end;
+    }
+    result += L"</math>\n";
+    return result;
+}
+
+// Counts of an input TeX-string, found by a light scan without parsing.
+struct InputStats {
+    size_t mTokens;            // as the blahtex tokenizer splits
+    size_t mMacroDefinitions;  // \newcommand
+    size_t mMacroExpansions;   // expansions of the macros, with nesting
+    size_t mMaxDepth;          // of {}, \begin/\end and \left/\right
+};
+
+static size_t SaturatingAdd(size_t a, size_t b)
+{
+    return (a > std::numeric_limits<size_t>::max() - b)
+	? std::numeric_limits<size_t>::max() : a + b;
+}
+
+// Splits input into tokens like the blahtex tokenizer: a control word,
+// a control symbol, a run of whitespace, or any other character.
+static std::vector<std::wstring> Tokenize(const std::wstring& input)
+{
+    std::vector<std::wstring> tokens;
+    std::wstring::size_type i = 0;
+    while (i < input.size()) {
+	std::wstring::size_type start = i;
+	wchar_t c = input[i++];
+	if (c == L'\\' && i < input.size()) {
+	    if (std::iswalpha(input[i]) && input[i] < 0x80) {
+		while (i < input.size() && std::iswalpha(input[i]) &&
+		       input[i] < 0x80)
+		    i++;
+	    } else {
+		i++;
+	    }
+	} else if (std::iswspace(c)) {
+	    while (i < input.size() && std::iswspace(input[i]))
+		i++;
+	}
+	tokens.push_back(input.substr(start, i - start));
+    }
+    return tokens;
+}
+
+static InputStats ScanInput(const std::wstring& input)
+{
+    std::vector<std::wstring> tokens = Tokenize(input);
+    InputStats stats;
+    stats.mTokens = tokens.size();
+    stats.mMacroDefinitions = 0;
+    stats.mMacroExpansions = 0;
+    stats.mMaxDepth = 0;
+
+    // Macro name -> range of tokens of its body.  The count of expansions
+    // of a macro is 1 plus the ones of the macros used in its body.
+    std::map<std::wstring, std::pair<size_t, size_t> > bodies;
+    std::vector<std::pair<size_t, size_t> > skipped;
+    size_t depth = 0;
+    for (size_t i = 0; i < tokens.size(); i++) {
+	const std::wstring& t = tokens[i];
+	if (t == L"{" || t == L"\\begin" || t == L"\\left") {
+	    depth++;
+	    stats.mMaxDepth = std::max(stats.mMaxDepth, depth);
+	} else if ((t == L"}" || t == L"\\end" || t == L"\\right") &&
+		   depth > 0) {
+	    depth--;
+	} else if (t == L"\\newcommand") {
+	    stats.mMacroDefinitions++;
+	    size_t j = i + 1;
+	    while (j < tokens.size() && std::iswspace(tokens[j][0]))
+		j++;
+	    if (j < tokens.size() && tokens[j] == L"{")
+		j++;
+	    if (j >= tokens.size() || tokens[j][0] != L'\\')
+		continue;
+	    std::wstring name = tokens[j];
+	    // The body is the first brace group after the name.
+	    while (j < tokens.size() && tokens[j] != L"{")
+		j++;
+	    size_t k = j, level = 0;
+	    for (; k < tokens.size(); k++) {
+		if (tokens[k] == L"{")
+		    level++;
+		else if (tokens[k] == L"}" && --level == 0)
+		    break;
+	    }
+	    bodies[name] = std::make_pair(j, k);
+	    skipped.push_back(std::make_pair(i, k));
+	}
+    }
+
+    // Weights are computed iteratively, so that recursive definitions,
+    // which blahtex rejects anyway, cannot loop forever.
+    std::map<std::wstring, size_t> weights;
+    for (auto& b: bodies)
+	weights[b.first] = 1;
+    for (size_t pass = 0; pass < bodies.size(); pass++) {
+	bool changed = false;
+	for (auto& b: bodies) {
+	    size_t w = 1;
+	    for (size_t k = b.second.first; k < b.second.second &&
+		     k < tokens.size(); k++) {
+		auto found = weights.find(tokens[k]);
+		if (found != weights.end())
+		    w = SaturatingAdd(w, found->second);
+	    }
+	    if (w != weights[b.first]) {
+		weights[b.first] = w;
+		changed = true;
+	    }
+	}
+	if (! changed)
+	    break;
+    }
+
+    size_t next = 0;
+    for (size_t i = 0; i < tokens.size(); i++) {
+	while (next < skipped.size() && skipped[next].first < i)
+	    next++;
+	if (next < skipped.size() && i == skipped[next].first) {
+	    i = skipped[next++].second;
+	    continue;
+	}
+	auto found = weights.find(tokens[i]);
+	if (found != weights.end())
+	    stats.mMacroExpansions = SaturatingAdd(stats.mMacroExpansions,
+						   found->second);
+    }
+    return stats;
+}
+
+// Commands whose braced arguments are in math mode, where whitespace
+// does not matter.  The arguments of any other command are kept as they
+// are by CanonicalKey(), since they may be text, names, or the body of a
+// macro.  Sorted, for std::binary_search().
+static const wchar_t* const MATH_COMMANDS[] = {
+    L"\\Bbb", L"\\acute", L"\\bar", L"\\binom", L"\\bold", L"\\boldsymbol",
+    L"\\boxed", L"\\breve", L"\\cfrac", L"\\check", L"\\dbinom", L"\\ddot",
+    L"\\dfrac", L"\\displaystyle", L"\\dot", L"\\frac", L"\\grave",
+    L"\\hat", L"\\hphantom", L"\\mathbb", L"\\mathbf", L"\\mathbin",
+    L"\\mathcal", L"\\mathclose", L"\\mathfrak", L"\\mathinner",
+    L"\\mathit", L"\\mathop", L"\\mathopen", L"\\mathord", L"\\mathpunct",
+    L"\\mathrel", L"\\mathring", L"\\mathrm", L"\\mathscr", L"\\mathsf",
+    L"\\mathtt", L"\\not", L"\\overbrace", L"\\overleftarrow",
+    L"\\overleftrightarrow", L"\\overline", L"\\overrightarrow",
+    L"\\overset", L"\\phantom", L"\\pmb", L"\\pmod", L"\\scriptscriptstyle",
+    L"\\scriptstyle", L"\\sqrt", L"\\stackrel", L"\\substack", L"\\tbinom",
+    L"\\textstyle", L"\\tfrac", L"\\tilde", L"\\underbrace", L"\\underline",
+    L"\\underset", L"\\vec", L"\\vphantom", L"\\widehat", L"\\widetilde"
+};
+
+static bool IsMathCommand(const std::wstring& t)
+{
+    return std::binary_search(
+	std::begin(MATH_COMMANDS), std::end(MATH_COMMANDS), t.c_str(),
+	[](const wchar_t* a, const wchar_t* b) {
+	    return std::wcscmp(a, b) < 0;
+	});
+}
+
+static bool IsControlWord(const std::wstring& t)
+{
+    return t.size() > 1 && t[0] == L'\\' && t[1] < 0x80 &&
+	std::iswalpha(t[1]);
+}
+
+static bool IsAsciiAlnum(wchar_t c)
+{
+    return c < 0x80 && std::iswalnum(c);
+}
+
+static bool IsNumberPart(wchar_t c)
+{
+    return (c >= L'0' && c <= L'9') || c == L'.';
+}
+
+// Index of the first token at or after i which is not whitespace.
+static size_t SkipSpaces(const std::vector<std::wstring>& tokens, size_t i)
+{
+    while (i < tokens.size() && std::iswspace(tokens[i][0]))
+	i++;
+    return i;
+}
+
+// Key of a TeX-string, the same for TeX-strings which differ only in
+// ways which cannot change the output: whitespace in math mode (except
+// in the arguments of commands other than MATH_COMMANDS), and
+// braces around a superscript or subscript of one letter or digit.  The
+// key is itself a TeX-string equivalent to the input.  Whitespace which
+// may matter is kept as one space: between digits, and before an
+// optional argument or a star after a command.
+static std::wstring CanonicalKey(const std::wstring& input)
+{
+    std::vector<std::wstring> tokens = Tokenize(input);
+    std::wstring key;
+    key.reserve(input.size());
+    std::wstring last;       // last token appended
+    bool spaced = false;     // whitespace was dropped after it
+    bool comment = false;    // after % on the line
+    for (size_t i = 0; i < tokens.size(); i++) {
+	const std::wstring& t = tokens[i];
+	if (std::iswspace(t[0])) {
+	    if (comment && t.find(L'\n') != std::wstring::npos) {
+		key += L'\n';
+		last = L"\n";
+		comment = false;
+	    } else {
+		spaced = true;
+	    }
+	    continue;
+	}
+	if ((IsControlWord(last) && t[0] < 0x80 && std::iswalpha(t[0])) ||
+	    (spaced && ! last.empty() && IsNumberPart(last.back()) &&
+	     IsNumberPart(t[0])) ||
+	    (spaced && ! last.empty() && last[0] == L'\\' &&
+	     (t == L"[" || t == L"*")))
+	    key += L' ';
+	key += t;
+	last = t;
+	spaced = false;
+	if (t == L"%")
+	    comment = true;
+	if (IsControlWord(t) && ! IsMathCommand(t)) {
+	    // A star and the arguments are copied as they are, with the
+	    // optional ones after the first, like in \newcommand.
+	    bool first = true;
+	    for (;;) {
+		size_t j = SkipSpaces(tokens, i + 1);
+		if (j >= tokens.size())
+		    break;
+		if (first && tokens[j] == L"*") {
+		    if (j > i + 1)
+			key += L' ';
+		    key += L"*";
+		    last = L"*";
+		    i = j;
+		    continue;
+		}
+		if (tokens[j] != L"{" && (first || tokens[j] != L"["))
+		    break;
+		bool optional = tokens[j] == L"[";
+		size_t level = 0;
+		for (i = j; i < tokens.size(); i++) {
+		    key += tokens[i];
+		    if (tokens[i] == L"{")
+			level++;
+		    else if (tokens[i] == L"}" && level > 0)
+			level--;
+		    if (level == 0 && (optional ? tokens[i] == L"]"
+				       : tokens[i] == L"}"))
+			break;
+		}
+		last = optional ? L"]" : L"}";
+		first = false;
+		if (i >= tokens.size())
+		    break;
+	    }
+	} else if (t == L"^" || t == L"_") {
+	    size_t open = SkipSpaces(tokens, i + 1);
+	    size_t arg = SkipSpaces(tokens, open + 1);
+	    size_t close = SkipSpaces(tokens, arg + 1);
+	    if (close < tokens.size() && tokens[open] == L"{" &&
+		tokens[arg].size() == 1 && IsAsciiAlnum(tokens[arg][0]) &&
+		tokens[close] == L"}") {
+		key += tokens[arg];
+		last = tokens[arg];
+		i = close;
+	    }
+	}
+    }
+    return key;
+}
+
+// Number of elements in MathML.
+static size_t CountNodes(const std::wstring& mathml)
+{
+    size_t count = 0;
+    for (std::wstring::size_type i = 0; i + 1 < mathml.size(); i++) {
+	if (mathml[i] == L'<' && mathml[i + 1] != L'/')
+	    count++;
+    }
+    return count;
+}
+
+// Encodes a wide string to UTF-8.  wchar_t is UTF-16 when
+// WCHAR_T_IS_16BIT is defined, and UTF-32 otherwise.
+static std::string EncodeUtf8(const std::wstring& s)
+{
+    std::string out;
+    out.reserve(s.size() + s.size() / 4);
+    for (std::wstring::size_type i = 0; i < s.size(); i++) {
+	unsigned long c = static_cast<unsigned long>(s[i]);
+#ifdef WCHAR_T_IS_16BIT
+	if (c >= 0xD800 && c < 0xDC00 && i + 1 < s.size()) {
+	    unsigned long low = static_cast<unsigned long>(s[i + 1]);
+	    if (low >= 0xDC00 && low < 0xE000) {
+		c = 0x10000 + ((c - 0xD800) << 10) + (low - 0xDC00);
+		i++;
+	    }
+	}
+#endif
+	if (c < 0x80) {
+	    out += static_cast<char>(c);
+	} else if (c < 0x800) {
+	    out += static_cast<char>(0xC0 | (c >> 6));
+	    out += static_cast<char>(0x80 | (c & 0x3F));
+	} else if (c < 0x10000) {
+	    out += static_cast<char>(0xE0 | (c >> 12));
+	    out += static_cast<char>(0x80 | ((c >> 6) & 0x3F));
+	    out += static_cast<char>(0x80 | (c & 0x3F));
+	} else {
+	    out += static_cast<char>(0xF0 | (c >> 18));
+	    out += static_cast<char>(0x80 | ((c >> 12) & 0x3F));
+	    out += static_cast<char>(0x80 | ((c >> 6) & 0x3F));
+	    out += static_cast<char>(0x80 | (c & 0x3F));
+	}
+    }
+    return out;
+}
+
+// Reads an input TeX-string given as str, or as bytes or any other
+// buffer holding UTF-8.
+static std::wstring ReadInput(py::handle input)
+{
+    if (py::isinstance<py::str>(input))
+	return input.cast<std::wstring>();
+    py::buffer_info info = py::reinterpret_borrow<py::buffer>(input)
+	.request();
+    if (info.ndim > 1 || info.itemsize != 1)
+	throw py::type_error("input must be str or a buffer of UTF-8 bytes");
+    py::str decoded = py::reinterpret_steal<py::str>(
+	PyUnicode_DecodeUTF8(static_cast<const char*>(info.ptr),
+			     info.size, "strict"));
+    if (! decoded)
+	throw py::error_already_set();
+    return decoded.cast<std::wstring>();
+}
+
+// Options compiled once by BlahtexOptions.  The members are the same as
+// the ones of Interface, so options are copied between them by
+// CopyOptions().
+struct Options {
+    blahtex::MathmlOptions mMathmlOptions;
+    blahtex::EncodingOptions mEncodingOptions;
+    blahtex::PurifiedTexOptions mPurifiedTexOptions;
+    bool mTexvcCompatibility;
+    bool mIndented;
+    bool mCompact;
+
+    Options()
+	: mTexvcCompatibility(false), mIndented(false), mCompact(false) { }
+};
+
+// The Interface of blahtex with the options of the binding which blahtex
+// does not have.
+struct Core : public blahtex::Interface {
+    bool mCompact;  // CompactMathml() on the output
+
+    Core() : mCompact(false) { }
+};
+
+// Copies options except for display_math, which belongs to the input.
+template <class To, class From>
+static void CopyOptions(To& to, const From& from)
+{
+    bool displayMath = to.mPurifiedTexOptions.mDisplayMath;
+    to.mMathmlOptions = from.mMathmlOptions;
+    to.mEncodingOptions = from.mEncodingOptions;
+    to.mPurifiedTexOptions = from.mPurifiedTexOptions;
+    to.mPurifiedTexOptions.mDisplayMath = displayMath;
+    to.mTexvcCompatibility = from.mTexvcCompatibility;
+    to.mIndented = from.mIndented;
+    to.mCompact = from.mCompact;
+}
+
+// Frees the parse tree, the layout tree and the MathML tree kept by an
+// Interface for its last input, by replacing it with a new Interface
+// which has the same options.
+static void ReleaseTrees(Core& interface)
+{
+    if (interface.GetManager() == NULL)
+	return;
+    Core fresh;
+    CopyOptions(fresh, interface);
+    fresh.mPurifiedTexOptions.mDisplayMath =
+	interface.mPurifiedTexOptions.mDisplayMath;
+    interface = std::move(fresh);
+}
+
+// Resident set size of the process and its peak, in bytes.  -1 means not
+// known on the platform.
+static std::pair<long long, long long> ResidentMemory()
+{
+    long long current = -1, peak = -1;
+#if defined(_WIN32)
+    PROCESS_MEMORY_COUNTERS counters;
+    if (GetProcessMemoryInfo(GetCurrentProcess(), &counters,
+			     sizeof(counters))) {
+	current = counters.WorkingSetSize;
+	peak = counters.PeakWorkingSetSize;
+    }
+#elif defined(__APPLE__)
+    mach_task_basic_info_data_t info;
+    mach_msg_type_number_t count = MACH_TASK_BASIC_INFO_COUNT;
+    if (task_info(mach_task_self(), MACH_TASK_BASIC_INFO,
+		  reinterpret_cast<task_info_t>(&info), &count) == KERN_SUCCESS) {
+	current = info.resident_size;
+	peak = info.resident_size_max;
+    }
+#else
+    FILE* statm = std::fopen("/proc/self/statm", "r");
+    if (statm != NULL) {
+	long long pages, resident;
+	if (std::fscanf(statm, "%lld %lld", &pages, &resident) == 2)
+	    current = resident * sysconf(_SC_PAGESIZE);
+	std::fclose(statm);
+    }
+    struct rusage usage;
+    if (getrusage(RUSAGE_SELF, &usage) == 0)
+	peak = static_cast<long long>(usage.ru_maxrss) * 1024;
+#endif
+    return std::make_pair(current, peak);
+}
+
+// Applies options to an Interface while in scope, and restores the
+// previous ones afterwards.  Nothing is done when options is NULL.
+class ScopedOptions {
+public:
+    ScopedOptions(Core& interface, const Options* options)
+	: mInterface(interface), mApplied(options != NULL)
+    {
+	if (mApplied) {
+	    CopyOptions(mSaved, interface);
+	    CopyOptions(interface, *options);
+	}
+    }
+
+    ~ScopedOptions()
+    {
+	if (mApplied)
+	    CopyOptions(mInterface, mSaved);
+    }
+
+private:
+    Core& mInterface;
+    bool mApplied;
+    Options mSaved;
+};
+
+typedef std::chrono::steady_clock Clock;
+
+static double Seconds(Clock::time_point from, Clock::time_point to)
+{
+    return std::chrono::duration<double>(to - from).count();
+}
+
+// Resource limits of a conversion, set by Blahtex.set_limits().  Zero
+// means no limit.  Exceeding a limit throws a blahtex::Exception whose
+// code is the name of the Python exception class raised for it.
+struct Limits {
+    size_t mMaxInputLength;
+    size_t mMaxTokens;
+    size_t mMaxMacroExpansions;
+    size_t mMaxDepth;
+    size_t mMaxNodes;
+    double mDeadline;  // seconds from the start of a conversion
+
+    Limits()
+	: mMaxInputLength(0), mMaxTokens(0), mMaxMacroExpansions(0),
+	  mMaxDepth(0), mMaxNodes(0), mDeadline(0.0) { }
+
+    bool NeedsScan() const
+    {
+	return mMaxTokens || mMaxMacroExpansions || mMaxDepth;
+    }
+};
+
+static const wchar_t* const LIMIT_CODES[] = {
+    L"InputTooLong", L"TooManyTokens", L"TooManyMacroExpansions",
+    L"NestingTooDeep", L"TooManyNodes", L"DeadlineExceeded"
+};
+
+static void CheckLimit(const wchar_t* code, size_t value, size_t limit)
+{
+    if (limit && value > limit)
+	throw blahtex::Exception(code, std::to_wstring(value),
+				 std::to_wstring(limit));
+}
+
+static void CheckDeadline(const Limits& limits, Clock::time_point start)
+{
+    if (limits.mDeadline > 0.0) {
+	double elapsed = Seconds(start, Clock::now());
+	if (elapsed > limits.mDeadline)
+	    throw blahtex::Exception(L"DeadlineExceeded",
+				     std::to_wstring(elapsed),
+				     std::to_wstring(limits.mDeadline));
+    }
+}
+
+// Rejects an input over the limits before parsing it.  The input is
+// scanned only if a limit needs it, unless stats of the scan are given.
+static void CheckInput(const std::wstring& input, const Limits& limits,
+		       const InputStats* scanned = NULL)
+{
+    CheckLimit(L"InputTooLong", input.size(), limits.mMaxInputLength);
+    if (! limits.NeedsScan())
+	return;
+    InputStats stats = scanned ? *scanned : ScanInput(input);
+    CheckLimit(L"TooManyTokens", stats.mTokens, limits.mMaxTokens);
+    CheckLimit(L"TooManyMacroExpansions", stats.mMacroExpansions,
+	       limits.mMaxMacroExpansions);
+    CheckLimit(L"NestingTooDeep", stats.mMaxDepth, limits.mMaxDepth);
+}
+
+// The whole parse -> layout -> MathML pipeline for one input.  This is
+// called without holding the GIL, so it must not touch any Python object.
+// With limits, the input is checked first, and the deadline and the
+// number of nodes are checked between the stages.
+static std::wstring Convert(Core& interface,
+			    const std::wstring& input, bool displayMath,
+			    const Limits* limits = NULL)
+{
+    interface.mPurifiedTexOptions.mDisplayMath = displayMath;
+    if (limits == NULL) {
+	interface.ProcessInput(input, displayMath);
+	return WrapMathml(interface.GetMathml(), displayMath,
+			  interface.mIndented, interface.mCompact);
+    }
+    Clock::time_point start = Clock::now();
+    CheckInput(input, *limits);
+    CheckDeadline(*limits, start);
+    interface.ProcessInput(input, displayMath);
+    CheckDeadline(*limits, start);
+    std::wstring body = interface.GetMathml();
+    if (limits->mMaxNodes)
+	CheckLimit(L"TooManyNodes", CountNodes(body), limits->mMaxNodes);
+    CheckDeadline(*limits, start);
+    return WrapMathml(body, displayMath, interface.mIndented,
+		      interface.mCompact);
+}
+
+// Formula parsed once by Blahtex.parse().  The Interface owns the parse
+// tree and the layout tree, and renders them with any options without
+// parsing again.  The mutex serializes renderings from several threads.
+struct ParsedFormula {
+    std::unique_ptr<Core> mInterface;
+    bool mDisplayMath;
+    std::mutex mMutex;
+};
+
+enum RenderFormat {
+    cRenderMathml,
+    cRenderMathmlBytes,
+    cRenderPurifiedTex,
+    cRenderPurifiedTexOnly
+};
+
+struct RenderResult {
+    bool mIsBytes;
+    std::wstring mText;
+    std::string mBytes;
+};
+
+static RenderFormat ReadRenderFormat(const std::string& name)
+{
+    if (name == "mathml")
+	return cRenderMathml;
+    else if (name == "mathml_bytes")
+	return cRenderMathmlBytes;
+    else if (name == "purified_tex")
+	return cRenderPurifiedTex;
+    else if (name == "purified_tex_only")
+	return cRenderPurifiedTexOnly;
+    throw py::value_error("Unknown format '" + name + "'");
+}
+
+// Renders a parsed formula.  Called without the GIL and with the mutex
+// of the formula locked.
+static RenderResult Render(ParsedFormula& formula, RenderFormat format,
+			   const Options* options)
+{
+    Core& interface = *formula.mInterface;
+    ScopedOptions scoped(interface, options);
+    RenderResult r;
+    r.mIsBytes = false;
+    switch (format) {
+    case cRenderMathml:
+	r.mText = WrapMathml(interface.GetMathml(), formula.mDisplayMath,
+			     interface.mIndented, interface.mCompact);
+	break;
+    case cRenderMathmlBytes:
+	r.mBytes = EncodeUtf8(WrapMathml(interface.GetMathml(),
+					 formula.mDisplayMath,
+					 interface.mIndented,
+					 interface.mCompact));
+	r.mIsBytes = true;
+	break;
+    case cRenderPurifiedTex:
+	r.mText = interface.GetPurifiedTex();
+	break;
+    case cRenderPurifiedTexOnly:
+	r.mText = interface.GetPurifiedTexOnly();
+	break;
+    }
+    return r;
+}
+
+static py::object RenderToPython(const RenderResult& r)
+{
+    if (r.mIsBytes)
+	return py::bytes(r.mBytes);
+    return py::cast(r.mText);
+}
+
+// Stats of one conversion recorded by ConvertWithStats().
+struct ConversionStats {
+    size_t mInputLength;
+    InputStats mInput;
+    double mParseTime;   // ProcessInput: tokenizer, macros, parse, layout
+    double mMathmlTime;  // GetMathml: MathML tree and XML encoding
+    double mWrapTime;    // <math> element
+    size_t mNodes;
+    size_t mOutputLength;
+    std::wstring mError;
+    std::vector<std::wstring> mErrorArgs;
+};
+
+// Same as Convert(), but also records stats.  An error is recorded in
+// stats and false is returned, instead of throwing it.
+static bool ConvertWithStats(Core& interface,
+			     const std::wstring& input, bool displayMath,
+			     std::wstring& result, ConversionStats& stats,
+			     const Limits* limits = NULL)
+{
+    Clock::time_point begin = Clock::now();
+    stats = ConversionStats();
+    stats.mInputLength = input.size();
+    stats.mInput = ScanInput(input);
+    double* stage = &stats.mParseTime;
+    Clock::time_point start = Clock::now();
+    try {
+	if (limits) {
+	    CheckInput(input, *limits, &stats.mInput);
+	    CheckDeadline(*limits, begin);
+	}
+	interface.mPurifiedTexOptions.mDisplayMath = displayMath;
+	interface.ProcessInput(input, displayMath);
+	Clock::time_point now = Clock::now();
+	stats.mParseTime = Seconds(start, now);
+	if (limits)
+	    CheckDeadline(*limits, begin);
+	start = now;
+	stage = &stats.mMathmlTime;
+	std::wstring body = interface.GetMathml();
+	now = Clock::now();
+	stats.mMathmlTime = Seconds(start, now);
+	stats.mNodes = CountNodes(body);
+	if (limits) {
+	    CheckLimit(L"TooManyNodes", stats.mNodes, limits->mMaxNodes);
+	    CheckDeadline(*limits, begin);
+	}
+	start = Clock::now();
+	stage = &stats.mWrapTime;
+	result = WrapMathml(body, displayMath, interface.mIndented,
+			    interface.mCompact);
+	stats.mWrapTime = Seconds(start, Clock::now());
+	stats.mOutputLength = result.size();
+	return true;
+    } catch (const blahtex::Exception& e) {
+	*stage = Seconds(start, Clock::now());
+	stats.mError = e.GetCode();
+	stats.mErrorArgs = e.GetArgs();
+	return false;
+    }
+}
+
+// Stats as a tuple for blahtex.stats.ConversionStats.
+static py::tuple StatsToTuple(const ConversionStats& stats)
+{
+    py::object error = py::none();
+    if (! stats.mError.empty())
+	error = py::cast(stats.mError);
+    return py::make_tuple(stats.mInputLength, stats.mInput.mTokens,
+			  stats.mInput.mMacroDefinitions,
+			  stats.mInput.mMacroExpansions,
+			  stats.mInput.mMaxDepth,
+			  stats.mParseTime, stats.mMathmlTime, stats.mWrapTime,
+			  stats.mNodes, stats.mOutputLength, error);
+}
+
+// Message of BlahtexException: "code: arg1, arg2, ..."
+static std::wstring ExceptionMessage(const std::wstring& code,
+				     const std::vector<std::wstring>& args)
+{
+    std::wstring msg = code + L": ";
+    bool firstarg = true;
+    for (std::wstring arg: args) {
+	if (! firstarg)
+	    msg += L", ";
+	msg += arg;
+	firstarg = false;
+    }
+    return msg;
+}
+
+// Subclasses of BlahtexException raised for exceeded limits, by the error
+// code.  The references are owned by the module.
+static std::map<std::wstring, PyObject*> limitExceptions;
+
+// Creates a BlahtexException instance, or one of its subclasses for the
+// codes of limits.  The error code and its arguments are also kept as the
+// ``code`` and ``arguments`` attributes.
+static py::object MakeException(py::handle type, const std::wstring& code,
+				const std::vector<std::wstring>& args)
+{
+    auto found = limitExceptions.find(code);
+    if (found != limitExceptions.end())
+	type = found->second;
+    py::object e = type(ExceptionMessage(code, args));
+    e.attr("code") = code;
+    py::tuple arguments(args.size());
+    for (size_t i = 0; i < args.size(); i++)
+	arguments[i] = py::cast(args[i]);
+    e.attr("arguments") = arguments;
+    return e;
+}
+
+// Result of one item of Blahtex.convert_many().
+struct BatchResult {
+    bool mFailed;
+    std::wstring mText;               // MathML, or the error code
+    std::vector<std::wstring> mArgs;  // arguments of the error
+    ConversionStats mStats;           // only if requested
+};
+
+// Reads the items of Blahtex.convert_many(): TeX-strings or
+// (TeX-string, display_math) pairs.
+static std::vector<std::pair<std::wstring, bool> > ReadBatch(
+    py::iterable items)
+{
+    std::vector<std::pair<std::wstring, bool> > inputs;
+    for (py::handle item: items) {
+	if (py::isinstance<py::str>(item) ||
+	    PyObject_CheckBuffer(item.ptr())) {
+	    inputs.emplace_back(ReadInput(item), false);
+	} else {
+	    py::sequence pair = item.cast<py::sequence>();
+	    if (pair.size() != 2)
+		throw py::value_error("items must be TeX-strings or "
+				      "(TeX-string, display_math) pairs");
+	    inputs.emplace_back(ReadInput(pair[0]), pair[1].cast<bool>());
+	}
+    }
+    return inputs;
+}
+
+// Converts all inputs without holding the GIL.
+static std::vector<BatchResult> ConvertBatch(
+    Core& interface,
+    const std::vector<std::pair<std::wstring, bool> >& inputs,
+    bool withStats, const Limits* limits)
+{
+    std::vector<BatchResult> results(inputs.size());
+    py::gil_scoped_release release;
+    for (size_t i = 0; i < inputs.size(); i++) {
+	BatchResult& r = results[i];
+	if (withStats) {
+	    r.mFailed = ! ConvertWithStats(interface, inputs[i].first,
+					   inputs[i].second, r.mText,
+					   r.mStats, limits);
+	    if (r.mFailed) {
+		r.mText = r.mStats.mError;
+		r.mArgs = r.mStats.mErrorArgs;
+	    }
+	    continue;
+	}
+	try {
+	    r.mText = Convert(interface, inputs[i].first, inputs[i].second,
+			      limits);
+	    r.mFailed = false;
+	} catch (const blahtex::Exception& e) {
+	    r.mText = e.GetCode();
+	    r.mArgs = e.GetArgs();
+	    r.mFailed = true;
+	}
+    }
+    return results;
+}
+
+// Makes the list returned by Blahtex.convert_many().  With stats, the
+// items are pairs of the result and the stats.
+static py::list BatchToList(py::handle exceptionType,
+			    const std::vector<BatchResult>& results,
+			    bool withStats)
+{
+    py::list list(results.size());
+    for (size_t i = 0; i < results.size(); i++) {
+	const BatchResult& r = results[i];
+	py::object item;
+	if (r.mFailed)
+	    item = MakeException(exceptionType, r.mText, r.mArgs);
+	else
+	    item = py::cast(r.mText);
+	if (withStats)
+	    list[i] = py::make_tuple(item, StatsToTuple(r.mStats));
+	else
+	    list[i] = item;
+    }
+    return list;
+}
+
+// Offset in input of the token where an error of blahtex is, in code
+// points, or -1 if it is not known.  blahtex does not report positions,
+// so the token is found from the error code and its arguments.
+static long LocateError(const std::wstring& input, const std::wstring& code,
+			const std::vector<std::wstring>& args)
+{
+    for (const wchar_t* limit: LIMIT_CODES) {
+	if (code == limit)
+	    return -1;
+    }
+    std::vector<std::wstring> tokens = Tokenize(input);
+    std::vector<size_t> offsets(tokens.size());
+    size_t offset = 0;
+    for (size_t i = 0; i < tokens.size(); i++) {
+	offsets[i] = offset;
+	offset += tokens[i].size();
+    }
+
+    // Unmatched pairs: the innermost opening left open, or the first
+    // closing without an opening.
+    static const wchar_t* const PAIRS[][4] = {
+	{ L"UnmatchedOpenBrace", L"UnmatchedCloseBrace", L"{", L"}" },
+	{ L"UnmatchedLeft", L"UnmatchedRight", L"\\left", L"\\right" },
+	{ L"UnmatchedBegin", L"UnmatchedEnd", L"\\begin", L"\\end" },
+    };
+    long found = -1;
+    for (auto& pair: PAIRS) {
+	if (code != pair[0] && code != pair[1])
+	    continue;
+	std::vector<size_t> open;
+	for (size_t i = 0; i < tokens.size() && found < 0; i++) {
+	    if (tokens[i] == pair[2])
+		open.push_back(i);
+	    else if (tokens[i] == pair[3] && ! open.empty())
+		open.pop_back();
+	    else if (tokens[i] == pair[3] && code == pair[1])
+		found = offsets[i];
+	}
+	if (found < 0 && code == pair[0] && ! open.empty())
+	    found = offsets[open.back()];
+    }
+    if (found < 0 && code == L"IllegalFinalBackslash" && ! input.empty())
+	found = input.size() - 1;
+    // Otherwise, the first argument is usually the offending command.
+    if (found < 0 && ! args.empty()) {
+	for (size_t i = 0; i < tokens.size(); i++) {
+	    if (tokens[i] == args[0]) {
+		found = offsets[i];
+		break;
+	    }
+	}
+    }
+#ifdef WCHAR_T_IS_16BIT
+    // Surrogate pairs are one character of Python.
+    if (found > 0) {
+	long pairs = 0;
+	for (long i = 0; i < found; i++) {
+	    if (input[i] >= 0xD800 && input[i] < 0xDC00)
+		pairs++;
+	}
+	found -= pairs;
+    }
+#endif
+    return found;
+}
+
+// Result of validating one input.  mCode is empty if it is valid.
+struct ValidationResult {
+    std::wstring mCode;
+    std::vector<std::wstring> mArgs;
+    long mPosition;
+};
+
+// Runs blahtex through the parser and the layout tree, without making
+// any MathML.  Called without holding the GIL.
+static ValidationResult Validate(Core& interface,
+				 const std::wstring& input, bool displayMath,
+				 const Limits* limits)
+{
+    ValidationResult r;
+    r.mPosition = -1;
+    try {
+	Clock::time_point start = Clock::now();
+	if (limits)
+	    CheckInput(input, *limits);
+	interface.mPurifiedTexOptions.mDisplayMath = displayMath;
+	interface.ProcessInput(input, displayMath);
+	if (limits)
+	    CheckDeadline(*limits, start);
+    } catch (const blahtex::Exception& e) {
+	r.mCode = e.GetCode();
+	r.mArgs = e.GetArgs();
+	r.mPosition = LocateError(input, r.mCode, r.mArgs);
+    }
+    return r;
+}
+
+// None if valid, or a tuple of (code, arguments, position).
+static py::object ValidationToPython(const ValidationResult& r)
+{
+    if (r.mCode.empty())
+	return py::none();
+    py::tuple args(r.mArgs.size());
+    for (size_t i = 0; i < r.mArgs.size(); i++)
+	args[i] = py::cast(r.mArgs[i]);
+    py::object position = py::none();
+    if (r.mPosition >= 0)
+	position = py::cast(r.mPosition);
+    return py::make_tuple(r.mCode, args, position);
+}
+
+// Decodes UTF-8 into out.  Returns false if it is not valid UTF-8.
+static bool DecodeUtf8(const char* p, size_t n, std::wstring& out)
+{
+    static const unsigned long MIN_CODE[] = { 0, 0x80, 0x800, 0x10000 };
+    const unsigned char* s = reinterpret_cast<const unsigned char*>(p);
+    out.clear();
+    out.reserve(n);
+    size_t i = 0;
+    while (i < n) {
+	unsigned long c = s[i];
+	size_t extra;
+	if (c < 0x80) {
+	    extra = 0;
+	} else if ((c & 0xE0) == 0xC0) {
+	    c &= 0x1F;
+	    extra = 1;
+	} else if ((c & 0xF0) == 0xE0) {
+	    c &= 0x0F;
+	    extra = 2;
+	} else if ((c & 0xF8) == 0xF0) {
+	    c &= 0x07;
+	    extra = 3;
+	} else {
+	    return false;
+	}
+	if (n - i <= extra)
+	    return false;
+	for (size_t k = 1; k <= extra; k++) {
+	    unsigned long b = s[i + k];
+	    if ((b & 0xC0) != 0x80)
+		return false;
+	    c = (c << 6) | (b & 0x3F);
+	}
+	if (c < MIN_CODE[extra] || c > 0x10FFFF || (c >= 0xD800 && c < 0xE000))
+	    return false;
+	i += extra + 1;
+#ifdef WCHAR_T_IS_16BIT
+	if (c >= 0x10000) {
+	    c -= 0x10000;
+	    out += static_cast<wchar_t>(0xD800 + (c >> 10));
+	    out += static_cast<wchar_t>(0xDC00 + (c & 0x3FF));
+	    continue;
+	}
+#endif
+	out += static_cast<wchar_t>(c);
+    }
+    return true;
+}
+
+static bool BitAt(const unsigned char* bitmap, size_t i)
+{
+    return (bitmap[i >> 3] >> (i & 7)) & 1;
+}
+
+// Column of strings in the layout of Arrow: 32 or 64 bits offsets of
+// the strings in UTF-8 data, and a validity bitmap (NULL if no nulls).
+// The first string is at mOffset of the offsets and the bitmap.
+struct StringColumn {
+    const char* mOffsets;
+    bool mLarge;
+    const char* mData;
+    const unsigned char* mValidity;
+    size_t mOffset;
+    size_t mLength;
+
+    long long Offset(size_t i) const
+    {
+	i += mOffset;
+	if (mLarge) {
+	    int64_t v;
+	    std::memcpy(&v, mOffsets + i * sizeof(v), sizeof(v));
+	    return v;
+	}
+	int32_t v;
+	std::memcpy(&v, mOffsets + i * sizeof(v), sizeof(v));
+	return v;
+    }
+
+    bool IsValid(size_t i) const
+    {
+	return mValidity == NULL || BitAt(mValidity, mOffset + i);
+    }
+};
+
+// Result of a string of a column: MathML, or the message of the error,
+// both in UTF-8.
+struct ColumnCell {
+    bool mNull;
+    bool mFailed;
+    std::string mText;
+};
+
+// Makes the table of ids of blahtex.archive in place from the hashes of
+// the ids: each becomes its high bits followed by its position in
+// positionBits bits, and the table is sorted, so that it is ordered by
+// the hash and then by the position.
+static void SortArchiveTable(uint64_t* table, size_t count,
+			     int positionBits)
+{
+    for (size_t i = 0; i < count; i++)
+	table[i] = ((table[i] >> positionBits) << positionBits) | i;
+    std::sort(table, table + count);
+}
+
+// Rows taken at once by a thread of ConvertColumn().
+static const size_t COLUMN_CHUNK = 64;
+
+// Converts the rows of a column taken from next by chunks, with a new
+// Interface having the options of options.  display is a bitmap of
+// display_math, or NULL.
+static void ConvertColumnRows(const Core& options,
+			      const StringColumn& column,
+			      const unsigned char* display,
+			      size_t displayOffset, const Limits* limits,
+			      std::atomic<size_t>& next,
+			      std::vector<ColumnCell>& cells)
+{
+    Core interface;
+    CopyOptions(interface, options);
+    std::wstring input;
+    for (;;) {
+	size_t begin = next.fetch_add(COLUMN_CHUNK);
+	if (begin >= cells.size())
+	    break;
+	size_t end = std::min(begin + COLUMN_CHUNK, cells.size());
+	for (size_t i = begin; i < end; i++) {
+	    ColumnCell& cell = cells[i];
+	    cell.mNull = ! column.IsValid(i);
+	    cell.mFailed = true;
+	    if (cell.mNull)
+		continue;
+	    long long from = column.Offset(i);
+	    if (! DecodeUtf8(column.mData + from, column.Offset(i + 1) - from,
+			     input)) {
+		cell.mText = EncodeUtf8(ExceptionMessage(
+		    L"InvalidUtf8", std::vector<std::wstring>()));
+		continue;
+	    }
+	    bool displayMath = display != NULL &&
+		BitAt(display, displayOffset + i);
+	    try {
+		cell.mText = EncodeUtf8(Convert(interface, input, displayMath,
+						limits));
+		cell.mFailed = false;
+	    } catch (const blahtex::Exception& e) {
+		cell.mText = EncodeUtf8(ExceptionMessage(e.GetCode(),
+							 e.GetArgs()));
+	    }
+	}
+    }
+}
+
+// Converts all rows of a column with threads.  Called without the GIL.
+static std::vector<ColumnCell> ConvertColumn(
+    const Core& options, const StringColumn& column,
+    const unsigned char* display, size_t displayOffset, size_t threads,
+    const Limits* limits)
+{
+    std::vector<ColumnCell> cells(column.mLength);
+    std::atomic<size_t> next(0);
+    size_t chunks = (column.mLength + COLUMN_CHUNK - 1) / COLUMN_CHUNK;
+    threads = std::max<size_t>(1, std::min(threads, chunks));
+    std::vector<std::thread> workers;
+    std::vector<std::exception_ptr> errors(threads);
+    for (size_t t = 1; t < threads; t++)
+	workers.emplace_back([&, t]() {
+	    try {
+		ConvertColumnRows(options, column, display, displayOffset,
+				  limits, next, cells);
+	    } catch (...) {
+		errors[t] = std::current_exception();
+	    }
+	});
+    try {
+	ConvertColumnRows(options, column, display, displayOffset, limits,
+			  next, cells);
+    } catch (...) {
+	errors[0] = std::current_exception();
+    }
+    for (std::thread& w: workers)
+	w.join();
+    for (const std::exception_ptr& e: errors)
+	if (e)
+	    std::rethrow_exception(e);
+    return cells;
+}
+
+// Bytes made without the GIL, given to Python through the buffer
+// protocol without copying.
+struct OutputBuffer {
+    std::string mData;
+};
+
+// Buffers of an Arrow string column holding the texts of the cells
+// which failed (or not), as (large, offsets, data, validity, nulls).
+// Other cells are null.  Offsets are of 64 bits if large.
+static py::tuple ColumnToPython(const std::vector<ColumnCell>& cells,
+				bool failed)
+{
+    std::unique_ptr<OutputBuffer> offsets(new OutputBuffer);
+    std::unique_ptr<OutputBuffer> data(new OutputBuffer);
+    std::unique_ptr<OutputBuffer> validity(new OutputBuffer);
+    size_t nulls = 0;
+    bool large;
+    {
+	py::gil_scoped_release release;
+	size_t total = 0;
+	for (const ColumnCell& cell: cells)
+	    if (! cell.mNull && cell.mFailed == failed)
+		total += cell.mText.size();
+	large = total > static_cast<size_t>(
+	    std::numeric_limits<int32_t>::max());
+	size_t width = large ? sizeof(int64_t) : sizeof(int32_t);
+	offsets->mData.resize((cells.size() + 1) * width);
+	data->mData.reserve(total);
+	validity->mData.assign((cells.size() + 7) / 8, '\0');
+	for (size_t i = 0; i <= cells.size(); i++) {
+	    if (large) {
+		int64_t v = data->mData.size();
+		std::memcpy(&offsets->mData[i * width], &v, width);
+	    } else {
+		int32_t v = static_cast<int32_t>(data->mData.size());
+		std::memcpy(&offsets->mData[i * width], &v, width);
+	    }
+	    if (i == cells.size())
+		break;
+	    const ColumnCell& cell = cells[i];
+	    if (cell.mNull || cell.mFailed != failed) {
+		nulls++;
+		continue;
+	    }
+	    data->mData += cell.mText;
+	    validity->mData[i >> 3] |= static_cast<char>(1 << (i & 7));
+	}
+    }
+    py::object validityObject = py::none();
+    if (nulls > 0)
+	validityObject = py::cast(validity.release(),
+				  py::return_value_policy::take_ownership);
+    return py::make_tuple(
+	large,
+	py::cast(offsets.release(), py::return_value_policy::take_ownership),
+	py::cast(data.release(), py::return_value_policy::take_ownership),
+	validityObject, nulls);
+}
+
+// Gets a buffer given to convert_column(), checking it has at least
+// size bytes.  None gives NULL.
+static const char* ColumnBuffer(py::handle object, size_t size,
+				std::vector<py::buffer_info>& views,
+				const char* name)
+{
+    if (object.is_none())
+	return NULL;
+    views.push_back(py::reinterpret_borrow<py::buffer>(object).request());
+    const py::buffer_info& info = views.back();
+    if (static_cast<size_t>(info.size * info.itemsize) < size)
+	throw py::value_error(std::string(name) + " buffer is too small");
+    return static_cast<const char*>(info.ptr);
+}
+
+// Each Interface is used by one thread at a time (Blahtex keeps one per
+// thread), so the module does not need the GIL on free-threaded builds.
+#if defined(PYBIND11_VERSION_HEX) && PYBIND11_VERSION_HEX >= 0x020D0000
+PYBIND11_MODULE(_blahtex, m, py::mod_gil_not_used()) {
+#else
 PYBIND11_MODULE(_blahtex, m) {
+#endif
     m.doc() = "Blahtex binding for python";
+#ifdef VERSION_INFO
+    m.attr("__version__") = VERSION_INFO;
+#else
+    m.attr("__version__") = "dev";
+#endif
+    // Revision of the blahtex core, a part of the keys of persistent
+    // caches.
+#ifdef BLAHTEXML_REVISION
+    m.attr("blahtexml_revision") = BLAHTEXML_REVISION;
+#else
+    m.attr("blahtexml_revision") = "unknown";
+#endif
 
     static py::exception<blahtex::Exception> ex(m, "BlahtexException");
+    // Subclasses of BlahtexException for exceeded limits, named after the
+    // error codes.
+    py::object limitExceeded = py::reinterpret_steal<py::object>(
+	PyErr_NewException("blahtex._blahtex.LimitExceeded", ex.ptr(), NULL));
+    if (! limitExceeded)
+	throw py::error_already_set();
+    m.attr("LimitExceeded") = limitExceeded;
+    for (const wchar_t* code: LIMIT_CODES) {
+	std::string name = py::cast(std::wstring(code)).cast<std::string>();
+	py::object type = py::reinterpret_steal<py::object>(
+	    PyErr_NewException(("blahtex._blahtex." + name).c_str(),
+			       limitExceeded.ptr(), NULL));
+	if (! type)
+	    throw py::error_already_set();
+	m.attr(name.c_str()) = type;
+	limitExceptions[code] = type.ptr();
+    }
     py::register_exception_translator([](std::exception_ptr p){
 	try {
 	    if (p) std::rethrow_exception(p);
 	} catch (const blahtex::Exception &e) {
-	    std::wstring msg = e.GetCode() + L": ";
-	    bool firstarg = true;
-	    for (std::wstring arg: e.GetArgs()) {
-		if (! firstarg)
-		    msg += L", ";
-		msg += arg;
-		firstarg = false;
-	    }
-	    PyErr_SetObject(ex.ptr(),
-			    PyUnicode_FromWideChar(msg.c_str(), msg.size()));
+	    py::object obj = MakeException(ex, e.GetCode(), e.GetArgs());
+	    PyErr_SetObject(reinterpret_cast<PyObject*>(Py_TYPE(obj.ptr())),
+			    obj.ptr());
 	}
     });
     
-    py::class_<blahtex::Interface>(m, "Blahtex")
+    py::class_<Core>(m, "Blahtex")
 	.def(py::init<>())
 	.def("process_input",
-	     &blahtex::Interface::ProcessInput,
+	     [](Core& self, py::handle input,
+		bool display_style) {
+		 std::wstring s = ReadInput(input);
+		 py::gil_scoped_release release;
+		 self.ProcessInput(s, display_style);
+	     },
 	     py::arg("input"), py::arg("display_style") = false)
-	.def("get_mathml", &blahtex::Interface::GetMathml)
-	.def("get_purified_tex", &blahtex::Interface::GetPurifiedTex)
-	.def("get_purified_tex_only", &blahtex::Interface::GetPurifiedTexOnly)
+	.def("get_mathml", &blahtex::Interface::GetMathml,
+	     py::call_guard<py::gil_scoped_release>())
+	.def("get_purified_tex", &blahtex::Interface::GetPurifiedTex,
+	     py::call_guard<py::gil_scoped_release>())
+	.def("get_purified_tex_only", &blahtex::Interface::GetPurifiedTexOnly,
+	     py::call_guard<py::gil_scoped_release>())
+	.def("convert",
+	     [](Core& self, py::handle input,
+		bool display_math, const Options* options,
+		const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 py::gil_scoped_release release;
+		 ScopedOptions scoped(self, options);
+		 return Convert(self, s, display_math, limits);
+	     },
+	     py::arg("input"), py::arg("display_math") = false,
+	     py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("convert_bytes",
+	     [](Core& self, py::handle input,
+		bool display_math, const Options* options,
+		const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 std::string result;
+		 {
+		     py::gil_scoped_release release;
+		     ScopedOptions scoped(self, options);
+		     result = EncodeUtf8(Convert(self, s, display_math,
+						 limits));
+		 }
+		 return py::bytes(result);
+	     },
+	     py::arg("input"), py::arg("display_math") = false,
+	     py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("convert_into",
+	     [](Core& self, py::handle input, py::handle out,
+		bool display_math, const Options* options,
+		const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 std::string result;
+		 {
+		     py::gil_scoped_release release;
+		     ScopedOptions scoped(self, options);
+		     result = EncodeUtf8(Convert(self, s, display_math,
+						 limits));
+		 }
+		 if (PyByteArray_Check(out.ptr())) {
+		     Py_ssize_t size = PyByteArray_Size(out.ptr());
+		     if (PyByteArray_Resize(out.ptr(), size + result.size()))
+			 throw py::error_already_set();
+		     std::copy(result.begin(), result.end(),
+			       PyByteArray_AsString(out.ptr()) + size);
+		 } else if (PyObject_CheckBuffer(out.ptr())) {
+		     py::buffer_info info =
+			 py::reinterpret_borrow<py::buffer>(out).request(true);
+		     if (info.ndim > 1 || info.itemsize != 1)
+			 throw py::type_error("buffer must be of bytes");
+		     if (static_cast<size_t>(info.size) < result.size())
+			 throw py::value_error("buffer is too small");
+		     std::copy(result.begin(), result.end(),
+			       static_cast<char*>(info.ptr));
+		 } else {
+		     out.attr("write")(py::bytes(result));
+		 }
+		 return result.size();
+	     },
+	     py::arg("input"), py::arg("out"), py::arg("display_math") = false,
+	     py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("parse",
+	     [](Core& self, py::handle input,
+		bool display_math, const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 std::unique_ptr<ParsedFormula> formula(new ParsedFormula);
+		 formula->mInterface.reset(new Core);
+		 formula->mDisplayMath = display_math;
+		 {
+		     py::gil_scoped_release release;
+		     Core& interface = *formula->mInterface;
+		     CopyOptions(interface, self);
+		     interface.mPurifiedTexOptions.mDisplayMath = display_math;
+		     Clock::time_point start = Clock::now();
+		     if (limits)
+			 CheckInput(s, *limits);
+		     interface.ProcessInput(s, display_math);
+		     if (limits)
+			 CheckDeadline(*limits, start);
+		 }
+		 return formula;
+	     },
+	     py::arg("input"), py::arg("display_math") = false,
+	     py::arg("limits") = py::none())
+	.def("get_mathml_bytes",
+	     [](Core& self) {
+		 std::string result;
+		 {
+		     py::gil_scoped_release release;
+		     bool displayMath = self.mPurifiedTexOptions.mDisplayMath;
+		     result = EncodeUtf8(WrapMathml(self.GetMathml(),
+						    displayMath,
+						    self.mIndented,
+						    self.mCompact));
+		 }
+		 return py::bytes(result);
+	     })
+	.def("convert_many",
+	     [](Core& self, py::iterable items,
+		const Options* options, const Limits* limits) {
+		 std::vector<std::pair<std::wstring, bool> > inputs =
+		     ReadBatch(items);
+		 std::vector<BatchResult> results;
+		 {
+		     ScopedOptions scoped(self, options);
+		     results = ConvertBatch(self, inputs, false, limits);
+		 }
+		 return BatchToList(ex, results, false);
+	     },
+	     py::arg("items"), py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("convert_stats",
+	     [](Core& self, py::handle input,
+		bool display_math, const Options* options,
+		const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 std::wstring result;
+		 ConversionStats stats;
+		 bool ok;
+		 {
+		     py::gil_scoped_release release;
+		     ScopedOptions scoped(self, options);
+		     ok = ConvertWithStats(self, s, display_math, result,
+					   stats, limits);
+		 }
+		 py::object item = ok ? py::cast(result)
+		     : MakeException(ex, stats.mError, stats.mErrorArgs);
+		 return py::make_tuple(item, StatsToTuple(stats));
+	     },
+	     py::arg("input"), py::arg("display_math") = false,
+	     py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("convert_many_stats",
+	     [](Core& self, py::iterable items,
+		const Options* options, const Limits* limits) {
+		 std::vector<std::pair<std::wstring, bool> > inputs =
+		     ReadBatch(items);
+		 std::vector<BatchResult> results;
+		 {
+		     ScopedOptions scoped(self, options);
+		     results = ConvertBatch(self, inputs, true, limits);
+		 }
+		 return BatchToList(ex, results, true);
+	     },
+	     py::arg("items"), py::arg("options") = py::none(),
+	     py::arg("limits") = py::none())
+	.def("validate",
+	     [](Core& self, py::handle input,
+		bool display_math, const Limits* limits) {
+		 std::wstring s = ReadInput(input);
+		 ValidationResult r;
+		 {
+		     py::gil_scoped_release release;
+		     r = Validate(self, s, display_math, limits);
+		 }
+		 return ValidationToPython(r);
+	     },
+	     py::arg("input"), py::arg("display_math") = false,
+	     py::arg("limits") = py::none())
+	.def("validate_many",
+	     [](Core& self, py::iterable items,
+		const Limits* limits) {
+		 std::vector<std::pair<std::wstring, bool> > inputs =
+		     ReadBatch(items);
+		 std::vector<ValidationResult> results(inputs.size());
+		 {
+		     py::gil_scoped_release release;
+		     for (size_t i = 0; i < inputs.size(); i++)
+			 results[i] = Validate(self, inputs[i].first,
+					       inputs[i].second, limits);
+		 }
+		 py::list list(results.size());
+		 for (size_t i = 0; i < results.size(); i++)
+		     list[i] = ValidationToPython(results[i]);
+		 return list;
+	     },
+	     py::arg("items"), py::arg("limits") = py::none())
+	.def("convert_column",
+	     [](const Core& self, py::object offsets,
+		py::object data, bool large, size_t offset, size_t length,
+		py::object validity, py::object display, size_t displayOffset,
+		size_t threads, const Limits* limits) {
+		 std::vector<py::buffer_info> views;
+		 size_t width = large ? sizeof(int64_t) : sizeof(int32_t);
+		 StringColumn column;
+		 column.mOffsets = ColumnBuffer(
+		     offsets, (offset + length + 1) * width, views, "offsets");
+		 if (column.mOffsets == NULL)
+		     throw py::value_error("offsets must be given");
+		 column.mLarge = large;
+		 column.mValidity = reinterpret_cast<const unsigned char*>(
+		     ColumnBuffer(validity, (offset + length + 7) / 8, views,
+				  "validity"));
+		 column.mOffset = offset;
+		 column.mLength = length;
+		 long long first = column.Offset(0);
+		 long long last = column.Offset(length);
+		 column.mData = ColumnBuffer(data, 0, views, "data");
+		 long long dataSize = 0;
+		 if (column.mData == NULL)
+		     column.mData = "";
+		 else
+		     dataSize = views.back().size * views.back().itemsize;
+		 if (first < 0 || last > dataSize)
+		     throw py::value_error("offsets are out of the data");
+		 for (size_t i = 0; i < length; i++)
+		     if (column.Offset(i) > column.Offset(i + 1))
+			 throw py::value_error("offsets are not sorted");
+		 const unsigned char* displayBits =
+		     reinterpret_cast<const unsigned char*>(ColumnBuffer(
+			 display, (displayOffset + length + 7) / 8, views,
+			 "display"));
+		 std::vector<ColumnCell> cells;
+		 {
+		     py::gil_scoped_release release;
+		     cells = ConvertColumn(self, column, displayBits,
+					   displayOffset, threads, limits);
+		 }
+		 return py::make_tuple(ColumnToPython(cells, false),
+				       ColumnToPython(cells, true));
+	     },
+	     py::arg("offsets"), py::arg("data"), py::arg("large"),
+	     py::arg("offset"), py::arg("length"), py::arg("validity"),
+	     py::arg("display"), py::arg("display_offset"),
+	     py::arg("threads"), py::arg("limits") = py::none())
+	.def("release", &ReleaseTrees)
+	.def_property_readonly("has_input",
+	     [](const Core& self) {
+		 return self.GetManager() != NULL;
+	     })
+	.def_static("canonical_key",
+	     [](py::handle input) {
+		 return CanonicalKey(ReadInput(input));
+	     },
+	     py::arg("input"))
+	.def_static("canonical_keys",
+	     [](py::iterable inputs) {
+		 std::vector<std::wstring> texts;
+		 for (py::handle input: inputs)
+		     texts.push_back(ReadInput(input));
+		 std::vector<std::wstring> keys(texts.size());
+		 {
+		     py::gil_scoped_release release;
+		     for (size_t i = 0; i < texts.size(); i++)
+			 keys[i] = CanonicalKey(texts[i]);
+		 }
+		 py::list list(keys.size());
+		 for (size_t i = 0; i < keys.size(); i++)
+		     list[i] = py::cast(keys[i]);
+		 return list;
+	     },
+	     py::arg("inputs"))
+	.def_static("compact_mathml", &CompactMathml, py::arg("mathml"))
+	.def_static("scan_input",
+	     [](py::handle input) {
+		 InputStats stats = ScanInput(ReadInput(input));
+		 return py::make_tuple(stats.mTokens, stats.mMacroDefinitions,
+				       stats.mMacroExpansions,
+				       stats.mMaxDepth);
+	     },
+	     py::arg("input"))
+	.def("copy_options", &CopyOptions<Core, Core>,
+	     py::arg("other"))
+	.def("copy_options", &CopyOptions<Core, Options>,
+	     py::arg("other"))
 	.def_readwrite("mathml_options",
 		       &blahtex::Interface::mMathmlOptions)
 	.def_readwrite("encoding_options",
@@ -72,7 +1903,105 @@ PYBIND11_MODULE(_blahtex, m) {
 		       &blahtex::Interface::mPurifiedTexOptions)
 	.def_readwrite("texvc_compatibility",
 		       &blahtex::Interface::mTexvcCompatibility)
-	.def_readwrite("indented", &blahtex::Interface::mIndented);
+	.def_readwrite("indented", &blahtex::Interface::mIndented)
+	.def_readwrite("compact", &Core::mCompact);
+
+    m.def("resident_memory",
+	  []() {
+	      std::pair<long long, long long> r = ResidentMemory();
+	      py::object current = py::none(), peak = py::none();
+	      if (r.first >= 0)
+		  current = py::int_(r.first);
+	      if (r.second >= 0)
+		  peak = py::int_(r.second);
+	      return py::make_tuple(current, peak);
+	  });
+
+    m.def("sort_archive_table",
+	  [](py::buffer table) {
+	      py::buffer_info info = table.request(true);
+	      if (info.ndim != 1 || info.itemsize != 8 ||
+		  info.strides[0] != 8)
+		  throw py::value_error("table must be an array('Q')");
+	      size_t count = static_cast<size_t>(info.shape[0]);
+	      int bits = 0;
+	      while (bits < 63 && (static_cast<uint64_t>(1) << bits) <= count)
+		  bits++;
+	      py::gil_scoped_release release;
+	      SortArchiveTable(static_cast<uint64_t*>(info.ptr), count, bits);
+	  },
+	  py::arg("table"));
+
+    py::class_<OutputBuffer>(m, "OutputBuffer", py::buffer_protocol())
+	.def_buffer([](OutputBuffer& self) {
+	    return py::buffer_info(&self.mData[0], 1,
+				   py::format_descriptor<uint8_t>::format(),
+				   static_cast<py::ssize_t>(self.mData.size()));
+	})
+	.def("__len__", [](const OutputBuffer& self) {
+	    return self.mData.size();
+	});
+
+    py::class_<Limits>(m, "Limits")
+	.def(py::init<>())
+	.def_readwrite("max_input_length", &Limits::mMaxInputLength)
+	.def_readwrite("max_tokens", &Limits::mMaxTokens)
+	.def_readwrite("max_macro_expansions", &Limits::mMaxMacroExpansions)
+	.def_readwrite("max_depth", &Limits::mMaxDepth)
+	.def_readwrite("max_nodes", &Limits::mMaxNodes)
+	.def_readwrite("deadline", &Limits::mDeadline);
+
+    py::class_<Options>(m, "Options")
+	.def(py::init<>())
+	.def("copy_options", &CopyOptions<Options, Core>,
+	     py::arg("other"))
+	.def_readwrite("mathml_options", &Options::mMathmlOptions)
+	.def_readwrite("encoding_options", &Options::mEncodingOptions)
+	.def_readwrite("purified_tex_options", &Options::mPurifiedTexOptions)
+	.def_readwrite("texvc_compatibility", &Options::mTexvcCompatibility)
+	.def_readwrite("indented", &Options::mIndented)
+	.def_readwrite("compact", &Options::mCompact);
+
+    py::class_<ParsedFormula>(m, "ParsedFormula")
+	.def_readonly("display_math", &ParsedFormula::mDisplayMath)
+	.def("render",
+	     [](ParsedFormula& self, const std::string& format,
+		const Options* options) {
+		 RenderFormat f = ReadRenderFormat(format);
+		 RenderResult r;
+		 {
+		     py::gil_scoped_release release;
+		     std::lock_guard<std::mutex> lock(self.mMutex);
+		     r = Render(self, f, options);
+		 }
+		 return RenderToPython(r);
+	     },
+	     py::arg("format"), py::arg("options") = py::none())
+	.def("render_all",
+	     [](ParsedFormula& self, py::iterable requests) {
+		 std::vector<std::pair<RenderFormat, const Options*> > items;
+		 std::vector<py::object> keepAlive;
+		 for (py::handle request: requests) {
+		     py::sequence pair = request.cast<py::sequence>();
+		     keepAlive.push_back(pair[1]);
+		     items.emplace_back(
+			 ReadRenderFormat(pair[0].cast<std::string>()),
+			 pair[1].cast<const Options*>());
+		 }
+		 std::vector<RenderResult> results;
+		 {
+		     py::gil_scoped_release release;
+		     std::lock_guard<std::mutex> lock(self.mMutex);
+		     for (size_t i = 0; i < items.size(); i++)
+			 results.push_back(Render(self, items[i].first,
+						  items[i].second));
+		 }
+		 py::list list(results.size());
+		 for (size_t i = 0; i < results.size(); i++)
+		     list[i] = RenderToPython(results[i]);
+		 return list;
+	     },
+	     py::arg("requests"));
 
     py::class_<blahtex::MathmlOptions> mathml_options(m, "MathmlOptions");
     mathml_options
@@ -1,5 +1,10 @@
+import io
+import pickle
+import subprocess
+import sys
+import threading
 import unittest
-from blahtex import Blahtex, BlahtexException
+from blahtex import Blahtex, BlahtexException, BlahtexOptions
 
 class TestAll(unittest.TestCase):
 
@@ -30,11 +35,49 @@ class TestAll(unittest.TestCase):
         bt.set_options(options)
         self.assertEqual(bt.get_options(), options)
 
+    def test_profile(self):
+        bt = Blahtex()
+        strict = BlahtexOptions(spacing=Blahtex.SPACING.STRICT, indented=True)
+        self.assertEqual(strict.spacing, Blahtex.SPACING.STRICT)
+        self.assertEqual(strict, BlahtexOptions(**strict.as_dict()))
+        self.assertEqual(hash(strict), hash(strict.replace()))
+        self.assertNotEqual(strict, strict.replace(indented=False))
+        self.assertEqual(BlahtexOptions(), bt.get_profile())
+        with self.assertRaises(AttributeError):
+            strict.indented = False
+        with self.assertRaises(ValueError):
+            BlahtexOptions(spacing=100)
+
+        plain = bt.convert(r'\sqrt{3}')
+        with_profile = bt.convert(r'\sqrt{3}', options=strict)
+        self.assertEqual(bt.get_options(), BlahtexOptions().as_dict())
+        self.assertEqual(bt.convert(r'\sqrt{3}'), plain)
+        self.assertEqual(bt.convert_many([r'\sqrt{3}'], options=strict),
+                         [with_profile])
+        bt.set_options(strict)
+        self.assertEqual(bt.get_options(), strict.as_dict())
+        self.assertEqual(bt.convert(r'\sqrt{3}'), with_profile)
+
     def test_bad_option_value(self):
         bt = Blahtex()
         with self.assertRaises(ValueError):
             bt.not_exist_key = True
 
+    def test_option_enums(self):
+        self.assertIs(Blahtex.SPACING, Blahtex().SPACING)
+        self.assertIs(pickle.loads(pickle.dumps(Blahtex.SPACING.STRICT)),
+                      Blahtex.SPACING.STRICT)
+        self.assertEqual(Blahtex.ENCODING.__qualname__, 'Blahtex.ENCODING')
+        self.assertEqual(Blahtex().spacing, Blahtex.SPACING.RELAXED)
+
+    def test_lazy_imports(self):
+        script = ('import sys, blahtex; blahtex.Blahtex().convert("x"); '
+                  'print(" ".join(sorted(sys.modules)))')
+        modules = subprocess.check_output(
+            [sys.executable, '-c', script]).decode().split()
+        for name in ('enum', 'textwrap', 'threading'):
+            self.assertNotIn(name, modules)
+
     def test_bad_option_value(self):
         bt = Blahtex()
         bt.other_encoding = Blahtex.ENCODING.NUMERIC
@@ -50,6 +93,123 @@ class TestAll(unittest.TestCase):
         bt = Blahtex()
         with self.assertRaises(BlahtexException):
             bt.convert(r'\badcommand')
+
+    def test_exception_attributes(self):
+        bt = Blahtex()
+        with self.assertRaises(BlahtexException) as cm:
+            bt.convert(r'\badcommand')
+        self.assertTrue(cm.exception.code)
+        self.assertIsInstance(cm.exception.arguments, tuple)
+
+    def test_convert_many(self):
+        bt = Blahtex()
+        inputs = [r'\sqrt{3}', (r'\badcommand', False), (r'x^2', True)]
+        results = bt.convert_many(inputs)
+        self.assertEqual(results[0], bt.convert(r'\sqrt{3}'))
+        self.assertIsInstance(results[1], BlahtexException)
+        self.assertEqual(results[2], bt.convert(r'x^2', True))
+        self.assertEqual(bt.convert_many([]), [])
+
+    def test_bytes(self):
+        bt = Blahtex(indented=True)
+        expected = bt.convert(r'\mathfrak{A} \alpha', True).encode('utf-8')
+        self.assertEqual(bt.convert_bytes(r'\mathfrak{A} \alpha', True),
+                         expected)
+        self.assertEqual(bt.get_mathml_bytes(), expected)
+        self.assertEqual(
+            bt.convert_bytes(memoryview(r'\mathfrak{A} \alpha'.encode()), True),
+            expected)
+        out = bytearray(b'>')
+        self.assertEqual(bt.convert_into(b'\\mathfrak{A} \\alpha', out, True),
+                         len(expected))
+        self.assertEqual(out, b'>' + expected)
+        buf = bytearray(len(expected) + 10)
+        bt.convert_into(r'\mathfrak{A} \alpha', memoryview(buf), True)
+        self.assertEqual(bytes(buf[:len(expected)]), expected)
+        with self.assertRaises(ValueError):
+            bt.convert_into(r'\alpha', memoryview(bytearray(3)))
+        f = io.BytesIO()
+        bt.convert_into(r'\mathfrak{A} \alpha', f, True)
+        self.assertEqual(f.getvalue(), expected)
+        self.assertEqual(bt.convert_many([b'x', (bytearray(b'y'), True)]),
+                         [bt.convert('x'), bt.convert('y', True)])
+
+    def test_parse(self):
+        bt = Blahtex()
+        formula = bt.parse(r'\frac{1}{\alpha}', True)
+        expected = bt.convert(r'\frac{1}{\alpha}', True)
+        purified = bt.get_purified_tex()
+        self.assertTrue(formula.display_math)
+        self.assertEqual(formula.mathml(), expected)
+        self.assertEqual(formula.mathml_bytes(), expected.encode('utf-8'))
+        self.assertEqual(formula.purified_tex(), purified)
+        numeric = BlahtexOptions(mathml_encoding=Blahtex.ENCODING.NUMERIC,
+                                 indented=True)
+        results = formula.render_all(
+            ['mathml', ('mathml', numeric), ('mathml_bytes', None),
+             'purified_tex_only'])
+        self.assertEqual(results[0], expected)
+        self.assertEqual(results[1], bt.convert(r'\frac{1}{\alpha}', True,
+                                                options=numeric))
+        self.assertEqual(results[2], expected.encode('utf-8'))
+        self.assertEqual(results[3], bt.get_purified_tex_only())
+        self.assertEqual(formula.mathml(), expected)
+        with self.assertRaises(ValueError):
+            formula.render_all(['png'])
+        with self.assertRaises(BlahtexException):
+            bt.parse(r'\badcommand')
+
+    def test_reset(self):
+        bt = Blahtex()
+        self.assertFalse(bt.memory_usage()['retained'])
+        mathml = bt.convert(r'\sqrt{3}')
+        self.assertTrue(bt.memory_usage()['retained'])
+        bt.reset()
+        self.assertFalse(bt.memory_usage()['retained'])
+        with self.assertRaises(ValueError):
+            bt.get_mathml()
+        self.assertEqual(bt.convert(r'\sqrt{3}'), mathml)
+        self.assertEqual(bt.get_mathml(), mathml)
+
+    def test_release_trees(self):
+        bt = Blahtex(indented=True)
+        expected = bt.convert(r'\sqrt{3}', True)
+        bt.set_release_trees()
+        self.assertEqual(bt.convert(r'\sqrt{3}', True), expected)
+        self.assertFalse(bt.memory_usage()['retained'])
+        with self.assertRaises(ValueError):
+            bt.get_mathml()
+        with self.assertRaises(BlahtexException):
+            bt.convert(r'\badcommand')
+        self.assertEqual(bt.convert_many([(r'\sqrt{3}', True)]), [expected])
+        self.assertFalse(bt.validate(r'\badcommand').valid)
+        self.assertFalse(bt.memory_usage()['retained'])
+        bt.process_input(r'\sqrt{3}', True)
+        self.assertEqual(bt.get_mathml(), expected)
+        usage = bt.memory_usage()
+        if usage['resident'] is not None:
+            self.assertGreater(usage['resident'], 0)
+
+    def test_threads(self):
+        inputs = [(r'\sqrt{%d}' % i, i % 2 == 0) for i in range(100)]
+        inputs.append((r'\begin{array}{cc} a & b \\ c & d \end{array}', True))
+        bt = Blahtex(indented=True)
+        expected = [bt.convert(s, d) for s, d in inputs]
+        results = {}
+        def worker(n):
+            results[n] = [bt.convert(s, d) for s, d in inputs]
+            with self.assertRaises(BlahtexException):
+                bt.convert(r'\badcommand')
+            bt.process_input(inputs[n][0], inputs[n][1])
+            results[n].append(bt.get_mathml())
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for n in range(8):
+            self.assertEqual(results[n], expected + [expected[n]])
     
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,168 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.archive import (ArchiveReader, ArchiveWriter, merge_archives,
+                             main)
+from blahtex.cli import main as cli_main
+
+FORMULAS = [
+    ('a', r'x^2 + y^2'),
+    ('b', r'\frac{1}{2', True),
+    ('c', r'\sqrt{3} \pi', True),
+    (4, r'\alpha'),
+]
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bt = Blahtex()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, items):
+        path = self.path(name)
+        with ArchiveWriter(path) as writer:
+            self.assertEqual(writer.convert(self.bt, items, chunksize=3),
+                             len(items))
+        return path
+
+    def test_read(self):
+        path = self.write('a.bta', FORMULAS)
+        with ArchiveReader(path) as reader:
+            self.assertEqual(len(reader), 4)
+            mathml = reader.get('a')
+            self.assertIsInstance(mathml, memoryview)
+            self.assertEqual(str(mathml, 'utf-8'),
+                             self.bt.convert(r'x^2 + y^2'))
+            mathml.release()
+            self.assertEqual(str(reader.get(4), 'utf-8'),
+                             self.bt.convert(r'\alpha'))
+            self.assertEqual(str(reader.get_at(-2), 'utf-8'),
+                             self.bt.convert(r'\sqrt{3} \pi', True))
+            with self.assertRaises(BlahtexException) as cm:
+                reader.get('b')
+            with self.assertRaises(BlahtexException) as expected:
+                self.bt.convert(r'\frac{1}{2', True)
+            self.assertEqual(cm.exception.code, expected.exception.code)
+            self.assertEqual(str(cm.exception), str(expected.exception))
+            with self.assertRaises(KeyError):
+                reader.get('d')
+            with self.assertRaises(IndexError):
+                reader.get_at(4)
+            self.assertIn('c', reader)
+            self.assertNotIn('4 ', reader)
+            self.assertEqual(reader.find('c'), 2)
+            self.assertEqual(list(reader.ids()), ['a', 'b', 'c', '4'])
+            records = list(reader)
+            self.assertEqual([r.id for r in records], ['a', 'b', 'c', '4'])
+            self.assertIsNone(records[1].mathml)
+            self.assertEqual(records[1].error.code, expected.exception.code)
+            self.assertEqual(bytes(records[2].mathml),
+                             bytes(reader.record(2).mathml))
+            # A view of the archive keeps it mapped.
+            with self.assertRaises(BufferError):
+                reader.close()
+            del records
+        reader.close()
+
+    def test_writer(self):
+        path = self.path('w.bta')
+        with ArchiveWriter(path) as writer:
+            self.assertEqual(writer.add('x', '<math/>'), 0)
+            writer.add_many([('y', ValueError('bad line')), ('x', '<m/>')])
+            self.assertEqual(len(writer), 3)
+        with self.assertRaises(ValueError):
+            writer.add('z', '')
+        with ArchiveReader(path) as reader:
+            # The last record of an id is found.
+            self.assertEqual(bytes(reader.get('x')), b'<m/>')
+            self.assertEqual(bytes(reader.get_at(0)), b'<math/>')
+            with self.assertRaises(BlahtexException) as cm:
+                reader.get('y')
+            self.assertEqual(cm.exception.code, 'ValueError')
+            self.assertEqual(cm.exception.arguments, ('bad line',))
+        with ArchiveWriter(self.path('empty.bta')):
+            pass
+        with ArchiveReader(self.path('empty.bta')) as reader:
+            self.assertEqual(len(reader), 0)
+            self.assertEqual(list(reader), [])
+            self.assertEqual(reader.find('x'), -1)
+
+    def test_unfinished(self):
+        path = self.path('u.bta')
+        writer = ArchiveWriter(path)
+        writer.add('x', '<math/>')
+        writer._file.flush()
+        with self.assertRaises(ValueError):
+            ArchiveReader(path)
+        writer.close()
+        with ArchiveReader(path) as reader:
+            self.assertEqual(len(reader), 1)
+        # An archive left by an exception has no index.
+        with self.assertRaises(RuntimeError):
+            with ArchiveWriter(path) as writer:
+                writer.add('x', '<math/>')
+                raise RuntimeError()
+        with self.assertRaises(ValueError):
+            ArchiveReader(path)
+
+    def test_many(self):
+        path = self.path('many.bta')
+        with ArchiveWriter(path) as writer:
+            for i in range(3000):
+                writer.add('f{}'.format(i % 2500), str(i))
+        with ArchiveReader(path) as reader:
+            for i in range(2500):
+                expected = i + 2500 if i < 500 else i
+                self.assertEqual(reader.find('f{}'.format(i)), expected)
+            self.assertEqual(reader.find('f2500'), -1)
+
+    def test_merge(self):
+        first = self.write('1.bta', FORMULAS[:2])
+        second = self.write('2.bta', FORMULAS[2:] + [('a', r'\beta')])
+        output = self.path('all.bta')
+        self.assertEqual(merge_archives(output, [first, second]), 5)
+        with ArchiveReader(output) as reader:
+            self.assertEqual(list(reader.ids()), ['a', 'b', 'c', '4', 'a'])
+            self.assertEqual(str(reader.get('a'), 'utf-8'),
+                             self.bt.convert(r'\beta'))
+            self.assertEqual(str(reader.get('c'), 'utf-8'),
+                             self.bt.convert(r'\sqrt{3} \pi', True))
+            with self.assertRaises(BlahtexException):
+                reader.get('b')
+        with self.assertRaises(ValueError):
+            merge_archives(first, [first, second])
+
+    def test_tools(self):
+        stderr, stdout = sys.stderr, sys.stdout
+        sys.stderr, sys.stdout = io.StringIO(), io.StringIO()
+        try:
+            src = self.path('in.txt')
+            with open(src, 'w', encoding='utf-8') as f:
+                f.write('x^2\n\\bad\n')
+            first = self.path('1.bta')
+            self.assertEqual(cli_main([src, '-q', '--archive',
+                                       '-o', first]), 1)
+            second = self.write('2.bta', FORMULAS[2:3])
+            merged = self.path('all.bta')
+            self.assertEqual(main(['merge', '-o', merged, first, second]),
+                             0)
+            self.assertEqual(main(['get', merged, '1', 'c']), 0)
+            self.assertEqual(main(['get', merged, '2']), 1)
+            self.assertEqual(sys.stdout.getvalue().splitlines(), [
+                self.bt.convert('x^2'),
+                self.bt.convert(r'\sqrt{3} \pi', True)])
+        finally:
+            sys.stderr, sys.stdout = stderr, stdout
+
+if __name__ == '__main__':
+    unittest.main()
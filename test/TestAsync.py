@@ -0,0 +1,139 @@
+import asyncio
+import gc
+import logging
+import threading
+import time
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.aio import AsyncBlahtex
+
+HEAVY = (r'\begin{array}{' + 'c' * 20 + '}' +
+         r' \\ '.join(' & '.join(r'\frac{x_{%d}}{y^{%d}}' % (i, j)
+                                 for j in range(20))
+                      for i in range(100)) +
+         r'\end{array}')
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+class TestAsync(unittest.TestCase):
+
+    def test_convert(self):
+        bt = Blahtex()
+        abl = AsyncBlahtex(max_concurrency=2)
+        async def main():
+            results = await asyncio.gather(
+                *[abl.convert(r'\sqrt{%d}' % i, i % 2 == 0)
+                  for i in range(20)])
+            with self.assertRaises(BlahtexException):
+                await abl.convert(r'\badcommand')
+            return results
+        results = run(main())
+        abl.close()
+        self.assertEqual(results, [bt.convert(r'\sqrt{%d}' % i, i % 2 == 0)
+                                   for i in range(20)])
+
+    def test_convert_many(self):
+        inputs = [r'x_{%d}' % i for i in range(300)] + [r'\badcommand']
+        expected = Blahtex().convert_many(inputs)
+        async def main():
+            async with AsyncBlahtex(max_concurrency=3) as abl:
+                return [r async for r in abl.convert_many(inputs, 16)]
+        results = run(main())
+        self.assertEqual(results[:-1], expected[:-1])
+        self.assertIsInstance(results[-1], BlahtexException)
+
+    def test_loops(self):
+        abl = AsyncBlahtex(max_concurrency=2)
+        expected = [Blahtex().convert(HEAVY)] * 6
+        async def main():
+            return await asyncio.gather(*[abl.convert(HEAVY)
+                                          for i in range(6)])
+        self.assertEqual(run(main()), expected)
+        self.assertEqual(run(main()), expected)
+        abl.close()
+
+    def test_break(self):
+        inputs = [HEAVY] * 8
+        errors = []
+        async def main():
+            asyncio.get_running_loop().set_exception_handler(
+                lambda loop, context: errors.append(context))
+            async with AsyncBlahtex(max_concurrency=3) as abl:
+                results = abl.convert_many(inputs, 1)
+                async for result in results:
+                    break
+                await results.aclose()
+                return result
+        self.assertEqual(run(main()), Blahtex().convert(HEAVY))
+        gc.collect()
+        self.assertEqual(errors, [])
+
+    def test_closed_loop(self):
+        abl = AsyncBlahtex(max_concurrency=1)
+        started, finish = threading.Event(), threading.Event()
+        def convert():
+            started.set()
+            finish.wait()
+        async def main():
+            task = asyncio.ensure_future(abl._run(convert))
+            await asyncio.get_running_loop().run_in_executor(
+                None, started.wait)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('concurrent.futures')
+        logger.addHandler(handler)
+        try:
+            # The loop is closed before the conversion finishes.
+            run(main())
+            finish.set()
+            abl.close()
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(records, [])
+
+    def test_cancel(self):
+        abl = AsyncBlahtex(max_concurrency=1)
+        async def main():
+            tasks = [asyncio.ensure_future(abl.convert(HEAVY))
+                     for i in range(4)]
+            await asyncio.sleep(0)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            return await abl.convert(r'\sqrt{3}')
+        self.assertEqual(run(main()), Blahtex().convert(r'\sqrt{3}'))
+        abl.close()
+
+    def test_loop_latency(self):
+        abl = AsyncBlahtex(max_concurrency=2)
+        async def ticker(lags, done):
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lags.append(time.perf_counter() - start - 0.001)
+        async def main():
+            lags = []
+            done = asyncio.Event()
+            tick = asyncio.ensure_future(ticker(lags, done))
+            await asyncio.gather(*[abl.convert(HEAVY, True)
+                                   for i in range(8)])
+            done.set()
+            await tick
+            return sorted(lags)
+        lags = run(main())
+        abl.close()
+        p50 = lags[len(lags) // 2]
+        p99 = lags[min(len(lags) - 1, len(lags) * 99 // 100)]
+        self.assertLess(p50, 0.01)
+        self.assertLess(p99, 0.05)
+
+if __name__ == '__main__':
+    unittest.main()
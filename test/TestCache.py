@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+from blahtex import Blahtex, BlahtexException, _blahtex
+from blahtex.cache import LRUCache, SQLiteCache
+
+class TestCache(unittest.TestCase):
+
+    def test_hit(self):
+        bt = Blahtex()
+        bt.set_cache(LRUCache(maxsize=10))
+        first = bt.convert(r'\frac{1}{2}')
+        self.assertEqual(bt.convert(r'\frac{1}{2}'), first)
+        info = bt.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 1, 1))
+        bt.convert(r'\frac{1}{2}', True)
+        self.assertEqual(bt.cache_info().misses, 2)
+
+    def test_option_change(self):
+        bt = Blahtex()
+        bt.set_cache(LRUCache())
+        inline = bt.convert(r'\alpha')
+        bt.indented = True
+        self.assertNotEqual(bt.convert(r'\alpha'), inline)
+        bt.set_options(indented=False)
+        self.assertEqual(bt.convert(r'\alpha'), inline)
+        self.assertEqual(bt.cache_info().hits, 1)
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        bt = Blahtex()
+        bt.set_cache(cache)
+        for s in ('a', 'b', 'a', 'c', 'a', 'b'):
+            bt.convert(s)
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses), (2, 4))
+        self.assertEqual((info.evictions, info.currsize), (2, 2))
+        cache = LRUCache(maxsize=None, maxbytes=1)
+        cache.put(('a', False, ''), 'x')
+        self.assertEqual(cache.info().currsize, 0)
+
+    def test_error(self):
+        bt = Blahtex()
+        bt.set_cache(LRUCache())
+        for i in range(2):
+            with self.assertRaises(BlahtexException) as cm:
+                bt.convert(r'\badcommand')
+            self.assertTrue(cm.exception.code)
+        self.assertEqual(bt.cache_info().hits, 1)
+
+    def test_convert_many(self):
+        bt = Blahtex()
+        expected = bt.convert_many([r'x', (r'\badcommand', False), (r'y', True)])
+        bt.set_cache(LRUCache())
+        bt.convert('x')
+        results = bt.convert_many([r'x', (r'\badcommand', False), (r'y', True)])
+        self.assertEqual(results[0], expected[0])
+        self.assertIsInstance(results[1], BlahtexException)
+        self.assertEqual(results[2], expected[2])
+        self.assertEqual(bt.cache_info().hits, 1)
+
+class TestSQLiteCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_persistent(self):
+        bt = Blahtex()
+        cache = SQLiteCache(self.path)
+        bt.set_cache(cache)
+        expected = bt.convert(r'\sqrt{3}', True)
+        with self.assertRaises(BlahtexException):
+            bt.convert(r'\badcommand')
+        cache.close()
+
+        bt = Blahtex()
+        bt.set_cache(SQLiteCache(self.path))
+        self.assertEqual(bt.convert(r'\sqrt{3}', True), expected)
+        with self.assertRaises(BlahtexException) as cm:
+            bt.convert(r'\badcommand')
+        self.assertTrue(cm.exception.code)
+        info = bt.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 0, 2))
+        bt.indented = True
+        self.assertNotEqual(bt.convert(r'\sqrt{3}', True), expected)
+
+    def test_blahtexml_revision(self):
+        cache = SQLiteCache(self.path)
+        key = ('x', False, Blahtex()._options_fingerprint())
+        cache.put(key, '<math/>')
+        self.assertEqual(cache.get(key), '<math/>')
+        revision = _blahtex.blahtexml_revision
+        _blahtex.blahtexml_revision = revision + '-other'
+        try:
+            self.assertIsNone(cache.get(key))
+        finally:
+            _blahtex.blahtexml_revision = revision
+
+    def test_warm_and_evict(self):
+        corpus = os.path.join(self.tmpdir, 'corpus.tex')
+        with open(corpus, 'w', encoding='utf-8') as f:
+            for i in range(300):
+                f.write('x^{%d}\n' % i)
+        bt = Blahtex()
+        cache = SQLiteCache(self.path)
+        self.assertEqual(cache.warm(bt, corpus, chunksize=64), 300)
+        self.assertEqual(cache.warm(bt, corpus), 0)
+        bt.set_cache(cache)
+        self.assertEqual(bt.convert('x^{7}'), Blahtex().convert('x^{7}'))
+        self.assertEqual(cache.info().hits, 1)
+        cache.maxbytes = cache.info().currbytes // 2
+        cache.EVICT_BATCH = 16
+        self.assertGreater(cache.evict(), 16)
+        self.assertLessEqual(cache.info().currbytes, cache.maxbytes)
+        cache.compact()
+
+    def test_warm_limits(self):
+        bt = Blahtex()
+        bt.set_limits(max_input_length=4)
+        cache = SQLiteCache(self.path)
+        self.assertEqual(cache.warm(bt, ['x', 'x+y+z']), 2)
+        bt.set_cache(cache)
+        with self.assertRaises(BlahtexException) as cm:
+            bt.convert('x+y+z')
+        self.assertEqual(cm.exception.code, 'InputTooLong')
+        self.assertEqual(cache.info().hits, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from blahtex import Blahtex
+from blahtex.cli import main
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stderr = sys.stderr
+        sys.stderr = io.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.dir)
+
+    def path(self, name, text=None):
+        path = os.path.join(self.dir, name)
+        if text is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return path
+
+    def run_cli(self, *argv):
+        out = self.path('out.jsonl')
+        status = main(list(argv) + ['-o', out])
+        with open(out, encoding='utf-8') as f:
+            return status, [json.loads(line) for line in f]
+
+    def test_lines(self):
+        src = self.path('in.txt', 'x^2\n\n\\sqrt{2}\n')
+        status, records = self.run_cli(src, '-q')
+        bt = Blahtex()
+        self.assertEqual(status, 0)
+        self.assertEqual(records, [
+            {'id': 1, 'mathml': bt.convert('x^2')},
+            {'id': 3, 'mathml': bt.convert(r'\sqrt{2}')}])
+        self.assertEqual(sys.stderr.getvalue(), '')
+
+    def test_jsonl(self):
+        lines = [json.dumps({'id': 'a', 'tex': 'x', 'display': True}),
+                 json.dumps({'tex': r'\bad'}),
+                 '{not json',
+                 json.dumps({'id': 'b'})]
+        src = self.path('in.jsonl', '\n'.join(lines) + '\n')
+        status, records = self.run_cli(src, '--indented')
+        self.assertEqual(status, 1)
+        self.assertEqual(records[0],
+                         {'id': 'a', 'mathml': Blahtex(indented=True)
+                          .convert('x', True)})
+        self.assertEqual(records[1]['id'], 2)
+        self.assertEqual(records[1]['error']['code'], 'UnrecognisedCommand')
+        self.assertEqual(records[2]['error']['code'], 'ValueError')
+        self.assertEqual(records[3]['error']['code'], 'ValueError')
+        self.assertIn('4 formulas, 3 errors', sys.stderr.getvalue())
+
+    def test_options_and_jobs(self):
+        src = self.path('in.txt', ''.join(
+            r'\alpha_{%d}' % i + '\n' for i in range(50)))
+        bt = Blahtex(spacing=Blahtex.SPACING.STRICT)
+        expected = [bt.convert(r'\alpha_{%d}' % i) for i in range(50)]
+        for jobs in ('1', '2'):
+            status, records = self.run_cli(
+                src, '-j', jobs, '--chunksize', '7', '--spacing', 'strict',
+                '-q')
+            self.assertEqual([r['mathml'] for r in records], expected)
+            self.assertEqual([r['id'] for r in records], list(range(1, 51)))
+
+    def test_stdin_text(self):
+        stdin = sys.stdin
+        sys.stdin = io.StringIO('x\n\\bad\n')
+        try:
+            out = self.path('out.txt')
+            status = main(['--text', '-q', '-o', out])
+        finally:
+            sys.stdin = stdin
+        with open(out, encoding='utf-8') as f:
+            self.assertEqual(f.read(), Blahtex().convert('x') + '\n\n')
+        self.assertEqual(status, 1)
+        self.assertIn('UnrecognisedCommand', sys.stderr.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
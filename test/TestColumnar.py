@@ -0,0 +1,105 @@
+import array
+import unittest
+from blahtex import Blahtex, BlahtexException
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.bt = Blahtex()
+        self.inputs = [r'\sqrt{2}', r'\badcommand', None, r'x^2', '']
+
+    def expected(self, display=False):
+        mathml, errors = [], []
+        for s in self.inputs:
+            if s is None:
+                mathml.append(None)
+                errors.append(None)
+                continue
+            try:
+                mathml.append(self.bt.convert(s, display))
+                errors.append(None)
+            except BlahtexException as e:
+                mathml.append(None)
+                errors.append(str(e))
+        return mathml, errors
+
+    def test_native_layout(self):
+        # buffers in the layout of Arrow, without pyarrow
+        strs = [b'x', b'\xff', b'\\alpha']
+        offsets = [0]
+        for s in strs:
+            offsets.append(offsets[-1] + len(s))
+        core = self.bt._thread_core()
+        mathml, errors = core.convert_column(
+            array.array('q', offsets), b''.join(strs), True, 1, 2,
+            None, bytes([0b10]), 0, 2)
+        large, offs, data, validity, nulls = mathml
+        self.assertFalse(large)
+        self.assertEqual(nulls, 1)
+        self.assertEqual(bytes(validity)[0] & 3, 2)
+        self.assertEqual(bytes(data).decode('utf-8'),
+                         self.bt.convert(r'\alpha', True))
+        self.assertEqual(list(array.array('i', bytes(offs))),
+                         [0, 0, len(bytes(data))])
+        self.assertTrue(bytes(errors[2]).startswith(b'InvalidUtf8'))
+        with self.assertRaises(ValueError):
+            core.convert_column(array.array('i', [0, 9]), b'x', False,
+                                0, 1, None, None, 0, 1)
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_arrow(self):
+        from blahtex.columnar import convert_column
+        mathml, errors = self.expected()
+        result = convert_column(self.bt, pa.array(self.inputs), threads=3)
+        self.assertEqual(result[0].to_pylist(), mathml)
+        self.assertEqual(result[1].to_pylist(), errors)
+        self.assertEqual(result[0].type, pa.string())
+
+    @unittest.skipIf(pa is None, 'pyarrow is not installed')
+    def test_chunked_and_display(self):
+        from blahtex.columnar import convert_column
+        self.inputs = [r'x_{%d}' % i for i in range(300)]
+        display = [i % 3 == 0 for i in range(300)]
+        column = pa.chunked_array([pa.array(self.inputs[:100]),
+                                   pa.array(self.inputs[100:])])
+        mathml, errors = convert_column(self.bt, column.slice(5),
+                                        display_math=display[5:])
+        expected = [self.bt.convert(s, d)
+                    for s, d in zip(self.inputs, display)][5:]
+        self.assertEqual(mathml.to_pylist(), expected)
+        self.assertEqual(errors.null_count, 295)
+        mathml, errors = convert_column(
+            self.bt, pa.array(self.inputs, pa.large_string()),
+            display_math=True, threads=1)
+        self.assertEqual(mathml.to_pylist(),
+                         [self.bt.convert(s, True) for s in self.inputs])
+        with self.assertRaises(ValueError):
+            convert_column(self.bt, self.inputs, display_math=[True])
+        with self.assertRaises(TypeError):
+            convert_column(self.bt, pa.array([1, 2]))
+
+    @unittest.skipIf(pa is None or numpy is None,
+                     'pyarrow or numpy is not installed')
+    def test_numpy(self):
+        from blahtex.columnar import convert_column
+        mathml, errors = self.expected()
+        result = convert_column(self.bt, numpy.array(self.inputs, object))
+        self.assertEqual(result[0].to_pylist(), mathml)
+        inputs = [s for s in self.inputs if s is not None]
+        result = convert_column(self.bt, numpy.array(inputs))
+        self.assertEqual(result[0].to_pylist(),
+                         [m for s, m in zip(self.inputs, mathml)
+                          if s is not None])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import itertools
+import re
+import unittest
+import xml.etree.ElementTree as ET
+from blahtex import Blahtex, BlahtexOptions, _blahtex
+
+FORMULAS = [
+    r'x^2 + y_i = z^{n+1}',
+    r'\frac{a}{b} \cdot \sqrt[3]{x}',
+    r'\sin x + \log_2 y',
+    r'\sum_{k=1}^n k^2 = \frac{n(n+1)(2n+1)}{6}',
+    r'\begin{pmatrix} a & b \\ c & d \end{pmatrix}',
+    r'\text{if } x > 0',
+    r'\left( x_1 + x_2 \right)^2 \quad {-} \alpha',
+    r'\mathbf{v} + \mathrm{d}x + \mathit{abc}',
+]
+
+# Elements whose children are in an inferred <mrow>.
+INFERRED = {'math', 'msqrt', 'mstyle', 'merror', 'mpadded', 'mphantom',
+            'menclose', 'mtd'}
+TOKENS = {'mi', 'mn', 'mo', 'mtext', 'ms'}
+
+def parse(mathml):
+    # Named entities are kept as text, so that any encoding is parsed.
+    mathml = re.sub(r'&([A-Za-z][A-Za-z0-9]*);', r'&amp;\1;', mathml)
+    return ET.fromstring(mathml)
+
+def normalize(e, styled=False):
+    # Tree rendered the same as e, with every <mrow> of one element and
+    # every <mrow> filling an inferred <mrow> removed, and the default
+    # fonts of tokens made explicit.
+    tag = e.tag.split('}')[-1]
+    attrs = dict(e.attrib)
+    children = list(e)
+    while tag in ('mrow', 'mstyle') and not attrs and len(children) == 1:
+        return normalize(children[0], styled)
+    if tag in INFERRED and len(children) == 1 and \
+       children[0].tag.split('}')[-1] == 'mrow' and not children[0].attrib:
+        children = list(children[0])
+    text = (e.text or '').strip(' \t\r\n')
+    if tag in TOKENS and not styled:
+        default = 'normal'
+        if tag == 'mi' and len(text) == 1:
+            default = 'italic'
+        for name in ('mathvariant', 'fontstyle'):
+            if attrs.get(name, default) == default:
+                attrs.pop(name, None)
+    inner = styled or (tag == 'mstyle' and any(
+        k in attrs for k in ('mathvariant', 'fontstyle',
+                             'fontweight', 'fontfamily')))
+    return (tag, sorted(attrs.items()), text if not children else '',
+            [normalize(c, inner) for c in children])
+
+class TestCompact(unittest.TestCase):
+
+    def test_compact_mathml(self):
+        compact = _blahtex.Blahtex.compact_mathml
+        self.assertEqual(
+            compact('<mrow>\n  <mi>x</mi>\n  <mo>+</mo>\n'
+                    '  <mrow><mn>1</mn></mrow>\n</mrow>\n'),
+            '<mi>x</mi><mo>+</mo><mn>1</mn>')
+        self.assertEqual(
+            compact('<msqrt><mrow><mn>3</mn><mi mathvariant="italic">x</mi>'
+                    '</mrow></msqrt><mi mathvariant="normal">sin</mi>'),
+            '<msqrt><mn>3</mn><mi>x</mi></msqrt><mi>sin</mi>')
+        # An <mrow> of an operator is kept, as its spacing may differ.
+        self.assertEqual(compact('<mi>a</mi><mrow><mo>-</mo></mrow>'),
+                         '<mi>a</mi><mrow><mo>-</mo></mrow>')
+        # Fonts are kept under an <mstyle> setting the font.
+        styled = ('<mstyle mathvariant="bold">'
+                  '<mi mathvariant="normal">x</mi></mstyle>')
+        self.assertEqual(compact(styled), styled)
+        # A named entity may be more than one character.
+        self.assertEqual(
+            compact('<mi mathvariant="italic">&alpha;</mi>'
+                    '<mi mathvariant="italic">&#x3B1;</mi>'),
+            '<mi mathvariant="italic">&alpha;</mi><mi>&#x3B1;</mi>')
+        self.assertEqual(compact('<mspace width="1em"></mspace><mrow></mrow>'),
+                         '<mspace width="1em"/><mrow/>')
+        # Anything else is returned as it is.
+        self.assertEqual(compact('<mrow><mi>x</mi>'), '<mrow><mi>x</mi>')
+        for mathml in ('<mrow><mn>1</mn></mrow>', '<msqrt><mi>x</mi></msqrt>'):
+            self.assertEqual(compact(compact(mathml)), compact(mathml))
+
+    def test_equivalent(self):
+        spacings = (Blahtex.SPACING.STRICT, Blahtex.SPACING.MODERATE,
+                    Blahtex.SPACING.RELAXED)
+        encodings = (Blahtex.ENCODING.RAW, Blahtex.ENCODING.NUMERIC,
+                     Blahtex.ENCODING.SHORT, Blahtex.ENCODING.LONG)
+        for spacing, encoding in itertools.product(spacings, encodings):
+            normal = Blahtex(spacing=spacing, mathml_encoding=encoding)
+            compact = Blahtex(spacing=spacing, mathml_encoding=encoding,
+                              compact=True)
+            for latex, display_math in itertools.product(FORMULAS,
+                                                         (False, True)):
+                a = normal.convert(latex, display_math)
+                b = compact.convert(latex, display_math)
+                self.assertLessEqual(len(b), len(a))
+                self.assertNotIn('\n', b)
+                self.assertEqual(normalize(parse(a)), normalize(parse(b)),
+                                 (latex, spacing, encoding))
+
+    def test_options(self):
+        latex = r'\sqrt{x} + \sin y'
+        expected = Blahtex(compact=True).convert(latex)
+        bt = Blahtex(indented=True)
+        self.assertNotEqual(bt.convert(latex), expected)
+        options = BlahtexOptions(indented=True, compact=True)
+        self.assertEqual(bt.convert(latex, options=options), expected)
+        self.assertEqual(bt.convert_bytes(latex, options=options),
+                         expected.encode('utf-8'))
+        self.assertEqual(bt.parse(latex).mathml(options), expected)
+        bt.compact = True
+        self.assertEqual(bt.convert_many([latex]), [expected])
+        bt.process_input(latex)
+        self.assertEqual(bt.get_mathml(), expected)
+        self.assertEqual(bt.get_mathml_bytes(), expected.encode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from blahtex import Blahtex, BlahtexException, canonical_key
+from blahtex.cache import LRUCache, SQLiteCache
+
+FORMULAS = [
+    r'x^2 + y_i = z^{n+1}',
+    r'\frac{a}{b} \cdot \sqrt[3]{x}',
+    r'\alpha\beta + \alpha b',
+    r'\sum_{k=1}^n k^2 = \frac{n(n+1)(2n+1)}{6}',
+    r'\begin{pmatrix} a & b \\ c & d \end{pmatrix}',
+    r'\text{if } x > 0',
+    r'\left( x_1 + x_2 \right)^2',
+    r'12.5 + 3',
+]
+
+def spaced(latex):
+    # Whitespace around operators and scripts, and braces around
+    # one-letter scripts.
+    latex = re.sub(r'([\^_])([A-Za-z0-9])', r'\1{\2}', latex)
+    latex = re.sub(r'([\^_])', r' \1 ', latex)
+    return re.sub(r'\s*([=+&()<>])\s*', r'  \1\n ', latex)
+
+class TestDedup(unittest.TestCase):
+
+    def test_canonical_key(self):
+        self.assertEqual(canonical_key(r'x ^ {2} +  y_{i}'),
+                         canonical_key(r'x^2+y_i'))
+        self.assertEqual(canonical_key(b'x ^ {2}'), canonical_key('x^2'))
+        self.assertNotEqual(canonical_key(r'\alpha b'),
+                            canonical_key(r'\alphab'))
+        self.assertNotEqual(canonical_key('1 2'), canonical_key('12'))
+        self.assertNotEqual(canonical_key(r'\text{a  b}'),
+                            canonical_key(r'\text{a b}'))
+        self.assertNotEqual(canonical_key('x^{23}'), canonical_key('x^23'))
+        for command in ('text', 'mbox', 'hbox', 'textrm', 'textbf', 'textit',
+                        'textsf', 'texttt', 'textnormal', 'textsl', 'textsc',
+                        'textup', 'textmd', 'emph', 'operatorname',
+                        'operatorname*'):
+            self.assertNotEqual(canonical_key('\\%s{a b}' % command),
+                                canonical_key('\\%s{ab}' % command), command)
+        self.assertNotEqual(canonical_key(r'\textcolor{red}{\text{a b}}'),
+                            canonical_key(r'\textcolor{red}{\text{ab}}'))
+        self.assertNotEqual(
+            canonical_key(r'\newcommand{\T}[1]{\text{#1 a}}\T{ b}'),
+            canonical_key(r'\newcommand{\T}[1]{\text{#1a}}\T{b}'))
+        self.assertEqual(canonical_key(r'\frac{a b}{\sqrt[3] {c}}'),
+                         canonical_key(r'\frac{ab}{\sqrt[3]{c}}'))
+        self.assertNotEqual(canonical_key(r'\begin{p matrix}'),
+                            canonical_key(r'\begin{pmatrix}'))
+        for latex in FORMULAS:
+            key = canonical_key(latex)
+            self.assertEqual(canonical_key(key), key)
+
+    def test_same_output(self):
+        bt = Blahtex()
+        same = 0
+        for latex in FORMULAS:
+            variant = spaced(latex)
+            if canonical_key(variant) != canonical_key(latex):
+                continue
+            same += 1
+            for display_math in (False, True):
+                self.assertEqual(bt.convert(variant, display_math),
+                                 bt.convert(latex, display_math))
+            key = canonical_key(latex)
+            self.assertEqual(bt.convert(key), bt.convert(latex))
+        self.assertGreater(same, len(FORMULAS) // 2)
+
+    def test_convert_many(self):
+        bt = Blahtex()
+        self.assertIsNone(bt.dedup_info())
+        bt.set_dedup()
+        items = [r'x ^ {2}', r'x^2', (r'x^2', True), r'\badcommand',
+                 r'\badcommand ', r'y']
+        results = bt.convert_many(items)
+        self.assertIs(results[0], results[1])
+        self.assertIsNot(results[0], results[2])
+        self.assertIsInstance(results[4], BlahtexException)
+        self.assertIs(results[3], results[4])
+        self.assertEqual(results[5], bt.convert('y'))
+        self.assertEqual(tuple(bt.dedup_info()), (6, 4, 1.5))
+        bt.set_cache(LRUCache(16))
+        bt.convert_many(items)
+        bt.convert_many(items)
+        self.assertEqual(bt.dedup_info().items, 12)
+        self.assertEqual(bt.cache_info().hits, 6)
+        self.assertEqual(bt.convert('x^{2}'), results[0])
+        bt.set_dedup(False)
+        self.assertIsNone(bt.dedup_info())
+
+    def test_warm(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            bt = Blahtex()
+            bt.set_dedup()
+            cache = SQLiteCache(os.path.join(tmpdir, 'cache.db'))
+            self.assertEqual(cache.warm(bt, [r'x ^ {2}', r'x^2', 'y']), 2)
+            bt.set_cache(cache)
+            expected = bt.convert(r'x ^ {2}')
+            self.assertEqual(bt.convert_many(['x^{2}', 'y ']),
+                             [expected, Blahtex().convert('y')])
+            info = cache.info()
+            self.assertEqual((info.hits, info.misses), (3, 0))
+            cache.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
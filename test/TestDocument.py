@@ -0,0 +1,63 @@
+import random
+import unittest
+from blahtex import Blahtex
+from blahtex.document import DocumentConverter
+
+DOCUMENT = (r'Price \$5. Inline $x^2$ and \(\alpha\), display $$\frac{1}{2}$$'
+            r' or \[a \$ b\], tag <math>\sqrt{3}</math>, bad $\badcommand$,'
+            r' unclosed $x')
+
+class TestDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.bt = Blahtex()
+        self.converter = DocumentConverter(self.bt)
+
+    def expected(self):
+        c = self.bt.convert
+        return (r'Price \$5. Inline ' + c('x^2') + ' and ' + c(r'\alpha') +
+                ', display ' + c(r'\frac{1}{2}', True) +
+                ' or ' + c(r'a \$ b', True) + ', tag ' + c(r'\sqrt{3}') +
+                r', bad $\badcommand$, unclosed $x')
+
+    def test_string(self):
+        self.assertEqual(self.converter.convert_string(DOCUMENT),
+                         self.expected())
+
+    def test_chunks(self):
+        rand = random.Random(1)
+        for i in range(200):
+            cuts = sorted(rand.sample(range(len(DOCUMENT)), rand.randint(1, 20)))
+            chunks = [DOCUMENT[a:b] for a, b in
+                      zip([0] + cuts, cuts + [len(DOCUMENT)])]
+            self.assertEqual(''.join(self.converter.convert(chunks)),
+                             self.expected())
+        single = [ch for ch in DOCUMENT]
+        self.assertEqual(''.join(self.converter.convert(single)),
+                         self.expected())
+
+    def test_fallback(self):
+        errors = []
+        def fallback(latex, display_math, source, error):
+            errors.append((latex, display_math, error.code))
+            return '<span class="error">{}</span>'.format(source)
+        converter = DocumentConverter(self.bt, fallback=fallback)
+        result = converter.convert_string(r'a $$\badcommand$$ b')
+        self.assertEqual(result, r'a <span class="error">$$\badcommand$$</span> b')
+        self.assertEqual(errors[0][:2], (r'\badcommand', True))
+
+    def test_delimiters(self):
+        converter = DocumentConverter(self.bt, delimiters=['\\(', '$$'])
+        self.assertEqual(converter.convert_string(r'$5 and \(x\)'),
+                         '$5 and ' + self.bt.convert('x'))
+        with self.assertRaises(ValueError):
+            DocumentConverter(self.bt, delimiters=['%'])
+
+    def test_max_math_length(self):
+        converter = DocumentConverter(self.bt, max_math_length=10)
+        text = '$' + 'x' * 100 + '$ y'
+        self.assertEqual(''.join(converter.convert([text[:50], text[50:]])),
+                         text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import random
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.incremental import IncrementalSession
+
+CHARS = 'xyz12+-=& ^_'
+
+def edit(rand, rows):
+    rows = list(rows)
+    op = rand.random()
+    i = rand.randrange(len(rows))
+    if op < 0.4:
+        pos = rand.randint(0, len(rows[i]))
+        rows[i] = rows[i][:pos] + rand.choice(CHARS) + rows[i][pos:]
+    elif op < 0.8 and rows[i]:
+        pos = rand.randrange(len(rows[i]))
+        rows[i] = rows[i][:pos] + rows[i][pos + 1:]
+    elif op < 0.9 or len(rows) == 1:
+        rows.insert(i, 'a &= b')
+    else:
+        del rows[i]
+    return rows
+
+def formula(rows):
+    return r'\begin{aligned}' + r' \\ '.join(rows) + r'\end{aligned}'
+
+def result(func, latex):
+    try:
+        return func(latex)
+    except BlahtexException as e:
+        return e.code
+
+class RowTable(object):
+    # Converter making a table of rows which do not depend on each other,
+    # so that the session joins rows.
+    def __init__(self):
+        self.converted = 0
+
+    def _options_fingerprint(self):
+        return ''
+
+    def convert(self, latex, display_math=False):
+        self.converted += 1
+        body = latex[len(r'\begin{aligned}'):-len(r'\end{aligned}')]
+        return '<math><mtable>{}</mtable></math>'.format('\n'.join(
+            '<mtr><mtd>{}</mtd></mtr>'.format(row.strip())
+            for row in body.split(r'\\')))
+
+    def convert_many(self, items):
+        return [self.convert(latex, d) for latex, d in items]
+
+class SpacedTable(RowTable):
+    # Converter where \strictspacing in any row changes every row.
+    def convert(self, latex, display_math=False):
+        mathml = super().convert(latex, display_math)
+        if r'\strictspacing' in latex:
+            mathml = mathml.replace('<mtd>', '<mtd strict="true">')
+        return mathml
+
+class TestIncremental(unittest.TestCase):
+
+    def check_edits(self, bt, seed, rows, steps=200):
+        rand = random.Random(seed)
+        session = IncrementalSession(bt, display_math=True)
+        for _ in range(steps):
+            rows = edit(rand, rows)
+            latex = formula(rows)
+            self.assertEqual(
+                result(session.convert, latex),
+                result(lambda s: bt.convert(s, True), latex), latex)
+        return session
+
+    def test_random_edits(self):
+        bt = Blahtex()
+        rows = ['x_{%d} &= y^{%d} + z' % (i, i) for i in range(8)]
+        for seed in range(5):
+            self.check_edits(bt, seed, rows)
+
+    def test_joined_rows(self):
+        converter = RowTable()
+        rows = ['x%d &= y + z' % i for i in range(8)]
+        session = self.check_edits(converter, 0, rows)
+        info = session.info()
+        self.assertGreater(info.reused_rows, info.row_conversions)
+
+    def test_options(self):
+        bt = Blahtex()
+        session = IncrementalSession(bt)
+        latex = r'\sqrt{x} + \sin y'
+        first = session.convert(latex)
+        bt.set_options(compact=True)
+        self.assertEqual(session.convert(latex), bt.convert(latex))
+        self.assertNotEqual(session.convert(latex), first)
+
+    def test_global_commands(self):
+        converter = SpacedTable()
+        session = IncrementalSession(converter, display_math=True)
+        rows = ['x%d &= y' % i for i in range(4)]
+        for i in range(3):
+            latex = formula(rows[:i] + ['a &= b'] + rows[i + 1:])
+            session.convert(latex)
+        full = session.info().full_conversions
+        for row in (r'\strictspacing a &= b', r'a \newcommand{\c}{c} &= \c'):
+            latex = formula(rows[:1] + [row] + rows[2:])
+            self.assertEqual(session.convert(latex),
+                             session._convert_whole(latex))
+        self.assertEqual(session.info().full_conversions, full + 4)
+
+    def test_not_split(self):
+        bt = Blahtex()
+        session = IncrementalSession(bt)
+        for latex in (r'x^2', r'\begin{array}{c} a \\ \hline b \end{array}'):
+            self.assertEqual(session.convert(latex), bt.convert(latex))
+        self.assertEqual(session.info().row_conversions, 0)
+        with self.assertRaises(BlahtexException):
+            session.convert(r'\begin{aligned} a \\ \bad \end{aligned}')
+
+if __name__ == '__main__':
+    unittest.main()
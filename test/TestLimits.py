@@ -0,0 +1,88 @@
+import unittest
+from blahtex import (Blahtex, BlahtexException, LimitExceeded, InputTooLong,
+                     TooManyTokens, TooManyMacroExpansions, NestingTooDeep,
+                     TooManyNodes, DeadlineExceeded)
+from blahtex.cache import LRUCache
+
+class TestLimits(unittest.TestCase):
+
+    def test_hierarchy(self):
+        for e in (InputTooLong, TooManyTokens, TooManyMacroExpansions,
+                  NestingTooDeep, TooManyNodes, DeadlineExceeded):
+            self.assertTrue(issubclass(e, LimitExceeded))
+        self.assertTrue(issubclass(LimitExceeded, BlahtexException))
+
+    def test_get_limits(self):
+        bt = Blahtex()
+        self.assertEqual(set(bt.get_limits().values()), {None})
+        bt.set_limits(max_depth=8, deadline=0.5)
+        limits = bt.get_limits()
+        self.assertEqual(limits['max_depth'], 8)
+        self.assertEqual(limits['deadline'], 0.5)
+        self.assertIsNone(limits['max_tokens'])
+        bt.set_limits()
+        self.assertIsNone(bt.get_limits()['max_depth'])
+        with self.assertRaises(ValueError):
+            bt.set_limits(max_tokens=0)
+
+    def test_limits(self):
+        bt = Blahtex()
+        cases = [
+            ({'max_input_length': 10}, 'x' * 11, InputTooLong),
+            ({'max_tokens': 5}, 'a+b+c+d', TooManyTokens),
+            ({'max_macro_expansions': 3},
+             r'\newcommand{\a}{x}\a\a\a\a', TooManyMacroExpansions),
+            ({'max_depth': 3}, '{{{{x}}}}', NestingTooDeep),
+            ({'max_nodes': 1}, r'\frac{1}{2}', TooManyNodes),
+        ]
+        for limits, latex, error in cases:
+            bt.set_limits(**limits)
+            with self.assertRaises(error) as cm:
+                bt.convert(latex)
+            self.assertEqual(cm.exception.code, error.__name__)
+            self.assertEqual(len(cm.exception.arguments), 2)
+            self.assertIsInstance(bt.convert_many([latex])[0], error)
+        bt.set_limits(max_depth=3)
+        results = bt.convert_many(['{{{{x}}}}', 'x'])
+        self.assertIsInstance(results[0], NestingTooDeep)
+        self.assertIsInstance(results[1], str)
+        with self.assertRaises(NestingTooDeep):
+            bt.convert_bytes('{{{{x}}}}')
+        with self.assertRaises(NestingTooDeep):
+            bt.parse('{{{{x}}}}')
+        bt.convert('{{{x}}}')
+
+    def test_deadline(self):
+        bt = Blahtex()
+        bt.set_limits(deadline=1e-9)
+        with self.assertRaises(DeadlineExceeded):
+            bt.convert(r'\sqrt{' * 200 + 'x' + '}' * 200)
+        bt.set_limits(deadline=10.0)
+        bt.convert('x')
+
+    def test_stats(self):
+        bt = Blahtex()
+        records = []
+        bt.enable_stats(records.append)
+        bt.set_limits(max_tokens=2)
+        with self.assertRaises(TooManyTokens):
+            bt.convert('a+b')
+        self.assertEqual(records[0].error, 'TooManyTokens')
+        bt.set_limits(max_input_length=3)
+        results = bt.convert_many(['xxxxxxxx', 'x'])
+        self.assertIsInstance(results[0], InputTooLong)
+        self.assertIsInstance(results[1], str)
+        self.assertEqual(records[-2].error, 'InputTooLong')
+
+    def test_not_cached(self):
+        bt = Blahtex()
+        bt.set_cache(LRUCache(16))
+        bt.set_limits(max_depth=1)
+        with self.assertRaises(NestingTooDeep):
+            bt.convert('{{x}}')
+        self.assertEqual(bt.convert_many(['{{x}}'])[0].code, 'NestingTooDeep')
+        bt.set_limits()
+        bt.convert('{{x}}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.macros import MacroSet, parse_definitions
+
+PREAMBLE = (r'\newcommand{\R}{\mathbb{R}}  % reals' '\n'
+            r'\newcommand\norm[1]{\left\| #1 \right\|}'
+            r'\newcommand{\normR}[1]{\norm{#1}_{\R}}'
+            r'\newcommand{\unused}{\{x\}}')
+
+class TestMacros(unittest.TestCase):
+
+    def test_parse_definitions(self):
+        names = [name for name, _ in parse_definitions(PREAMBLE)]
+        self.assertEqual(names, [r'\R', r'\norm', r'\normR', r'\unused'])
+        with self.assertRaises(ValueError):
+            parse_definitions(r'\newcommand{\a}{x} x^2')
+        with self.assertRaises(ValueError):
+            parse_definitions(r'\newcommand{\a}{x')
+
+    def test_preamble_for(self):
+        macros = MacroSet(PREAMBLE)
+        self.assertEqual(len(macros), 4)
+        self.assertIn(r'\R', macros)
+        self.assertEqual(macros.preamble_for(r'x^2'), '')
+        self.assertEqual(macros.preamble_for(r'\R'),
+                         r'\newcommand{\R}{\mathbb{R}}')
+        preamble = macros.preamble_for(r'\normR{x} + \norm{y}')
+        self.assertEqual(preamble,
+                         r'\newcommand{\R}{\mathbb{R}}'
+                         r'\newcommand\norm[1]{\left\| #1 \right\|}'
+                         r'\newcommand{\normR}[1]{\norm{#1}_{\R}}')
+        with self.assertRaises(AttributeError):
+            macros.x = 1
+
+    def test_convert(self):
+        bt = Blahtex()
+        macros = bt.compile_macros(PREAMBLE)
+        for latex in (r'\normR{x} \in \R', r'x^2'):
+            expected = bt.convert(PREAMBLE + latex)
+            self.assertEqual(bt.convert(latex, macros=macros), expected)
+            self.assertEqual(bt.convert_many([latex], macros=macros),
+                             [expected])
+            self.assertEqual(bt.parse(latex, macros=macros).mathml(),
+                             expected)
+        with self.assertRaises(BlahtexException):
+            bt.compile_macros(r'\newcommand{\bad}{\badcommand}')
+
+if __name__ == '__main__':
+    unittest.main()
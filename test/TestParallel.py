@@ -0,0 +1,34 @@
+import pickle
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.parallel import ConverterPool
+
+class TestParallel(unittest.TestCase):
+
+    def test_pickle(self):
+        bt = Blahtex(spacing=Blahtex.SPACING.STRICT, japanese_font='ipaex.ttf')
+        bt2 = pickle.loads(pickle.dumps(bt))
+        self.assertEqual(bt2.get_options(), bt.get_options())
+        self.assertEqual(bt2.convert(r'\sqrt{3}'), bt.convert(r'\sqrt{3}'))
+
+    def test_imap(self):
+        inputs = [(r'\sqrt{%d}' % i, i % 3 == 0) for i in range(250)]
+        inputs[17] = r'\badcommand'
+        bt = Blahtex(indented=True)
+        expected = bt.convert_many(inputs)
+        with ConverterPool(processes=2, chunksize=16, blahtex=bt) as pool:
+            results = list(pool.imap(iter(inputs)))
+        self.assertEqual(len(results), len(inputs))
+        for i, (r, e) in enumerate(zip(results, expected)):
+            if i == 17:
+                self.assertIsInstance(r, BlahtexException)
+                self.assertEqual(r.code, e.code)
+            else:
+                self.assertEqual(r, e)
+
+    def test_bad_option(self):
+        with self.assertRaises(ValueError):
+            ConverterPool(processes=1, spacing=100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import re
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.preview import preview_document, preview_documents
+
+class TestPreview(unittest.TestCase):
+
+    def setUp(self):
+        self.bt = Blahtex(latex_preamble='\\usepackage{bm}\n')
+        self.items = [('a', r'\sqrt{2}'), ('b', r'x^2', True),
+                      ('bad', r'\badcommand'), ('c', r'\alpha')]
+
+    def test_structure(self):
+        doc = preview_document(self.bt, self.items)
+        tex = doc.tex
+        self.assertEqual(tex.count('\\begin{document}'), 1)
+        self.assertEqual(tex.count('\\end{document}'), 1)
+        self.assertTrue(tex.endswith('\\end{document}\n'))
+        self.assertEqual(tex.count('\\usepackage{bm}'), 1)
+        self.assertEqual(tex.count(']{preview}'), 1)
+        self.assertLess(tex.index('\\usepackage{bm}'),
+                        tex.index('\\begin{document}'))
+        self.assertEqual(tex.count('\\begin{preview}'), 3)
+        self.assertEqual(tex.count('\\end{preview}'), 3)
+        self.assertEqual(list(doc.pages), ['a', 'b', 'c'])
+        self.assertEqual([p.page for p in doc.pages.values()], [1, 2, 3])
+        self.assertIsInstance(doc.errors['bad'], BlahtexException)
+        markers = re.findall(r'\\typeout\{blahtex-marker:(\w+)\}', tex)
+        self.assertEqual(markers, [p.marker for p in doc.pages.values()])
+        # each marker is before the page of its formula
+        for p in doc.pages.values():
+            at = tex.index(p.marker)
+            self.assertEqual(tex.count('\\begin{preview}', 0, at), p.page - 1)
+
+    def test_stable_markers(self):
+        first = preview_document(self.bt, self.items)
+        again = preview_document(self.bt, dict(c=r'\alpha', a=r'\sqrt{2}'))
+        self.assertEqual(first.pages['a'].marker, again.pages['a'].marker)
+        self.assertEqual(first.pages['c'].marker, again.pages['c'].marker)
+        self.assertNotEqual(first.pages['a'].marker, first.pages['c'].marker)
+        same = preview_document(self.bt, [('x', r'\alpha'), ('y', r'\alpha')])
+        self.assertNotEqual(same.pages['x'].marker, same.pages['y'].marker)
+
+    def test_chunks(self):
+        items = [(i, r'x_{%d}' % i) for i in range(10)]
+        docs = list(preview_documents(self.bt, items, max_formulas=4))
+        self.assertEqual([len(d.pages) for d in docs], [4, 4, 2])
+        self.assertEqual(docs[1].pages[5].document, 1)
+        self.assertEqual(docs[1].pages[5].page, 2)
+        for doc in docs:
+            self.assertEqual(doc.tex.count('\\usepackage{bm}'), 1)
+        docs = list(preview_documents(self.bt, items, max_size=20))
+        self.assertEqual(sum(len(d.pages) for d in docs), 10)
+        self.assertGreater(len(docs), 1)
+        with self.assertRaises(ValueError):
+            list(preview_documents(self.bt, items, max_formulas=0))
+
+if __name__ == '__main__':
+    unittest.main()
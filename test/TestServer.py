@@ -0,0 +1,141 @@
+import http.client
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from blahtex import Blahtex
+from blahtex.server import ConversionServer
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ConversionServer(('127.0.0.1', 0), workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def request(self, conn, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        data = response.read()
+        if response.getheader('Content-Type') == 'application/json':
+            data = json.loads(data.decode('utf-8'))
+        return response.status, data
+
+    def test_convert(self):
+        bt = Blahtex()
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            # all of the requests on one connection (keep-alive)
+            status, data = self.request(conn, 'POST', '/convert',
+                                        {'tex': 'x^2', 'display': True})
+            self.assertEqual(status, 200)
+            self.assertEqual(data, {'mathml': bt.convert('x^2', True)})
+            status, data = self.request(conn, 'POST', '/convert',
+                                        {'tex': r'\bad'})
+            self.assertEqual(status, 422)
+            self.assertEqual(data['error']['code'], 'UnrecognisedCommand')
+            status, data = self.request(conn, 'POST', '/convert_many', {
+                'items': ['x', {'id': 7, 'tex': r'\bad'},
+                          {'tex': 'y', 'display': True}]})
+            self.assertEqual(status, 200)
+            results = data['results']
+            self.assertEqual(results[0], {'mathml': bt.convert('x')})
+            self.assertEqual(results[1]['id'], 7)
+            self.assertIn('error', results[1])
+            self.assertEqual(results[2], {'mathml': bt.convert('y', True)})
+            status, data = self.request(conn, 'POST', '/convert', [1])
+            self.assertEqual(status, 400)
+            status, data = self.request(conn, 'GET', '/nowhere')
+            self.assertEqual(status, 404)
+            status, data = self.request(conn, 'GET', '/metrics')
+            self.assertEqual(status, 200)
+        finally:
+            conn.close()
+        text = data.decode('utf-8')
+        self.assertIn('blahtex_requests_total{endpoint="convert",'
+                      'status="200"} 1', text)
+        self.assertIn('blahtex_conversions_total 5', text)
+        self.assertIn('blahtex_conversion_errors_total'
+                      '{code="UnrecognisedCommand"} 2', text)
+        self.assertIn('blahtex_request_seconds_count{endpoint="convert"} 3',
+                      text)
+        self.assertIn('# TYPE blahtex_resident_memory_bytes gauge', text)
+
+    def test_errors(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            status, data = self.request(conn, 'POST', '/convert',
+                                        {'tex': 'x\ud800'})
+            self.assertEqual(status, 400)
+            self.assertEqual(data['error']['code'], 'BadRequest')
+            status, data = self.request(conn, 'POST', '/convert_many',
+                                        {'items': ['x', '\ud800']})
+            self.assertEqual(status, 400)
+            # An unexpected error is a response too.
+            def convert_many(items):
+                raise RuntimeError('broken')
+            self.server.convert_many = convert_many
+            status, data = self.request(conn, 'POST', '/convert',
+                                        {'tex': 'x'})
+            self.assertEqual(status, 500)
+            self.assertEqual(data['error']['message'], 'broken')
+        finally:
+            conn.close()
+        requests = self.server.metrics.as_dict()['requests']
+        self.assertEqual(requests[('convert', 400)], 1)
+        self.assertEqual(requests[('convert_many', 400)], 1)
+        self.assertEqual(requests[('convert', 500)], 1)
+
+    def test_pipelining(self):
+        body = json.dumps({'tex': 'x'}).encode('utf-8')
+        request = (b'POST /convert HTTP/1.1\r\nHost: localhost\r\n'
+                   b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        with socket.create_connection(('127.0.0.1', self.port)) as sock:
+            sock.sendall(request * 3)
+            f = sock.makefile('rb')
+            for _ in range(3):
+                self.assertIn(b' 200 ', f.readline())
+                length = None
+                for line in iter(f.readline, b'\r\n'):
+                    name, value = line.decode().split(':', 1)
+                    if name.lower() == 'content-length':
+                        length = int(value)
+                self.assertEqual(json.loads(f.read(length).decode()),
+                                 {'mathml': Blahtex().convert('x')})
+            f.close()
+
+    @unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'no Unix sockets')
+    def test_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'blahtex.sock')
+        server = ConversionServer(path, workers=1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(path)
+                sock.sendall(b'GET /health HTTP/1.1\r\nHost: x\r\n\r\n')
+                response = http.client.HTTPResponse(sock)
+                response.begin()
+                self.assertEqual(json.loads(response.read().decode()),
+                                 {'status': 'ok'})
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertFalse(os.path.exists(path))
+        os.rmdir(os.path.dirname(path))
+
+if __name__ == '__main__':
+    unittest.main()
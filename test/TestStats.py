@@ -0,0 +1,69 @@
+import unittest
+from blahtex import Blahtex, BlahtexException
+from blahtex.stats import ConversionStats, PipelineStats
+from blahtex import _blahtex
+from blahtex.cache import LRUCache
+
+class TestStats(unittest.TestCase):
+
+    def test_scan_input(self):
+        self.assertEqual(_blahtex.Blahtex.scan_input(r'x^2'), (3, 0, 0, 0))
+        tokens, defs, expansions, depth = _blahtex.Blahtex.scan_input(
+            r'\newcommand{\a}{x}\newcommand{\b}{\a\a}'
+            r'\left( {\b} \right)')
+        self.assertEqual(defs, 2)
+        self.assertEqual(expansions, 3)
+        self.assertEqual(depth, 2)
+
+    def test_disabled(self):
+        bt = Blahtex()
+        self.assertIsNone(bt.get_stats())
+        bt.convert(r'x^2')
+        self.assertIsNone(bt.get_stats())
+
+    def test_convert(self):
+        bt = Blahtex()
+        records = []
+        stats = bt.enable_stats(records.append)
+        self.assertIsInstance(stats, PipelineStats)
+        self.assertIs(bt.get_stats(), stats)
+        mathml = bt.convert(r'\frac{1}{2}')
+        self.assertEqual(len(records), 1)
+        s = records[0]
+        self.assertIsInstance(s, ConversionStats)
+        self.assertEqual(s.input_length, len(r'\frac{1}{2}'))
+        self.assertEqual(s.max_depth, 1)
+        self.assertEqual(s.output_length, len(mathml))
+        self.assertGreater(s.nodes, 0)
+        self.assertIsNone(s.error)
+        self.assertGreaterEqual(s.parse_time, 0.0)
+        with self.assertRaises(BlahtexException):
+            bt.convert(r'\badcommand')
+        self.assertIsNotNone(records[1].error)
+        self.assertEqual(stats.conversions, 2)
+        self.assertEqual(stats.errors, 1)
+
+    def test_convert_many(self):
+        bt = Blahtex()
+        stats = bt.enable_stats()
+        results = bt.convert_many([r'x^2', r'\badcommand', (r'y', True)])
+        self.assertEqual(results[0], Blahtex().convert(r'x^2'))
+        self.assertIsInstance(results[1], BlahtexException)
+        totals = stats.as_dict()
+        self.assertEqual(totals['conversions'], 3)
+        self.assertEqual(totals['errors'], 1)
+        stats.reset()
+        self.assertEqual(stats.conversions, 0)
+        bt.disable_stats()
+        self.assertIsNone(bt.get_stats())
+
+    def test_cache(self):
+        bt = Blahtex()
+        bt.set_cache(LRUCache(16))
+        stats = bt.enable_stats()
+        bt.convert(r'x^2')
+        bt.convert(r'x^2')
+        self.assertEqual(stats.conversions, 1)
+
+if __name__ == '__main__':
+    unittest.main()
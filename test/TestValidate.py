@@ -0,0 +1,58 @@
+import unittest
+from blahtex import Blahtex, ValidationResult, NestingTooDeep
+
+class TestValidate(unittest.TestCase):
+
+    def test_valid(self):
+        bt = Blahtex()
+        result = bt.validate(r'\frac{1}{2}')
+        self.assertIsInstance(result, ValidationResult)
+        self.assertTrue(result.valid)
+        self.assertIsNone(result.code)
+        self.assertEqual(result.arguments, ())
+        self.assertIsNone(result.position)
+
+    def test_invalid(self):
+        bt = Blahtex()
+        result = bt.validate(r'x + \bad')
+        self.assertFalse(result.valid)
+        self.assertEqual(result.code, 'UnrecognisedCommand')
+        self.assertEqual(result.arguments, (r'\bad',))
+        self.assertEqual(result.position, 4)
+        result = bt.validate(b'\\alpha + \\bad')
+        self.assertEqual(result.position, 9)
+
+    def test_unmatched(self):
+        bt = Blahtex()
+        result = bt.validate(r'\frac{1}{')
+        self.assertEqual(result.code, 'UnmatchedOpenBrace')
+        self.assertEqual(result.position, 8)
+        result = bt.validate(r'x}')
+        self.assertEqual(result.code, 'UnmatchedCloseBrace')
+        self.assertEqual(result.position, 1)
+
+    def test_validate_many(self):
+        bt = Blahtex()
+        results = bt.validate_many([r'x^2', (r'\bad', True), r'\sqrt{2}'])
+        self.assertEqual([r.valid for r in results], [True, False, True])
+        self.assertEqual(results[1].position, 0)
+        self.assertEqual(bt.validate_many([]), [])
+
+    def test_macros(self):
+        bt = Blahtex()
+        macros = bt.compile_macros(r'\newcommand{\R}{\mathbb{R}}')
+        self.assertTrue(bt.validate(r'x \in \R', macros=macros).valid)
+        result = bt.validate(r'\R + \bad', macros=macros)
+        self.assertEqual(result.position, 5)
+        results = bt.validate_many([r'\R \bad'], macros=macros)
+        self.assertEqual(results[0].position, 3)
+
+    def test_limits(self):
+        bt = Blahtex()
+        bt.set_limits(max_depth=1)
+        result = bt.validate('{{x}}')
+        self.assertEqual(result.code, NestingTooDeep.__name__)
+        self.assertIsNone(result.position)
+
+if __name__ == '__main__':
+    unittest.main()